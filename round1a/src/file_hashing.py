@@ -0,0 +1,9 @@
+import hashlib
+
+def file_sha256(path):
+    # Read in 1 MiB blocks, so large PDFs are never held in memory
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
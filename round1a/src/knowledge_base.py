@@ -0,0 +1,221 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+import fitz  # PyMuPDF
+from file_hashing import file_sha256
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+# Bump whenever a change to reading or chunking can change the chunks;
+# indexes built under another version are rebuilt from scratch.
+INDEX_VERSION = "1"
+# Indexes are saved under this folder (one subfolder per knowledge base)
+# unless the caller picks an index folder; the KB_INDEX_DIR environment
+# variable, read when an index is opened, overrides it. The knowledge-base
+# folder itself may be read-only.
+DEFAULT_INDEX_ROOT = os.path.join(os.path.expanduser("~"), ".cache", "pdf_kb_index")
+SOURCE_EXTENSIONS = (".pdf", ".txt")
+CHUNK_WORDS = 200
+CHUNK_OVERLAP = 40
+
+_model = None
+_open_indexes = {}
+_lock = threading.Lock()
+
+def get_model():
+    # sentence_transformers (and torch) load on the first embedding only
+    global _model
+    if _model is None:
+        from sentence_transformers import SentenceTransformer
+        _model = SentenceTransformer(MODEL_NAME)
+    return _model
+
+def embed(texts):
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    embeddings = get_model().encode(texts, normalize_embeddings=True, show_progress_bar=False,
+                                    convert_to_numpy=True)
+    return np.asarray(embeddings, dtype=np.float32)
+
+def default_index_dir(kb_dir):
+    # Named after the folder and a hash of its absolute path, so two
+    # knowledge bases with the same folder name never share an index
+    kb_dir = os.path.abspath(kb_dir)
+    key = hashlib.sha1(kb_dir.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(os.environ.get("KB_INDEX_DIR") or DEFAULT_INDEX_ROOT,
+                        f"{os.path.basename(kb_dir)}-{key}")
+
+def list_sources(kb_dir):
+    return sorted(f for f in os.listdir(kb_dir) if f.lower().endswith(SOURCE_EXTENSIONS))
+
+def read_pages(path):
+    """
+    (page_number, text) of every page; a text file is a single page.
+    """
+    if not path.lower().endswith(".pdf"):
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return [(1, f.read())]
+    with fitz.open(path) as doc:
+        return [(page.number + 1, page.get_text()) for page in doc]
+
+def chunk_words(text, size=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    words = text.split()
+    step = max(1, size - overlap)
+    return [" ".join(words[start:start + size]) for start in range(0, max(len(words) - overlap, 1), step)
+            if words[start:start + size]]
+
+def chunk_source(kb_dir, source):
+    return [{"source": source, "page": page_number, "text": text}
+            for page_number, page_text in read_pages(os.path.join(kb_dir, source))
+            for text in chunk_words(page_text)]
+
+def scan_sources(kb_dir, files):
+    """
+    Manifest entries ({"sha256", "size", "mtime_ns"}) for the current files
+    of kb_dir. Hashing is skipped for files whose size and mtime still match
+    the entry in files.
+    """
+    entries = {}
+    for source in list_sources(kb_dir):
+        stat = os.stat(os.path.join(kb_dir, source))
+        entry = files.get(source)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            sha256 = entry["sha256"]
+        else:
+            sha256 = file_sha256(os.path.join(kb_dir, source))
+        entries[source] = {"sha256": sha256, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    return entries
+
+class KnowledgeBase:
+    """
+    Chunk embeddings of every PDF and text file in a knowledge-base folder,
+    persisted in index_dir (default_index_dir(kb_dir) unless given), never
+    inside the folder itself. Opening it again reuses the saved chunks of
+    every file whose SHA-256 is unchanged; only new or changed files are
+    read and embedded.
+    """
+
+    def __init__(self, kb_dir, manifest, chunks, embeddings, index_dir=None):
+        self.kb_dir = kb_dir
+        self.manifest = manifest
+        self.chunks = chunks
+        self.embeddings = embeddings
+        self.index_dir = index_dir or default_index_dir(kb_dir)
+        self.sources = np.array([chunk["source"] for chunk in chunks], dtype=object)
+
+    @classmethod
+    def load(cls, kb_dir, index_dir=None):
+        """
+        The saved index as it is on disk, or None if there is none or it was
+        built by another model or index version.
+        """
+        index_dir = index_dir or default_index_dir(kb_dir)
+        manifest_path = os.path.join(index_dir, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != INDEX_VERSION or manifest.get("model") != MODEL_NAME:
+            return None
+        with open(os.path.join(index_dir, "chunks.json"), "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        embeddings = np.load(os.path.join(index_dir, "embeddings.npy"), mmap_mode="r")
+        return cls(kb_dir, manifest, chunks, embeddings, index_dir)
+
+    @classmethod
+    def open(cls, kb_dir, index_dir=None):
+        """
+        Load the saved index, bringing it up to date with the folder first
+        if any file was added, changed or removed.
+        """
+        index_dir = index_dir or default_index_dir(kb_dir)
+        saved = cls.load(kb_dir, index_dir)
+        files = scan_sources(kb_dir, saved.manifest["files"] if saved else {})
+        if saved is not None and files == saved.manifest["files"]:
+            return saved
+        return cls.update(kb_dir, index_dir, saved, files)
+
+    @classmethod
+    def update(cls, kb_dir, index_dir, saved, files):
+        old_files = saved.manifest["files"] if saved else {}
+        unchanged = {source for source, entry in files.items()
+                     if source in old_files and old_files[source]["sha256"] == entry["sha256"]}
+        keep = [] if saved is None else [i for i, chunk in enumerate(saved.chunks) if chunk["source"] in unchanged]
+        added = [source for source in files if source not in unchanged]
+        new_chunks = [chunk for source in added for chunk in chunk_source(kb_dir, source)]
+        new_embeddings = embed([chunk["text"] for chunk in new_chunks])
+
+        chunks = [saved.chunks[i] for i in keep] + new_chunks
+        parts = [np.asarray(saved.embeddings[keep], dtype=np.float32)] if keep else []
+        if len(new_chunks):
+            parts.append(new_embeddings)
+        embeddings = np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+        manifest = {"version": INDEX_VERSION, "model": MODEL_NAME, "files": files}
+        cls.save(index_dir, manifest, chunks, embeddings)
+        print(f"Indexed {kb_dir} into {index_dir}: {len(added)} of {len(files)} files embedded "
+              f"({len(new_chunks)} chunks), {len(chunks)} chunks in total")
+        return cls.load(kb_dir, index_dir)
+
+    @staticmethod
+    def save(index_dir, manifest, chunks, embeddings):
+        os.makedirs(index_dir, exist_ok=True)
+        # Each file is written aside and swapped in; the manifest goes last,
+        # so an interrupted save is rebuilt on the next open
+        manifest_path = os.path.join(index_dir, "manifest.json")
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        with open(os.path.join(index_dir, "embeddings.npy.tmp"), "wb") as f:
+            np.save(f, embeddings)
+        os.replace(os.path.join(index_dir, "embeddings.npy.tmp"), os.path.join(index_dir, "embeddings.npy"))
+        for name, value in (("chunks.json", chunks), ("manifest.json", manifest)):
+            tmp_path = os.path.join(index_dir, name + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, os.path.join(index_dir, name))
+
+    def is_current(self):
+        # Cheap check for an index kept open between calls: files whose size
+        # and mtime match are not re-hashed
+        return scan_sources(self.kb_dir, self.manifest["files"]) == self.manifest["files"]
+
+    def search(self, query_embeddings, k=3, source=None):
+        """
+        Per query, up to k (score, chunk) hits, best first. source limits
+        the search to the chunks of that one file.
+        """
+        if not len(self.chunks):
+            return [[] for _ in query_embeddings]
+        scores = np.asarray(query_embeddings, dtype=np.float32) @ np.asarray(self.embeddings).T
+        if source is not None:
+            scores[:, self.sources != source] = -np.inf
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in zip(scores, top):
+            order = candidates[np.argsort(-row[candidates], kind="stable")]
+            results.append([(float(row[i]), self.chunks[i]) for i in order if np.isfinite(row[i])])
+        return results
+
+    def retrieve(self, queries, k=3, source=None):
+        """
+        search() for many query strings, embedded in one encode call.
+        """
+        if not self.chunks:
+            return [[] for _ in queries]
+        return self.search(embed(list(queries)), k, source)
+
+def open_knowledge_base(kb_path, index_dir=None):
+    """
+    The KnowledgeBase for kb_path (a folder, or a file in it), kept open
+    for the life of the process and reopened only once its files change.
+    index_dir is where its index is saved (see KnowledgeBase).
+    """
+    kb_dir = kb_path if os.path.isdir(kb_path) else os.path.dirname(kb_path) or "."
+    kb_dir = os.path.abspath(kb_dir)
+    index_dir = os.path.abspath(index_dir or default_index_dir(kb_dir))
+    with _lock:
+        kb = _open_indexes.get((kb_dir, index_dir))
+        if kb is None or not kb.is_current():
+            kb = _open_indexes[(kb_dir, index_dir)] = KnowledgeBase.open(kb_dir, index_dir)
+        return kb
@@ -1,21 +1,39 @@
+import argparse
 import os
-from langchain.chains import RetrievalQA
-from langchain.llms.fake import FakeListLLM  # Offline safe LLM mock
-from vector_store import build_vectorstore
+from knowledge_base import open_knowledge_base
 
-def run_rag(query, kb_path):
-    vectordb = build_vectorstore(kb_path)
-    retriever = vectordb.as_retriever(search_kwargs={"k": 3})
+NO_ANSWER = "No relevant passage found in the knowledge base."
 
-    # Using FakeListLLM to simulate LLM locally (offline)
-    llm = FakeListLLM(responses=["This is a placeholder answer from RAG pipeline."])
-    qa = RetrievalQA.from_chain_type(llm=llm, retriever=retriever)
+def format_answer(hits):
+    if not hits:
+        return NO_ANSWER
+    return "\n\n".join(f"[{chunk['source']}, page {chunk['page']}] {chunk['text']}" for _, chunk in hits)
 
-    result = qa.run(query)
-    return result
+def run_rag(queries, kb_path, k=3, index_dir=None):
+    """
+    Answer a query, or a list of queries in one batch, with the k passages
+    of the knowledge base most similar to each. The knowledge-base index is
+    built once, saved in index_dir (by default a per-folder cache
+    directory) and only updated when the files change (see
+    knowledge_base.py), so each call pays for retrieval only. kb_path is
+    the knowledge-base folder, or one file in it to search only that file.
+    """
+    single = isinstance(queries, str)
+    kb = open_knowledge_base(kb_path, index_dir)
+    source = os.path.basename(kb_path) if os.path.isfile(kb_path) else None
+    hits = kb.retrieve([queries] if single else queries, k=k, source=source)
+    answers = [format_answer(query_hits) for query_hits in hits]
+    return answers[0] if single else answers
 
 if __name__ == "__main__":
-    kb_path = "input/knowledge_base/format_guidelines.txt"
-    query = "What makes a good heading in a PDF?"
-    answer = run_rag(query, kb_path)
-    print("Answer:", answer)
+    parser = argparse.ArgumentParser(description="Answer questions from the knowledge base")
+    parser.add_argument("queries", nargs="*", default=["What makes a good heading in a PDF?"])
+    parser.add_argument("--kb", default="input/knowledge_base", help="Knowledge-base folder (or one file in it)")
+    parser.add_argument("--k", type=int, default=3, help="Passages per answer")
+    parser.add_argument("--index-dir",
+                        help="Where to save the knowledge-base index (default: a folder under $KB_INDEX_DIR or "
+                             "~/.cache/pdf_kb_index)")
+    args = parser.parse_args()
+    for query, answer in zip(args.queries, run_rag(args.queries, args.kb, k=args.k, index_dir=args.index_dir)):
+        print("Question:", query)
+        print("Answer:", answer)
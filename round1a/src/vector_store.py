@@ -2,20 +2,186 @@ import fitz  # PyMuPDF
 import os
 import json
 import re
-from collections import defaultdict
+import argparse
+import hashlib
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import numpy as np
 from PIL import Image
 import io
 import pytesseract
+from file_hashing import file_sha256
 
-def is_table_or_graphics_heavy(blocks):
-    if not blocks:
+# get_text("dict") flags without TEXT_PRESERVE_IMAGES: image blocks (and their
+# binary payloads) are never built, only text spans.
+TEXT_ONLY_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+# Bump whenever a change to the extractor can change its output; incremental
+# runs re-extract every document recorded under a different version.
+EXTRACTOR_VERSION = "2"
+MANIFEST_NAME = ".outline_manifest.json"
+
+# Documents shorter than this are never split across shard workers; the
+# process start-up and re-open cost outweighs the parallel parse.
+SHARD_MIN_PAGES = 64
+# Smallest budget a shard worker is given when the document's budget is
+# nearly spent
+MIN_SHARD_BUDGET_SECONDS = 0.001
+
+# OCR results are cached by image content hash, in memory and on disk, so a
+# logo or scan repeated across pages and documents is recognised only once.
+# The key also covers every setting that changes what tesseract returns.
+OCR_CACHE_DIR = os.environ.get(
+    "OCR_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "pdf_outline_ocr")
+)
+# OCR threads per process; by default the cores are split between the
+# processes extracting at the same time (--workers, --shard-workers)
+OCR_WORKERS = int(os.environ["OCR_WORKERS"]) if os.environ.get("OCR_WORKERS") else None
+OCR_LANG = os.environ.get("OCR_LANG", "eng")
+# Longest image side handed to tesseract; larger scans are downscaled first
+OCR_MAX_SIDE = 2500
+# Bump whenever ocr_image_bytes changes how images are prepared for tesseract
+OCR_PREPROCESS_VERSION = "grayscale-1"
+# Recognised texts kept in memory (least recently used dropped first); the
+# disk cache keeps the rest
+OCR_MEMORY_CACHE_SIZE = 1024
+
+_ocr_memory_cache = OrderedDict()
+_ocr_executor = None
+_ocr_processes = 1
+_ocr_key_prefix = None
+
+class ExtractionBudget:
+    """
+    Wall-clock budget for one document. As the deadline approaches the
+    extractor asks it whether the expensive paths are still affordable, and
+    every cheaper fallback taken is recorded in degradations.
+    Without a budget every check passes and nothing is recorded.
+    """
+    # Fractions of the budget that must remain for each stage to run in full
+    FULL_LAYOUT_RESERVE = 0.5
+    OCR_RESERVE = 0.3
+    FONT_SAMPLE_SHARE = 0.2
+    STOP_RESERVE = 0.05
+
+    def __init__(self, seconds=None, page_seconds=None):
+        self.seconds = seconds
+        self.page_seconds = page_seconds
+        self.start = time.monotonic()
+        self.degradations = []
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def fraction_left(self):
+        if not self.seconds:
+            return 1.0
+        return max(0.0, 1 - self.elapsed() / self.seconds)
+
+    def degrade(self, name):
+        if name not in self.degradations:
+            self.degradations.append(name)
+
+    def fast_layout(self, fast):
+        if not fast and self.fraction_left() < self.FULL_LAYOUT_RESERVE:
+            self.degrade("fast_layout")
+            return True
+        return fast
+
+    def ocr_timeout(self):
+        """
+        Seconds tesseract may spend on a page (0 means no limit), or None
+        when OCR should be skipped altogether.
+        """
+        if not self.seconds and not self.page_seconds:
+            return 0
+        if self.seconds and self.fraction_left() < self.OCR_RESERVE:
+            self.degrade("skip_ocr")
+            return None
+        limits = [self.page_seconds] if self.page_seconds else []
+        if self.seconds:
+            limits.append(self.seconds * (self.fraction_left() - self.OCR_RESERVE))
+        return max(1, int(min(limits)))
+
+    def font_sampling_over(self):
+        if self.seconds and self.elapsed() > self.seconds * self.FONT_SAMPLE_SHARE:
+            self.degrade("sampled_font_stats")
+            return True
+        return False
+
+    def should_stop(self):
+        if self.seconds and self.fraction_left() < self.STOP_RESERVE:
+            self.degrade("truncated_pages")
+            return True
+        return False
+
+    def metadata(self):
+        return {
+            "budget_seconds": self.seconds,
+            "page_budget_seconds": self.page_seconds,
+            "elapsed_seconds": round(self.elapsed(), 3),
+            "degradations": list(self.degradations)
+        }
+
+def get_page_layout(page, fast=True):
+    """
+    Parse a page once with get_text("dict") and keep only what the later
+    stages need: block type counts and one record per non-empty text line.
+
+    In fast mode image blocks are left out of the parse and counted from
+    page.get_image_info() instead, which reports placements without decoding.
+    """
+    if fast:
+        blocks = page.get_text("dict", flags=TEXT_ONLY_FLAGS)["blocks"]
+        num_image = len(page.get_image_info())
+    else:
+        blocks = page.get_text("dict")["blocks"]
+        num_image = 0
+    layout = {
+        "num_blocks": len(blocks) + num_image,
+        "num_text": 0,
+        "num_image": num_image,
+        "num_vector": 0,
+        "lines": []
+    }
+    for block in blocks:
+        block_type = block.get("type")
+        if block_type == 0:
+            layout["num_text"] += 1
+        elif block_type == 1:
+            layout["num_image"] += 1
+        elif block_type == 2:
+            layout["num_vector"] += 1
+        if "lines" not in block:
+            continue
+        for line in block["lines"]:
+            text = ""
+            size = None
+            for span in line["spans"]:
+                span_text = span.get("text", "").strip()
+                if not span_text:
+                    continue
+                if size is None:
+                    size = round(span["size"], 1)
+                text += " " + span_text
+            text = text.strip()
+            if text:
+                layout["lines"].append({
+                    "text": text,
+                    "raw_text": "".join(span["text"] for span in line["spans"]).strip(),
+                    "size": size,
+                    "y0": line.get("bbox", [0, 0, 0, 0])[1]
+                })
+    return layout
+
+def is_table_or_graphics_heavy(layout):
+    num_blocks = layout["num_blocks"]
+    if not num_blocks:
         return False
-    num_blocks = len(blocks)
-    num_text = sum(1 for b in blocks if b.get("type") == 0)
-    num_image = sum(1 for b in blocks if b.get("type") == 1)
-    num_vector = sum(1 for b in blocks if b.get("type") == 2)
-    text_ratio = num_text / num_blocks if num_blocks else 0
-    graphics_ratio = (num_image + num_vector) / num_blocks if num_blocks else 0
+    text_ratio = layout["num_text"] / num_blocks
+    graphics_ratio = (layout["num_image"] + layout["num_vector"]) / num_blocks
     if text_ratio < 0.3 or graphics_ratio > 0.3:
         return True
     return False
@@ -55,50 +221,115 @@ def clean_heading_text(text):
         text += " "
     return text
 
-def extract_text_with_ocr(page):
-    ocr_texts = []
-    for img_index, img in enumerate(page.get_images(full=True)):
+def init_ocr_worker(processes):
+    # Process pool initializer: this process is one of processes running OCR at once
+    global _ocr_processes
+    _ocr_processes = processes
+
+def _get_ocr_executor():
+    # tesseract runs as a subprocess, so threads are enough to use every core
+    global _ocr_executor
+    if _ocr_executor is None:
+        workers = OCR_WORKERS or max(1, (os.cpu_count() or 1) // _ocr_processes)
+        _ocr_executor = ThreadPoolExecutor(max_workers=workers)
+    return _ocr_executor
+
+def ocr_cache_key(image_bytes):
+    global _ocr_key_prefix
+    if _ocr_key_prefix is None:
+        try:
+            version = str(pytesseract.get_tesseract_version())
+        except pytesseract.TesseractNotFoundError:
+            version = "unknown"
+        _ocr_key_prefix = f"tesseract {version}|{OCR_LANG}|{OCR_MAX_SIDE}|{OCR_PREPROCESS_VERSION}|".encode("utf-8")
+    return hashlib.sha1(_ocr_key_prefix + image_bytes).hexdigest()
+
+def remember_ocr(image_hash, text):
+    _ocr_memory_cache[image_hash] = text
+    _ocr_memory_cache.move_to_end(image_hash)
+    while len(_ocr_memory_cache) > OCR_MEMORY_CACHE_SIZE:
+        _ocr_memory_cache.popitem(last=False)
+
+def load_cached_ocr(image_hash):
+    if image_hash in _ocr_memory_cache:
+        _ocr_memory_cache.move_to_end(image_hash)
+        return _ocr_memory_cache[image_hash]
+    if not OCR_CACHE_DIR:
+        return None
+    cache_path = os.path.join(OCR_CACHE_DIR, image_hash + ".txt")
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    remember_ocr(image_hash, text)
+    return text
+
+def store_cached_ocr(image_hash, text):
+    remember_ocr(image_hash, text)
+    if not OCR_CACHE_DIR:
+        return
+    os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+    cache_path = os.path.join(OCR_CACHE_DIR, image_hash + ".txt")
+    # Write then rename so concurrent batch workers never see a partial file
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, cache_path)
+
+def ocr_image_bytes(image_bytes, timeout=0):
+    image = Image.open(io.BytesIO(image_bytes)).convert('L')
+    if max(image.size) > OCR_MAX_SIDE:
+        image.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE))
+    return pytesseract.image_to_string(image, lang=OCR_LANG, timeout=timeout).strip()
+
+def submit_page_ocr(page, timeout=0, in_flight=None):
+    """
+    Start OCR of the page's images that aren't cached yet, without waiting
+    for it; collect_page_ocr returns the text. Pages sharing an in_flight
+    dict (image hash -> future) submit an image repeated across them once.
+    """
+    doc = page.parent
+    in_flight = {} if in_flight is None else in_flight
+    image_hashes = []
+    for img in page.get_images(full=True):
         xref = img[0]
-        base_image = page.extract_image(xref)
+        base_image = doc.extract_image(xref)
         image_bytes = base_image['image']
-        image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-        try:
-            text = pytesseract.image_to_string(image)
-            if text.strip():
-                ocr_texts.append(text.strip())
-        except Exception as e:
-            print(f"Warning: OCR failed on image {img_index} of page {page.number+1}: {e}")
+        image_hash = ocr_cache_key(image_bytes)
+        image_hashes.append(image_hash)
+        if image_hash in in_flight or load_cached_ocr(image_hash) is not None:
+            continue
+        in_flight[image_hash] = _get_ocr_executor().submit(ocr_image_bytes, image_bytes, timeout)
+    return page.number, image_hashes, in_flight
+
+def collect_page_ocr(submitted):
+    page_number, image_hashes, in_flight = submitted
+    ocr_texts = []
+    for image_hash in image_hashes:
+        future = in_flight.pop(image_hash, None)
+        if future is not None:
+            try:
+                store_cached_ocr(image_hash, future.result())
+            except Exception as e:
+                print(f"Warning: OCR failed on an image of page {page_number+1}: {e}")
+        text = load_cached_ocr(image_hash)
+        if text:
+            ocr_texts.append(text)
     return "\n".join(ocr_texts)
 
-def extract_title(doc, pdf_path):
+def extract_text_with_ocr(page, timeout=0):
+    return collect_page_ocr(submit_page_ocr(page, timeout))
+
+def extract_title(doc, pdf_path, layout=None, fast_layout=True, budget=None):
     page = doc[0]
-    blocks = page.get_text("dict")["blocks"]
-    lines = []
-    font_sizes = defaultdict(int)
-    for block in blocks:
-        if "lines" not in block:
-            continue
-        for line in block["lines"]:
-            text = ""
-            size = None
-            for span in line["spans"]:
-                span_text = span.get("text", "").strip()
-                if not span_text:
-                    continue
-                if size is None:
-                    size = round(span["size"], 1)
-                text += " " + span_text
-            text = text.strip()
-            if text:
-                lines.append({
-                    "text": text,
-                    "size": size,
-                    "y0": line.get("bbox", [0, 0, 0, 0])[1]
-                })
-                font_sizes[size] += 1
+    budget = budget or ExtractionBudget()
+    if layout is None:
+        layout = get_page_layout(page, fast=fast_layout)
+    lines = layout["lines"]
 
     if not lines:
-        ocr_text = extract_text_with_ocr(page)
+        ocr_timeout = budget.ocr_timeout()
+        ocr_text = extract_text_with_ocr(page, ocr_timeout) if ocr_timeout is not None else ""
         if ocr_text:
             first_line = ocr_text.split('\n')[0]
             if len(first_line) > 0:
@@ -116,133 +347,557 @@ def extract_title(doc, pdf_path):
 
     return os.path.splitext(os.path.basename(pdf_path))[0]
 
-def extract_outline_and_title(pdf_path):
+def graphics_heavy_result(doc, pdf_path, first_page_layout, budget=None):
+    title = extract_title(doc, pdf_path, first_page_layout, budget=budget)
+    # Check for headline text to be put in outline if title is empty or very short
+    headline = None
+    # Get largest font text on first page for headline
+    all_lines = [
+        {"text": line["raw_text"], "size": line["size"]}
+        for line in first_page_layout["lines"]
+    ]
+    if all_lines:
+        max_size = max(l["size"] for l in all_lines)
+        max_lines = [l["text"] for l in all_lines if abs(l["size"] - max_size) < 0.5]
+        if max_lines and (not title or len(title.strip()) < 5):
+            headline = max_lines[0]
+    if headline:
+        return {
+            "title": "",
+            "outline": [{
+                "level": "H1",
+                "text": headline + " ",
+                "page": 0
+            }]
+        }
+    else:
+        return {"title": title, "outline": []}
+
+def extract_outline_and_title(pdf_path, fast_layout=True, budget_seconds=None, page_budget_seconds=None,
+                              shard_workers=1):
+    """
+    With budget_seconds (and optionally page_budget_seconds) the extraction
+    degrades gracefully instead of overrunning, and the result gains a
+    "metadata" entry listing the degradations that were applied.
+
+    With shard_workers > 1, documents of at least SHARD_MIN_PAGES pages have
+    their page range split across that many processes; the output is the
+    same as the serial extraction.
+    """
+    budget = ExtractionBudget(budget_seconds, page_budget_seconds)
     doc = fitz.open(pdf_path)
-    first_page_blocks = doc[0].get_text("dict")["blocks"]
-    
+    # Every page is parsed exactly once; page 0 is shared by title detection,
+    # the graphics check and the main loop.
+    first_page_layout = get_page_layout(doc[0], fast=fast_layout)
+
     # Detect if document is table/image heavy -> only extract title, no outline
-    if is_table_or_graphics_heavy(first_page_blocks):
-        title = extract_title(doc, pdf_path)
-        # Check for headline text to be put in outline if title is empty or very short
-        headline = None
-        # Get largest font text on first page for headline
-        all_lines = []
-        for line in doc[0].get_text("dict")["blocks"]:
-            if "lines" not in line:
-                continue
-            for ln in line["lines"]:
-                txt = "".join([span["text"] for span in ln["spans"]]).strip()
-                size = round(ln["lines"][0]["spans"][0]["size"], 1) if ln["lines"][0]["spans"] else 0
-                if txt:
-                    all_lines.append({"text": txt, "size": size})
-        if all_lines:
-            max_size = max(l["size"] for l in all_lines)
-            max_lines = [l["text"] for l in all_lines if abs(l["size"] - max_size) < 0.5]
-            if max_lines and (not title or len(title.strip()) < 5):
-                headline = max_lines[0]
-        if headline:
-            return {
-                "title": "",
-                "outline": [{
-                    "level": "H1",
-                    "text": headline + " ",
-                    "page": 0
-                }]
-            }
+    if is_table_or_graphics_heavy(first_page_layout):
+        result = graphics_heavy_result(doc, pdf_path, first_page_layout, budget)
+    else:
+        if shard_workers > 1 and len(doc) >= SHARD_MIN_PAGES:
+            table = build_span_table_sharded(doc, pdf_path, first_page_layout, fast_layout, budget, shard_workers)
         else:
-            return {"title": title, "outline": []}
+            table = build_span_table(doc, first_page_layout, fast_layout, budget)
+        title = extract_title(doc, pdf_path, first_page_layout, budget=budget)
+        font_to_level = assign_font_levels(table)
+        outline = select_outline(table, font_to_level)
+        result = {"title": title.strip(), "outline": outline}
 
-    lines = []
-    font_sizes = defaultdict(int)
-    for page_idx, page in enumerate(doc):
-        blocks = page.get_text("dict")["blocks"]
-        if not blocks:
+    if budget_seconds or page_budget_seconds:
+        result["metadata"] = budget.metadata()
+    return result
+
+# Bits of the span table "flags" column
+SPAN_OCR = 1  # OCR fallback text; not counted in the font-size histogram
+
+def build_span_table(doc, first_page_layout=None, fast_layout=True, budget=None, page_range=None):
+    """
+    Collect every text line of the document (or of page_range) into a
+    columnar table: compact size/page/y0/flags arrays plus a text_id column
+    into an interned pool of distinct line texts.
+
+    Pages with images but no text are OCR'd; every such page is submitted
+    before any result is awaited, so tesseract runs on all of them at once.
+    """
+    sizes = array("d")
+    pages = array("i")
+    y0s = array("f")
+    flags = array("B")
+    text_ids = array("i")
+    texts = []
+    text_index = {}
+
+    def add_line(text, size, page, y0, flag=0):
+        text_id = text_index.get(text)
+        if text_id is None:
+            text_id = text_index[text] = len(texts)
+            texts.append(text)
+        sizes.append(size)
+        pages.append(page)
+        y0s.append(y0)
+        flags.append(flag)
+        text_ids.append(text_id)
+
+    budget = budget or ExtractionBudget()
+    # Each page's lines, or its pending OCR, in page order
+    page_entries = []
+    in_flight = {}
+    for page_idx in page_range if page_range is not None else range(len(doc)):
+        page = doc[page_idx]
+        if page_idx == 0 and first_page_layout is not None:
+            layout = first_page_layout
+        else:
+            if budget.should_stop():
+                break
+            layout = get_page_layout(page, fast=budget.fast_layout(fast_layout))
+        if not layout["lines"] and layout["num_image"]:
             # OCR fallback for image-only pages
-            ocr_text = extract_text_with_ocr(page)
+            ocr_timeout = budget.ocr_timeout()
+            if ocr_timeout is not None:
+                page_entries.append((page_idx, submit_page_ocr(page, ocr_timeout, in_flight)))
+            continue
+        page_entries.append((page_idx, layout["lines"]))
+
+    for page_idx, entry in page_entries:
+        if isinstance(entry, tuple):
+            ocr_text = collect_page_ocr(entry)
             if ocr_text:
-                lines.append({
-                    "text": ocr_text,
-                    "size": 10,
-                    "page": page_idx + 1,
-                    "y0": 0
-                })
+                add_line(ocr_text, 10, page_idx + 1, 0, SPAN_OCR)
             continue
-        for block in blocks:
-            if "lines" not in block:
-                continue
-            for line in block["lines"]:
-                text = ""
-                size = None
-                for span in line["spans"]:
-                    span_text = span.get("text", "").strip()
-                    if not span_text:
-                        continue
-                    if size is None:
-                        size = round(span["size"], 1)
-                    text += " " + span_text
-                text = text.strip()
-                if text:
-                    lines.append({
-                        "text": text,
-                        "size": size,
-                        "page": page_idx + 1,
-                        "y0": line.get("bbox", [0, 0, 0, 0])[1]
-                    })
-                    font_sizes[size] += 1
-
-    title = extract_title(doc, pdf_path)
-    sorted_fonts = sorted(font_sizes.items(), key=lambda x: -x[0])
+        for line in entry:
+            add_line(line["text"], line["size"], page_idx + 1, line["y0"])
+
+    return {
+        "size": np.frombuffer(sizes, dtype=np.float64),
+        "page": np.frombuffer(pages, dtype=np.int32),
+        "y0": np.frombuffer(y0s, dtype=np.float32),
+        "flags": np.frombuffer(flags, dtype=np.uint8),
+        "text_id": np.frombuffer(text_ids, dtype=np.int32),
+        "texts": texts
+    }
+
+def _build_shard_table(pdf_path, start, stop, fast_layout, budget_seconds, page_budget_seconds):
+    # Each shard worker opens the document itself; fitz documents can't be
+    # shared between processes.
+    budget = ExtractionBudget(budget_seconds, page_budget_seconds)
+    with fitz.open(pdf_path) as doc:
+        table = build_span_table(doc, None, fast_layout, budget, range(start, stop))
+    return table, budget.degradations
+
+def build_span_table_sharded(doc, pdf_path, first_page_layout, fast_layout, budget, shard_workers):
+    """
+    build_span_table over contiguous page ranges in parallel. Page 0 reuses
+    the layout already parsed here; the shards are merged back in page
+    order, so the font histogram and first-occurrence dedupe match the
+    serial table.
+    """
+    tables = [build_span_table(doc, first_page_layout, fast_layout, budget, range(0, 1))]
+    if len(doc) > 1 and budget.should_stop():
+        # The serial loop would stop before page 1 too
+        return merge_span_tables(tables)
+    bounds = np.linspace(1, len(doc), shard_workers + 1).astype(int).tolist()
+    # Never hand the shards a budget of 0, which ExtractionBudget reads as no limit
+    remaining = max(budget.seconds * budget.fraction_left(), MIN_SHARD_BUDGET_SECONDS) if budget.seconds else None
+    with ProcessPoolExecutor(max_workers=shard_workers, initializer=init_ocr_worker,
+                             initargs=(_ocr_processes * shard_workers,)) as executor:
+        futures = [
+            executor.submit(_build_shard_table, pdf_path, start, stop, fast_layout, remaining, budget.page_seconds)
+            for start, stop in zip(bounds, bounds[1:]) if stop > start
+        ]
+        for future in futures:
+            table, degradations = future.result()
+            tables.append(table)
+            for name in degradations:
+                budget.degrade(name)
+    return merge_span_tables(tables)
+
+def merge_span_tables(tables):
+    # Concatenate the columns and re-intern every shard's text pool into one
+    texts = []
+    text_index = {}
+    text_ids = []
+    for table in tables:
+        remap = np.empty(len(table["texts"]), dtype=np.int32)
+        for old_id, text in enumerate(table["texts"]):
+            new_id = text_index.get(text)
+            if new_id is None:
+                new_id = text_index[text] = len(texts)
+                texts.append(text)
+            remap[old_id] = new_id
+        text_ids.append(remap[table["text_id"]])
+    merged = {
+        column: np.concatenate([table[column] for table in tables])
+        for column in ("size", "page", "y0", "flags")
+    }
+    merged["text_id"] = np.concatenate(text_ids)
+    merged["texts"] = texts
+    return merged
+
+def assign_font_levels(table, levels=("H1", "H2", "H3")):
+    # Histogram of font sizes over real text lines, largest size first;
+    # sizes within 0.5pt of an already assigned size don't get a level.
+    counted = table["size"][(table["flags"] & SPAN_OCR) == 0]
+    return font_levels_from_sizes(np.unique(counted)[::-1].tolist(), levels)
+
+def font_levels_from_sizes(sizes, levels=("H1", "H2", "H3")):
+    # sizes must be distinct and sorted largest first
     font_to_level = {}
-    levels = ["H1", "H2", "H3"]
     sizes_assigned = []
-    for size, _ in sorted_fonts:
+    for size in sizes:
         if len(sizes_assigned) >= len(levels):
             break
         if all(abs(size - assigned) > 0.5 for assigned in sizes_assigned):
             font_to_level[size] = levels[len(sizes_assigned)]
             sizes_assigned.append(size)
+    return font_to_level
+
+def select_outline(table, font_to_level):
+    """
+    Pick outline entries from the span table. Level lookup and the text
+    filters run once per distinct text and are broadcast over the rows;
+    repeated headings keep only their first occurrence.
+    """
+    level_names = list(font_to_level.values())
+    level_idx = np.full(len(table["size"]), -1, dtype=np.int8)
+    for i, size in enumerate(font_to_level):
+        level_idx[table["size"] == size] = i
+
+    # Clean each distinct text once and intern the cleaned forms, since
+    # different raw texts can collapse to the same heading
+    cleaned_texts = []
+    cleaned_index = {}
+    pool_to_cleaned = np.empty(len(table["texts"]), dtype=np.int32)
+    for text_id, text in enumerate(table["texts"]):
+        cleaned = clean_heading_text(text)
+        cleaned_id = cleaned_index.get(cleaned)
+        if cleaned_id is None:
+            cleaned_id = cleaned_index[cleaned] = len(cleaned_texts)
+            cleaned_texts.append(cleaned)
+        pool_to_cleaned[text_id] = cleaned_id
+    keep_cleaned = np.array([
+        is_meaningful_heading(text) and not is_possible_table_line(text, None)
+        for text in cleaned_texts
+    ], dtype=bool)
+
+    row_cleaned = pool_to_cleaned[table["text_id"]]
+    candidates = np.flatnonzero((level_idx >= 0) & keep_cleaned[row_cleaned])
+    _, first = np.unique(row_cleaned[candidates], return_index=True)
+    rows = candidates[np.sort(first)]
+
+    return [
+        {
+            "level": level_names[level_idx[row]],
+            "text": cleaned_texts[row_cleaned[row]],
+            "page": int(table["page"][row])
+        }
+        for row in rows.tolist()
+    ]
+
+def iter_outline_records(pdf_path, fast_layout=True, font_sample_pages=None,
+                         budget_seconds=None, page_budget_seconds=None):
+    """
+    Streaming variant of extract_outline_and_title. Yields a title record and
+    then one record per heading as soon as it is found, holding only one page
+    of lines in memory.
+
+    A first pass collects the set of font sizes. By default it covers every
+    page, so the levels match extract_outline_and_title exactly; with
+    font_sample_pages only that many leading pages are sampled, trading
+    exactness for a bounded first pass. Under a time budget the first pass
+    also stops once it has used its share of the budget, and a final
+    {"document", "metadata"} record reports the degradations applied.
+    """
+    document = os.path.basename(pdf_path)
+    budget = ExtractionBudget(budget_seconds, page_budget_seconds)
+    with fitz.open(pdf_path) as doc:
+        first_page_layout = get_page_layout(doc[0], fast=fast_layout)
+        if is_table_or_graphics_heavy(first_page_layout):
+            result = graphics_heavy_result(doc, pdf_path, first_page_layout, budget)
+            yield {"document": document, "title": result["title"]}
+            for entry in result["outline"]:
+                yield dict(entry, document=document)
+        else:
+            yield from _iter_heading_records(doc, pdf_path, document, first_page_layout,
+                                             fast_layout, font_sample_pages, budget)
+    if budget_seconds or page_budget_seconds:
+        yield {"document": document, "metadata": budget.metadata()}
+
+def _iter_heading_records(doc, pdf_path, document, first_page_layout, fast_layout, font_sample_pages, budget):
+    yield {"document": document, "title": extract_title(doc, pdf_path, first_page_layout, budget=budget).strip()}
+
+    sample_count = len(doc) if font_sample_pages is None else min(font_sample_pages, len(doc))
+    font_sizes = set(line["size"] for line in first_page_layout["lines"])
+    for page_idx in range(1, sample_count):
+        if budget.font_sampling_over():
+            break
+        layout = get_page_layout(doc[page_idx], fast=budget.fast_layout(fast_layout))
+        font_sizes.update(line["size"] for line in layout["lines"])
+    font_to_level = font_levels_from_sizes(sorted(font_sizes, reverse=True))
 
-    outline = []
     added_texts = set()
-    for line in lines:
-        text = clean_heading_text(line["text"])
-        page = line["page"]
-        size = line["size"]
-        level = font_to_level.get(size)
-        if not level:
-            continue
-        if not is_meaningful_heading(text):
-            continue
-        if is_possible_table_line(text, level):
-            continue
-        if text in added_texts:
-            continue
-        added_texts.add(text)
-        outline.append({
-            "level": level,
-            "text": text,
-            "page": page
-        })
+    for page_idx, page in enumerate(doc):
+        if page_idx == 0:
+            layout = first_page_layout
+        else:
+            if budget.should_stop():
+                break
+            layout = get_page_layout(page, fast=budget.fast_layout(fast_layout))
+        if not layout["num_blocks"]:
+            # OCR fallback for image-only pages
+            ocr_timeout = budget.ocr_timeout()
+            ocr_text = extract_text_with_ocr(page, ocr_timeout) if ocr_timeout is not None else ""
+            page_lines = [{"text": ocr_text, "size": 10}] if ocr_text else []
+        else:
+            page_lines = layout["lines"]
+        for line in page_lines:
+            level = font_to_level.get(line["size"])
+            if not level:
+                continue
+            text = clean_heading_text(line["text"])
+            if not is_meaningful_heading(text) or is_possible_table_line(text, level):
+                continue
+            if text in added_texts:
+                continue
+            added_texts.add(text)
+            yield {"document": document, "level": level, "text": text, "page": page_idx + 1}
 
-    return {"title": title.strip(), "outline": outline}
+def stream_outline_to_ndjson(pdf_path, output_path, fast_layout=True, font_sample_pages=None,
+                             budget_seconds=None, page_budget_seconds=None):
+    count = 0
+    with open(output_path, "w", encoding="utf-8") as f:
+        for record in iter_outline_records(pdf_path, fast_layout, font_sample_pages,
+                                           budget_seconds, page_budget_seconds):
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            count += 1
+    return count
 
-def process_all_pdfs(input_dir, output_dir):
-    os.makedirs(output_dir, exist_ok=True)
-    pdf_files = sorted([f for f in os.listdir(input_dir) if f.lower().endswith('.pdf')])
+def output_name(pdf_file, stream=False):
+    return os.path.splitext(pdf_file)[0] + (".ndjson" if stream else ".json")
+
+def extract_to_file(pdf_path, output_path, stream=False, font_sample_pages=None,
+                    budget_seconds=None, page_budget_seconds=None, shard_workers=1, fast_layout=True):
+    # Runs inside pool workers too, so results never travel back through IPC
+    if stream:
+        stream_outline_to_ndjson(pdf_path, output_path, fast_layout=fast_layout,
+                                 font_sample_pages=font_sample_pages,
+                                 budget_seconds=budget_seconds, page_budget_seconds=page_budget_seconds)
+    else:
+        result = extract_outline_and_title(pdf_path, fast_layout=fast_layout, budget_seconds=budget_seconds,
+                                           page_budget_seconds=page_budget_seconds,
+                                           shard_workers=shard_workers)
+        save_result(result, output_path)
+
+def append_to_combined(output_path, combined):
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            combined.write(line)
+    combined.flush()
+
+def save_result(result, output_path):
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=4, ensure_ascii=False)
+
+def process_pdfs_parallel(input_dir, output_dir, pdf_files, workers, options=None, combined=None):
+    """
+    Spread extraction over a process pool. Each worker writes its own output
+    file; documents are reported in completion order and output names match
+    the serial path.
+    """
+    options = options or {}
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_ocr_worker, initargs=(workers,)) as executor:
+        futures = {}
+        for pdf_file in pdf_files:
+            output_path = os.path.join(output_dir, output_name(pdf_file, options.get("stream", False)))
+            future = executor.submit(extract_to_file, os.path.join(input_dir, pdf_file), output_path, **options)
+            futures[future] = (pdf_file, output_path)
+        for future in as_completed(futures):
+            pdf_file, output_path = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Failed {pdf_file}: {e}")
+                failed.append(pdf_file)
+                continue
+            if combined is not None:
+                append_to_combined(output_path, combined)
+            print(f"Saved {os.path.basename(output_path)}")
+    return sorted(failed)
+
+def process_pdfs_serial(input_dir, output_dir, pdf_files, options=None, combined=None):
+    options = options or {}
+    failed = []
     for pdf_file in pdf_files:
         print(f"Processing {pdf_file}")
         pdf_path = os.path.join(input_dir, pdf_file)
-        result = extract_outline_and_title(pdf_path)
-        output_filename = os.path.splitext(pdf_file)[0] + ".json"
-        output_path = os.path.join(output_dir, output_filename)
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(result, f, indent=4, ensure_ascii=False)
-        print(f"Saved {output_filename}")
+        output_path = os.path.join(output_dir, output_name(pdf_file, options.get("stream", False)))
+        try:
+            extract_to_file(pdf_path, output_path, **options)
+        except Exception as e:
+            print(f"Failed {pdf_file}: {e}")
+            failed.append(pdf_file)
+            continue
+        if combined is not None:
+            append_to_combined(output_path, combined)
+        print(f"Saved {os.path.basename(output_path)}")
+    return failed
 
-if __name__ == "__main__":
-    import sys
-    if len(sys.argv) == 3:
-        process_all_pdfs(sys.argv[1], sys.argv[2])
+def load_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(output_dir, manifest):
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def output_degraded(output_path):
+    # Whether a budgeted extraction had to cut corners (see ExtractionBudget)
+    with open(output_path, "r", encoding="utf-8") as f:
+        if output_path.endswith(".ndjson"):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            records = [json.load(f)]
+    return any(record.get("metadata", {}).get("degradations") for record in records)
+
+def plan_incremental_run(input_dir, output_dir, pdf_files, manifest, stream=False, font_sample_pages=None,
+                         full_layout=False):
+    """
+    Compare the input folder against the manifest. Returns the files that
+    need extracting and their fresh manifest entries, and deletes outputs
+    whose source PDF is gone or that the other mode wrote (.json in stream
+    mode, .ndjson otherwise). Hashing is skipped for files whose size and
+    mtime still match what was recorded. Outputs built from a sample of the
+    pages are only current for the same font_sample_pages, and outputs of a
+    full layout parse only for full_layout.
+    """
+    to_process = []
+    entries = {}
+    for pdf_file in pdf_files:
+        stat = os.stat(os.path.join(input_dir, pdf_file))
+        entry = manifest.get(pdf_file)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            sha256 = entry["sha256"]
+        else:
+            sha256 = file_sha256(os.path.join(input_dir, pdf_file))
+        output_filename = output_name(pdf_file, stream)
+        entries[pdf_file] = {
+            "sha256": sha256,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "version": EXTRACTOR_VERSION,
+            "font_sample_pages": font_sample_pages,
+            "full_layout": full_layout,
+            "output": output_filename
+        }
+        if (entry is None or entry["sha256"] != sha256
+                or entry["version"] != EXTRACTOR_VERSION
+                or entry.get("font_sample_pages") != font_sample_pages
+                or entry.get("full_layout", False) != full_layout
+                or not os.path.exists(os.path.join(output_dir, output_filename))):
+            to_process.append(pdf_file)
+        other_path = os.path.join(output_dir, output_name(pdf_file, not stream))
+        if os.path.exists(other_path):
+            os.remove(other_path)
+            print(f"Removed {os.path.basename(other_path)} (replaced by {output_filename})")
+
+    for pdf_file, entry in manifest.items():
+        if pdf_file in entries:
+            continue
+        stale_path = os.path.join(output_dir, entry["output"])
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+            print(f"Removed {entry['output']} ({pdf_file} no longer exists)")
+    return to_process, entries
+
+def process_all_pdfs(input_dir, output_dir, workers=1, incremental=False,
+                     stream=False, combined_jsonl=None, font_sample_pages=None,
+                     budget_seconds=None, page_budget_seconds=None, shard_workers=1, full_layout=False):
+    """
+    Extract every PDF in input_dir into output_dir. With stream=True each
+    document is written as NDJSON (<name>.ndjson) while it is processed, and
+    combined_jsonl additionally collects every record of the batch in one file.
+    budget_seconds / page_budget_seconds put each document on a wall-clock
+    budget (see ExtractionBudget). shard_workers splits the pages of each
+    large document across processes (not used in stream mode).
+    full_layout parses pages with their image blocks instead of counting
+    image placements (see get_page_layout); under a budget it falls back to
+    the fast parse once half the budget is spent.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    pdf_files = sorted([f for f in os.listdir(input_dir) if f.lower().endswith('.pdf')])
+    if incremental:
+        manifest = load_manifest(output_dir)
+        to_process, entries = plan_incremental_run(input_dir, output_dir, pdf_files, manifest, stream,
+                                                   font_sample_pages if stream else None, full_layout)
+        print(f"{len(pdf_files) - len(to_process)} of {len(pdf_files)} PDFs unchanged")
     else:
-        # Assume docker run mode
-        process_all_pdfs("input", "output")
+        to_process = pdf_files
+
+    options = {}
+    if stream:
+        options = {"stream": True, "font_sample_pages": font_sample_pages}
+    if budget_seconds or page_budget_seconds:
+        options.update(budget_seconds=budget_seconds, page_budget_seconds=page_budget_seconds)
+    if shard_workers > 1 and not stream:
+        options["shard_workers"] = shard_workers
+    if full_layout:
+        options["fast_layout"] = False
+    combined = open(combined_jsonl, "w", encoding="utf-8") if combined_jsonl else None
+    try:
+        if combined is not None:
+            # Unchanged documents are not re-extracted; their saved records
+            # still belong in the batch file
+            for pdf_file in pdf_files:
+                if pdf_file not in to_process:
+                    append_to_combined(os.path.join(output_dir, output_name(pdf_file, stream)), combined)
+        if workers > 1:
+            failed = process_pdfs_parallel(input_dir, output_dir, to_process, workers, options, combined)
+        else:
+            failed = process_pdfs_serial(input_dir, output_dir, to_process, options, combined)
+    finally:
+        if combined is not None:
+            combined.close()
+
+    if incremental:
+        # Failed documents, and outputs the budget cut short, stay out of the
+        # manifest so the next run retries them
+        for pdf_file in failed:
+            entries.pop(pdf_file)
+        for pdf_file in to_process:
+            if pdf_file in entries and output_degraded(os.path.join(output_dir, entries[pdf_file]["output"])):
+                entries.pop(pdf_file)
+        save_manifest(output_dir, entries)
+    return failed
+
+if __name__ == "__main__":
+    # With no arguments, assume docker run mode
+    parser = argparse.ArgumentParser(description="Extract title and outline from every PDF in a folder")
+    parser.add_argument("input_dir", nargs="?", default="input", help="Input PDF folder")
+    parser.add_argument("output_dir", nargs="?", default="output", help="Output JSON folder")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (default: 1)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Skip PDFs whose content hash and extractor version match the output manifest")
+    parser.add_argument("--stream", action="store_true",
+                        help="Write each outline as compact NDJSON while pages are processed")
+    parser.add_argument("--jsonl", help="Also collect every streamed record of the batch in this JSONL file")
+    parser.add_argument("--font-sample-pages", type=int,
+                        help="Stream mode: build the font-size histogram from only the first N pages")
+    parser.add_argument("--budget", type=float, help="Wall-clock budget in seconds per document")
+    parser.add_argument("--page-budget", type=float, help="Wall-clock budget in seconds for OCR on a single page")
+    parser.add_argument("--shard-workers", type=int, default=1,
+                        help=f"Split the pages of documents with {SHARD_MIN_PAGES}+ pages across N processes")
+    parser.add_argument("--full-layout", action="store_true",
+                        help="Parse image blocks instead of counting image placements (slower; falls back to the "
+                             "fast parse once half of --budget is spent)")
+    args = parser.parse_args()
+    process_all_pdfs(args.input_dir, args.output_dir, workers=args.workers, incremental=args.incremental,
+                     stream=args.stream or bool(args.jsonl), combined_jsonl=args.jsonl,
+                     font_sample_pages=args.font_sample_pages,
+                     budget_seconds=args.budget, page_budget_seconds=args.page_budget,
+                     shard_workers=args.shard_workers, full_layout=args.full_layout)
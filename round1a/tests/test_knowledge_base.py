@@ -0,0 +1,131 @@
+import os
+import zlib
+import numpy as np
+import pytest
+import knowledge_base
+from knowledge_base import KnowledgeBase, default_index_dir
+from src.rag_pipeline import run_rag
+
+DIM = 64
+
+
+@pytest.fixture
+def embedded(monkeypatch):
+    """
+    Replaces the sentence-transformers model with a bag-of-words hash
+    embedding and records every text embedded.
+    """
+    texts = []
+
+    def embed(batch):
+        texts.extend(batch)
+        vectors = np.zeros((len(batch), DIM), dtype=np.float32)
+        for row, text in zip(vectors, batch):
+            for word in text.lower().split():
+                row[zlib.crc32(word.strip(".,?").encode()) % DIM] += 1
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    monkeypatch.setattr(knowledge_base, "embed", embed)
+    monkeypatch.setattr(knowledge_base, "_open_indexes", {})
+    return texts
+
+
+def write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+@pytest.fixture
+def kb_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("KB_INDEX_DIR", str(tmp_path / "index"))
+    kb_dir = tmp_path / "kb"
+    kb_dir.mkdir()
+    write(kb_dir / "headings.txt", "Headings are short bold lines that start a section.")
+    write(kb_dir / "titles.txt", "The title names the whole document on its first page.")
+    return str(kb_dir)
+
+
+def test_index_is_saved_and_reused(kb_dir, embedded, tmp_path):
+    kb = KnowledgeBase.open(kb_dir)
+    assert len(embedded) == 2
+    # Saved under $KB_INDEX_DIR; the knowledge-base folder is left untouched
+    assert kb.index_dir == default_index_dir(kb_dir)
+    assert os.path.dirname(kb.index_dir) == str(tmp_path / "index")
+    assert os.path.exists(os.path.join(kb.index_dir, "manifest.json"))
+    assert sorted(os.listdir(kb_dir)) == ["headings.txt", "titles.txt"]
+
+    embedded.clear()
+    reopened = KnowledgeBase.open(kb_dir)
+    assert embedded == []
+    assert reopened.chunks == kb.chunks
+    assert np.array_equal(np.asarray(reopened.embeddings), np.asarray(kb.embeddings))
+
+
+def test_index_dir_can_be_chosen(kb_dir, embedded, tmp_path):
+    index_dir = str(tmp_path / "chosen")
+    kb = KnowledgeBase.open(kb_dir, index_dir)
+    assert kb.index_dir == index_dir
+    assert os.path.exists(os.path.join(index_dir, "manifest.json"))
+    assert KnowledgeBase.load(kb_dir) is None
+
+    embedded.clear()
+    answer = run_rag("Which line starts a section?", kb_dir, k=1, index_dir=index_dir)
+    # Only the query is embedded; the saved index is reused
+    assert embedded == ["Which line starts a section?"]
+    assert answer.startswith("[headings.txt, page 1]")
+
+
+def test_only_changed_files_are_embedded_again(kb_dir, embedded):
+    KnowledgeBase.open(kb_dir)
+    embedded.clear()
+    write(os.path.join(kb_dir, "titles.txt"), "A document title appears once, in large type.")
+    write(os.path.join(kb_dir, "lists.txt"), "Numbered lists are not headings.")
+
+    kb = KnowledgeBase.open(kb_dir)
+    assert sorted(embedded) == ["A document title appears once, in large type.", "Numbered lists are not headings."]
+    assert sorted(chunk["source"] for chunk in kb.chunks) == ["headings.txt", "lists.txt", "titles.txt"]
+    assert len(kb.embeddings) == len(kb.chunks)
+
+
+def test_removed_files_leave_the_index(kb_dir, embedded):
+    KnowledgeBase.open(kb_dir)
+    embedded.clear()
+    os.remove(os.path.join(kb_dir, "titles.txt"))
+
+    kb = KnowledgeBase.open(kb_dir)
+    assert embedded == []
+    assert [chunk["source"] for chunk in kb.chunks] == ["headings.txt"]
+
+
+def test_touched_file_is_not_embedded_again(kb_dir, embedded):
+    path = os.path.join(kb_dir, "headings.txt")
+    KnowledgeBase.open(kb_dir)
+    embedded.clear()
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    kb = KnowledgeBase.open(kb_dir)
+    assert embedded == []
+    assert kb.manifest["files"]["headings.txt"]["mtime_ns"] == stat.st_mtime_ns + 10 ** 9
+
+
+def test_changed_hash_rebuilds_the_file(kb_dir, embedded):
+    path = os.path.join(kb_dir, "headings.txt")
+    KnowledgeBase.open(kb_dir)
+    sha256 = KnowledgeBase.load(kb_dir).manifest["files"]["headings.txt"]["sha256"]
+    embedded.clear()
+    # Same size, so only the hash tells the contents apart
+    stat = os.stat(path)
+    write(path, "Headings are short BOLD lines that start a section.")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    kb = KnowledgeBase.open(kb_dir)
+    assert embedded == ["Headings are short BOLD lines that start a section."]
+    assert kb.manifest["files"]["headings.txt"]["sha256"] != sha256
+
+
+def test_run_rag_answers_from_the_closest_file(kb_dir, embedded):
+    answers = run_rag(["Which line starts a section?", "What names the whole document?"], kb_dir, k=1)
+    assert answers[0].startswith("[headings.txt, page 1]")
+    assert answers[1].startswith("[titles.txt, page 1]")
+    assert run_rag("anything", os.path.join(kb_dir, "titles.txt"), k=3).startswith("[titles.txt, page 1]")
@@ -0,0 +1,176 @@
+import io
+import json
+import os
+import shutil
+import threading
+import fitz
+import pytest
+from PIL import Image
+import vector_store
+from vector_store import SPAN_OCR, build_span_table, extract_outline_and_title
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "input", "knowledge_base")
+# 14 pages with a multi-level outline
+SAMPLE_PDF = os.path.join(INPUT_DIR, "file03.pdf")
+
+
+def without_timing(result):
+    result = dict(result)
+    if "metadata" in result:
+        result["metadata"] = {key: value for key, value in result["metadata"].items() if key != "elapsed_seconds"}
+    return result
+
+
+def without_metadata(result):
+    return {key: value for key, value in result.items() if key != "metadata"}
+
+
+@pytest.fixture
+def small_shards(monkeypatch):
+    # Shard the sample too, despite its few pages
+    monkeypatch.setattr(vector_store, "SHARD_MIN_PAGES", 2)
+
+
+def test_sharded_extraction_honours_an_exhausted_budget(small_shards):
+    serial = extract_outline_and_title(SAMPLE_PDF, budget_seconds=0.0001)
+    sharded = extract_outline_and_title(SAMPLE_PDF, budget_seconds=0.0001, shard_workers=2)
+    assert "truncated_pages" in serial["metadata"]["degradations"]
+    assert without_timing(sharded) == without_timing(serial)
+
+
+def image_only_pdf(path, shades):
+    # One page per shade, each holding only a solid-colour PNG
+    doc = fitz.open()
+    for shade in shades:
+        buffer = io.BytesIO()
+        Image.new("L", (32, 32), shade).save(buffer, "PNG")
+        doc.new_page().insert_image(fitz.Rect(50, 50, 250, 250), stream=buffer.getvalue())
+    doc.save(path)
+    return path
+
+
+@pytest.fixture
+def fake_ocr(monkeypatch, tmp_path):
+    """
+    Replaces tesseract: returns a text naming the image's grey level and
+    records the calls. Every call blocks until all of them have been
+    submitted, so a pipeline that waits on one page before submitting the
+    next would time out instead.
+    """
+    calls = []
+    submitted = threading.Event()
+    expected = {}
+
+    def ocr_image_bytes(image_bytes, timeout=0):
+        calls.append(image_bytes)
+        if len(calls) == expected.get("calls"):
+            submitted.set()
+        assert submitted.wait(5), "OCR was awaited before every page was submitted"
+        return f"Scanned page {Image.open(io.BytesIO(image_bytes)).convert('L').getpixel((0, 0))}"
+
+    monkeypatch.setattr(vector_store, "ocr_image_bytes", ocr_image_bytes)
+    monkeypatch.setattr(vector_store, "OCR_CACHE_DIR", str(tmp_path / "ocr_cache"))
+    monkeypatch.setattr(vector_store, "_ocr_memory_cache", vector_store.OrderedDict())
+    monkeypatch.setattr(vector_store, "_ocr_key_prefix", "test|".encode("utf-8"))
+    monkeypatch.setattr(vector_store, "OCR_WORKERS", 4)
+    monkeypatch.setattr(vector_store, "_ocr_executor", None)
+    return calls, expected
+
+
+def test_image_only_pages_are_ocrd_together(tmp_path, fake_ocr):
+    calls, expected = fake_ocr
+    expected["calls"] = 2
+    # The third page repeats the first page's image
+    with fitz.open(image_only_pdf(str(tmp_path / "scan.pdf"), [10, 20, 10])) as doc:
+        table = build_span_table(doc)
+    assert len(calls) == 2
+    assert table["page"].tolist() == [1, 2, 3]
+    assert (table["flags"] & SPAN_OCR).all()
+    assert [table["texts"][i] for i in table["text_id"]] == ["Scanned page 10", "Scanned page 20", "Scanned page 10"]
+
+
+def test_ocr_memory_cache_is_bounded(tmp_path, fake_ocr, monkeypatch):
+    calls, expected = fake_ocr
+    expected["calls"] = 3
+    monkeypatch.setattr(vector_store, "OCR_MEMORY_CACHE_SIZE", 2)
+    with fitz.open(image_only_pdf(str(tmp_path / "scan.pdf"), [10, 20, 30])) as doc:
+        build_span_table(doc)
+    assert len(vector_store._ocr_memory_cache) == 2
+    # Evicted texts are read back from the disk cache instead of OCR'd again
+    with fitz.open(str(tmp_path / "scan.pdf")) as doc:
+        build_span_table(doc)
+    assert len(calls) == 3
+
+
+def read_output(output_dir, pdf_file):
+    # The title and outline of a .json output, or rebuilt from .ndjson records
+    stem = os.path.splitext(pdf_file)[0]
+    json_path = os.path.join(output_dir, stem + ".json")
+    if os.path.exists(json_path):
+        with open(json_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    with open(os.path.join(output_dir, stem + ".ndjson"), "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert all(record["document"] == pdf_file for record in records)
+    return {
+        "title": records[0]["title"],
+        "outline": [{key: record[key] for key in ("level", "text", "page")} for record in records[1:]]
+    }
+
+
+@pytest.mark.parametrize("options", [
+    {"workers": 2},
+    {"shard_workers": 2},
+    {"stream": True},
+    {"stream": True, "combined_jsonl": "batch.jsonl"},
+])
+def test_every_extraction_path_gives_the_serial_output(tmp_path, small_shards, options):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    pdf_files = ["file02.pdf", "file03.pdf"]
+    for pdf_file in pdf_files:
+        shutil.copy(os.path.join(INPUT_DIR, pdf_file), input_dir)
+    vector_store.process_all_pdfs(str(input_dir), str(tmp_path / "serial"))
+    if "combined_jsonl" in options:
+        options = dict(options, combined_jsonl=str(tmp_path / options["combined_jsonl"]))
+    vector_store.process_all_pdfs(str(input_dir), str(tmp_path / "other"), **options)
+
+    for pdf_file in pdf_files:
+        expected = read_output(str(tmp_path / "serial"), pdf_file)
+        assert expected["outline"]
+        assert read_output(str(tmp_path / "other"), pdf_file) == expected
+    if "combined_jsonl" in options:
+        with open(options["combined_jsonl"], "r", encoding="utf-8") as f:
+            documents = [json.loads(line)["document"] for line in f]
+        assert sorted(set(documents)) == pdf_files
+
+
+def test_switching_output_mode_removes_the_other_outputs(tmp_path):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    shutil.copy(SAMPLE_PDF, input_dir)
+    output_dir = tmp_path / "output"
+    for stream in (False, True, False):
+        vector_store.process_all_pdfs(str(input_dir), str(output_dir), incremental=True, stream=stream)
+        assert sorted(os.listdir(output_dir)) == [vector_store.MANIFEST_NAME,
+                                                  vector_store.output_name(os.path.basename(SAMPLE_PDF), stream)]
+
+
+def test_full_layout_falls_back_to_the_fast_parse_under_budget(tmp_path, monkeypatch):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    shutil.copy(SAMPLE_PDF, input_dir)
+    vector_store.process_all_pdfs(str(input_dir), str(tmp_path / "fast"))
+    vector_store.process_all_pdfs(str(input_dir), str(tmp_path / "full"), full_layout=True, budget_seconds=1000)
+    pdf_file = os.path.basename(SAMPLE_PDF)
+    full = read_output(str(tmp_path / "full"), pdf_file)
+    assert full["metadata"]["degradations"] == []
+    assert without_metadata(full) == read_output(str(tmp_path / "fast"), pdf_file)
+
+    # Past the full layout's share of the budget every later page is parsed fast
+    monkeypatch.setattr(vector_store.ExtractionBudget, "FULL_LAYOUT_RESERVE", 1.0)
+    for stream in (False, True):
+        vector_store.process_all_pdfs(str(input_dir), str(tmp_path / "degraded"), full_layout=True,
+                                      budget_seconds=1000, stream=stream)
+        with open(tmp_path / "degraded" / vector_store.output_name(pdf_file, stream), "r", encoding="utf-8") as f:
+            assert '"fast_layout"' in f.read()
@@ -1,6 +1,25 @@
+import pytest
 from src.rag_pipeline import run_rag
 
+def model_available():
+    # The real model, if it is already downloaded; never fetched here
+    try:
+        import sentence_transformers  # noqa: F401
+        from huggingface_hub import try_to_load_from_cache
+    except ImportError:
+        return False
+    return isinstance(try_to_load_from_cache("sentence-transformers/all-MiniLM-L6-v2", "config.json"), str)
+
+pytestmark = pytest.mark.skipif(not model_available(), reason="all-MiniLM-L6-v2 is not downloaded")
+
 def test_rag_response():
     result = run_rag("Explain PDF heading structure.", "input/knowledge_base/format_guidelines.txt")
     assert isinstance(result, str)
     assert len(result) > 0
+
+def test_rag_batch():
+    queries = ["Explain PDF heading structure.", "What belongs in a document title?"]
+    results = run_rag(queries, "input/knowledge_base")
+    assert isinstance(results, list)
+    assert len(results) == len(queries)
+    assert all(isinstance(result, str) and result for result in results)
@@ -0,0 +1,133 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from model_registry import MAX_SEQ_LENGTH, MODEL_NAME, get_model
+
+DEFAULT_BATCH_SIZE = 64
+# Print throughput after every this many chunks
+PROGRESS_EVERY = 2048
+
+
+def length_buckets(texts, batch_size, lengths=None):
+    """
+    Batches of indices into texts, longest first, so each batch holds
+    chunks of similar length and pads little. lengths are the texts' word
+    piece counts if known (the chunker records them); character length
+    stands in otherwise.
+    """
+    lengths = [len(text) for text in texts] if lengths is None else lengths
+    order = sorted(range(len(texts)), key=lengths.__getitem__, reverse=True)
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+def model_tokens(lengths):
+    # Word pieces the model sees for texts of these lengths: [CLS] and [SEP]
+    # added, truncated to its max length
+    return sum(min(length + 2, MAX_SEQ_LENGTH) for length in lengths)
+
+
+def encode_batch(texts, model_name=MODEL_NAME):
+    """
+    Embeddings of one batch, encoded as a single forward pass with the
+    process's shared model.
+    """
+    model = get_model(model_name)
+    embeddings = model.encode(texts, batch_size=len(texts), show_progress_bar=False, convert_to_numpy=True)
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def init_encode_worker(threads):
+    # Split the cores between the workers instead of letting every process
+    # start one torch thread per core
+    import torch
+    torch.set_num_threads(threads)
+
+
+class ThroughputReporter:
+    def __init__(self, total=None, label="Embedded"):
+        self.total = total
+        self.label = label
+        self.chunks = 0
+        self.tokens = 0
+        self.start = time.perf_counter()
+        self.next_report = PROGRESS_EVERY
+
+    def add(self, chunks, tokens=None):
+        # Token throughput is only reported while every batch's count is known
+        self.chunks += chunks
+        self.tokens = None if tokens is None or self.tokens is None else self.tokens + tokens
+        if self.chunks >= self.next_report and (self.total is None or self.chunks < self.total):
+            self.next_report += PROGRESS_EVERY
+            self.report()
+
+    def report(self, done=False):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        prefix = "✅ " if done else ""
+        progress = f"{self.chunks}/{self.total}" if self.total is not None else f"{self.chunks}"
+        rates = f"{self.chunks / elapsed:.1f} chunks/s"
+        if self.tokens is not None:
+            rates += f", {self.tokens / elapsed:.0f} tokens/s"
+        print(f"{prefix}{self.label} {progress} chunks in {elapsed:.1f}s ({rates})")
+
+
+class ChunkEncoder:
+    """
+    Embeds chunk texts in length-bucketed batches, optionally spread over a
+    pool of worker processes, each holding its own copy of the model. The
+    pool and the throughput counters live as long as the encoder, so it can
+    be fed one slice of a corpus at a time.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, workers=1, model_name=MODEL_NAME, total=None):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.model_name = model_name
+        self.reporter = ThroughputReporter(total)
+        self.executor = None
+        if workers > 1:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_encode_worker,
+                                                initargs=(threads,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.reporter.chunks:
+            self.reporter.report(done=True)
+
+    def encode(self, texts, lengths=None):
+        """
+        (len(texts), dim) float32 matrix in the order of texts. lengths, the
+        texts' word piece counts, order the batches and give the token
+        throughput; texts are never tokenized just to count them.
+        """
+        batches = length_buckets(texts, self.batch_size, lengths)
+        embeddings = None
+
+        def place(batch, batch_embeddings):
+            nonlocal embeddings
+            if embeddings is None:
+                embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+            embeddings[batch] = batch_embeddings
+            self.reporter.add(len(batch), None if lengths is None else model_tokens(lengths[i] for i in batch))
+
+        if self.executor is None:
+            for batch in batches:
+                place(batch, encode_batch([texts[i] for i in batch], self.model_name))
+        else:
+            futures = {self.executor.submit(encode_batch, [texts[i] for i in batch], self.model_name): batch
+                       for batch in batches}
+            for future in as_completed(futures):
+                place(futures[future], future.result())
+
+        if embeddings is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return embeddings
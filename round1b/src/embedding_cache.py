@@ -0,0 +1,174 @@
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from model_registry import EMBEDDING_DIM, MODEL_NAME, MODEL_REVISION, get_model
+
+# Query embeddings persist here across processes and reruns, unless the
+# EMBEDDING_CACHE_DIR environment variable (read when a cache is created)
+# names another folder, or is empty to keep the cache in memory only.
+DEFAULT_EMBEDDING_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "rag_pipeline")
+MEMORY_CACHE_SIZE = 4096
+DISK_CACHE_SIZE = 200000
+
+
+def normalize_prompt(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def embedding_cache_dir():
+    return os.environ.get("EMBEDDING_CACHE_DIR", DEFAULT_EMBEDDING_CACHE_DIR)
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of prompt embeddings: an in-process LRU in front of a
+    size-bounded SQLite table. Keys cover the model name, revision and
+    embedding size, the normalize_embeddings flag and the
+    whitespace-normalized prompt, so a new model or revision never sees
+    stale vectors; stored rows of another size are ignored.
+
+    dim defaults to EMBEDDING_DIM for the default model; other models'
+    vectors are checked against the size of the first ones they return.
+    cache_dir defaults to embedding_cache_dir().
+    """
+
+    def __init__(self, model_name=MODEL_NAME, revision=MODEL_REVISION, cache_dir=None,
+                 memory_size=MEMORY_CACHE_SIZE, disk_size=DISK_CACHE_SIZE, dim=None):
+        self.model_name = model_name
+        self.revision = revision
+        self.dim = dim or (EMBEDDING_DIM if model_name == MODEL_NAME else None)
+        # Fixed here, so keys don't change once an unknown size is learned
+        self.key_dim = self.dim
+        if cache_dir is None:
+            cache_dir = embedding_cache_dir()
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.db = sqlite3.connect(os.path.join(cache_dir, "query_embeddings.sqlite"), check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, dim INTEGER, vector BLOB, last_used REAL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self.db.commit()
+
+    def key(self, text, normalize):
+        raw = (f"{self.model_name}\0{self.revision or ''}\0{self.key_dim or ''}\0{int(bool(normalize))}\0"
+               f"{normalize_prompt(text)}")
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def get_many(self, keys):
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+            missing = [key for key in keys if key not in found]
+            if self.db is not None and missing:
+                placeholders = ",".join("?" * len(missing))
+                rows = [
+                    (key, blob) for key, dim, blob in self.db.execute(
+                        f"SELECT key, dim, vector FROM embeddings WHERE key IN ({placeholders})", missing
+                    )
+                    # Rows written for another size (or cut short) are misses
+                    if len(blob) == 4 * dim and dim == (self.dim or dim)
+                ]
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(key, vector)
+                    found[key] = vector
+                if rows:
+                    self.db.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                        [(time.time(), key) for key, _ in rows]
+                    )
+                    self.db.commit()
+        return found
+
+    def put_many(self, items):
+        with self.lock:
+            for key, vector in items:
+                self._remember(key, vector)
+            if self.db is None:
+                return
+            now = time.time()
+            self.db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dim, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(key, len(vector), np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+            )
+            # Evict the least recently used rows beyond the size bound
+            count = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.disk_size:
+                self.db.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (count - self.disk_size,)
+                )
+            self.db.commit()
+
+    def encode(self, texts, normalize=True):
+        """
+        Embeddings for texts as a (len(texts), dim) float32 array. Only the
+        prompts missing from both tiers go through the model, in one call.
+        """
+        keys = [self.key(text, normalize) for text in texts]
+        found = self.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = get_model(self.model_name, self.revision).encode(list(missing.values()), normalize_embeddings=normalize)
+            vectors = np.asarray(vectors, dtype=np.float32)
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"{self.model_name} returned {vectors.shape[1]}-dimensional embeddings, "
+                                 f"expected {self.dim}")
+            new_items = list(zip(missing.keys(), vectors))
+            self.put_many(new_items)
+            found.update(new_items)
+        return np.stack([found[key] for key in keys])
+
+    def warm_up(self, prompts, normalize=True):
+        self.encode(prompts, normalize=normalize)
+
+
+_query_cache = None
+_query_cache_lock = threading.Lock()
+
+
+def get_query_cache():
+    global _query_cache
+    with _query_cache_lock:
+        if _query_cache is None:
+            _query_cache = EmbeddingCache()
+        return _query_cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-compute query embeddings into the persistent cache")
+    parser.add_argument("prompts", help="Text file with one prompt per line")
+    args = parser.parse_args()
+
+    with open(args.prompts, "r", encoding="utf-8") as f:
+        prompts = [line.strip() for line in f if line.strip()]
+    get_query_cache().warm_up(prompts)
+    print(f"✅ Cached embeddings for {len(prompts)} prompts")
@@ -0,0 +1,198 @@
+import os
+import json
+import re
+from array import array
+from collections import Counter
+import numpy as np
+from vector_index import top_k_rows
+
+# Inverted index over chunk text, saved next to the store's vectors:
+#   lexical.json      terms (a term's id is its position), BM25 parameters,
+#                     indexed row count and average chunk length
+#   lexical.offsets   int64 start of each term's postings, plus the end
+#   lexical.postings  uint32 rows containing each term, ascending, grouped by term
+#   lexical.freqs     uint16 occurrences of the term in that row
+#   lexical.lengths   uint32 tokens per row (0 for rows not indexed, or
+#                     tombstoned since)
+LEXICAL_META_FILENAME = "lexical.json"
+LEXICAL_FILENAMES = (LEXICAL_META_FILENAME, "lexical.offsets", "lexical.postings", "lexical.freqs",
+                     "lexical.lengths")
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def in_ranges(rows, ranges):
+    # Mask of the (ascending) rows that fall in sorted [start, stop) ranges
+    starts = np.array([start for start, _ in ranges])
+    stops = np.array([stop for _, stop in ranges])
+    which = np.searchsorted(starts, rows, side="right") - 1
+    return (which >= 0) & (rows < stops[np.maximum(which, 0)])
+
+
+def tokenize_rows(texts, vocabulary, lengths):
+    """
+    (term ids, rows, frequencies) of every distinct term of each (row, text),
+    adding new terms to vocabulary and each row's token count to lengths.
+    """
+    term_ids, rows, freqs = array("I"), array("I"), array("H")
+    for row, text in texts:
+        tokens = tokenize(text)
+        lengths[row] = len(tokens)
+        for term, freq in Counter(tokens).items():
+            term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+            rows.append(row)
+            freqs.append(min(freq, np.iinfo(np.uint16).max))
+    return (np.frombuffer(term_ids, dtype=np.uint32), np.frombuffer(rows, dtype=np.uint32),
+            np.frombuffer(freqs, dtype=np.uint16))
+
+
+def write_lexical_meta(store_dir, vocabulary, lengths):
+    indexed = int(np.count_nonzero(lengths))
+    meta = {
+        "count": len(lengths),
+        "indexed_rows": indexed,
+        "average_length": float(lengths.sum() / max(indexed, 1)),
+        "k1": BM25_K1,
+        "b": BM25_B,
+        "terms": sorted(vocabulary, key=vocabulary.get)
+    }
+    # Written last: a store with lexical.json has a complete index
+    with open(os.path.join(store_dir, LEXICAL_META_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+
+def build_lexical_index(store_dir, texts, count):
+    """
+    Write the inverted index of texts, an iterable of (row, text) in
+    ascending row order, for a store of count rows. Returns the number of
+    distinct terms.
+    """
+    vocabulary = {}
+    lengths = np.zeros(count, dtype=np.uint32)
+    term_ids, rows, freqs = tokenize_rows(texts, vocabulary, lengths)
+
+    # Stable, so each term's postings stay in row order
+    order = np.argsort(term_ids, kind="stable")
+    offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=offsets[1:])
+    rows[order].tofile(os.path.join(store_dir, "lexical.postings"))
+    freqs[order].tofile(os.path.join(store_dir, "lexical.freqs"))
+    offsets.tofile(os.path.join(store_dir, "lexical.offsets"))
+    lengths.tofile(os.path.join(store_dir, "lexical.lengths"))
+    write_lexical_meta(store_dir, vocabulary, lengths)
+    return len(vocabulary)
+
+
+def append_lexical_index(store_dir, texts, count, dead_rows=()):
+    """
+    Add texts, (row, text) pairs past the rows already indexed in ascending
+    order, to the saved index of a store that now has count rows. Only the
+    new texts are tokenized; their postings are merged in after each
+    term's existing ones. dead_rows (tombstoned since) get a length of 0,
+    which drops them from the statistics and from search; their postings
+    stay until the index is rebuilt. Returns the number of distinct terms.
+    """
+    meta_path = os.path.join(store_dir, LEXICAL_META_FILENAME)
+    with open(meta_path, "r", encoding="utf-8") as f:
+        vocabulary = {term: i for i, term in enumerate(json.load(f)["terms"])}
+    # Incomplete until the new lexical.json is written
+    os.remove(meta_path)
+    old_offsets = np.fromfile(os.path.join(store_dir, "lexical.offsets"), dtype=np.int64)
+    old_postings = np.fromfile(os.path.join(store_dir, "lexical.postings"), dtype=np.uint32)
+    old_freqs = np.fromfile(os.path.join(store_dir, "lexical.freqs"), dtype=np.uint16)
+    old_lengths = np.fromfile(os.path.join(store_dir, "lexical.lengths"), dtype=np.uint32)
+    lengths = np.zeros(count, dtype=np.uint32)
+    lengths[:len(old_lengths)] = old_lengths
+    lengths[np.asarray(dead_rows, dtype=np.int64)] = 0
+    old_terms = len(vocabulary)
+    term_ids, rows, freqs = tokenize_rows(texts, vocabulary, lengths)
+
+    old_counts = np.zeros(len(vocabulary), dtype=np.int64)
+    old_counts[:old_terms] = np.diff(old_offsets)
+    new_counts = np.bincount(term_ids, minlength=len(vocabulary))
+    new_before = np.cumsum(new_counts) - new_counts
+    offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(old_counts + new_counts, out=offsets[1:])
+    postings = np.empty(offsets[-1], dtype=np.uint32)
+    merged_freqs = np.empty(offsets[-1], dtype=np.uint16)
+    # A term's existing postings move up by the new postings of the terms
+    # before it; its new postings follow them
+    old_positions = np.arange(len(old_postings)) + np.repeat(new_before[:old_terms], old_counts[:old_terms])
+    postings[old_positions], merged_freqs[old_positions] = old_postings, old_freqs
+    order = np.argsort(term_ids, kind="stable")
+    sorted_terms = term_ids[order]
+    new_positions = offsets[sorted_terms] + old_counts[sorted_terms] + np.arange(len(order)) - new_before[sorted_terms]
+    postings[new_positions], merged_freqs[new_positions] = rows[order], freqs[order]
+
+    postings.tofile(os.path.join(store_dir, "lexical.postings"))
+    merged_freqs.tofile(os.path.join(store_dir, "lexical.freqs"))
+    offsets.tofile(os.path.join(store_dir, "lexical.offsets"))
+    lengths.tofile(os.path.join(store_dir, "lexical.lengths"))
+    write_lexical_meta(store_dir, vocabulary, lengths)
+    return len(vocabulary)
+
+
+class LexicalIndex:
+    """
+    BM25 over a store's chunks, reading only the postings of the query's
+    terms (memory-mapped).
+    """
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, LEXICAL_META_FILENAME), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.terms = {term: i for i, term in enumerate(self.meta["terms"])}
+        self.offsets = np.fromfile(os.path.join(store_dir, "lexical.offsets"), dtype=np.int64)
+        self.postings = self._memmap(store_dir, "lexical.postings", np.uint32)
+        self.freqs = self._memmap(store_dir, "lexical.freqs", np.uint16)
+        self.lengths = self._memmap(store_dir, "lexical.lengths", np.uint32)
+
+    @staticmethod
+    def _memmap(store_dir, name, dtype):
+        path = os.path.join(store_dir, name)
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def search(self, text, k, ranges=None):
+        """
+        (scores, rows) of the k rows with the best BM25 score for text, best
+        first; rows matching no query term are never returned. ranges limits
+        the search to those [start, stop) row ranges.
+        """
+        term_ids = sorted({self.terms[term] for term in tokenize(text) if term in self.terms})
+        k1, b = self.meta["k1"], self.meta["b"]
+        num_rows, average_length = self.meta["indexed_rows"], self.meta["average_length"]
+        all_rows, all_scores = [], []
+        for term_id in term_ids:
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            rows = np.asarray(self.postings[start:stop])
+            freqs = np.asarray(self.freqs[start:stop], dtype=np.float32)
+            # Rows tombstoned since they were indexed have a length of 0
+            lengths = np.asarray(self.lengths[rows])
+            live = lengths > 0
+            rows, freqs, lengths = rows[live], freqs[live], lengths[live]
+            frequency = len(rows)
+            if ranges is not None:
+                keep = in_ranges(rows, ranges)
+                rows, freqs, lengths = rows[keep], freqs[keep], lengths[keep]
+            idf = np.log(1 + (num_rows - frequency + 0.5) / (frequency + 0.5))
+            norm = freqs + k1 * (1 - b + b * lengths / average_length)
+            all_rows.append(rows)
+            all_scores.append(idf * freqs * (k1 + 1) / norm)
+        if not all_rows:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype(np.float32)
+        best = top_k_rows(scores[None, :], k)[0]
+        return scores[best], rows[best].astype(np.int64)
+
+    @property
+    def nbytes(self):
+        return self.postings.nbytes + self.freqs.nbytes + self.offsets.nbytes + self.lengths.nbytes
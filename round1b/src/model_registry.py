@@ -0,0 +1,44 @@
+import os
+import threading
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+# Pin a model revision (commit hash or tag) so cached query embeddings can be
+# tied to the exact weights that produced them
+MODEL_REVISION = os.environ.get("EMBEDDING_MODEL_REVISION") or None
+# Word pieces the model reads per input, [CLS] and [SEP] included; anything
+# past this is truncated away
+MAX_SEQ_LENGTH = 256
+# Size of the model's sentence embeddings
+EMBEDDING_DIM = 384
+
+_models = {}
+_tokenizers = {}
+_lock = threading.Lock()
+
+
+def get_model(name=MODEL_NAME, revision=MODEL_REVISION):
+    """
+    The shared SentenceTransformer for name, loaded on first use.
+    sentence_transformers (and torch) are only imported here, so modules
+    that never embed anything start without them.
+    """
+    with _lock:
+        if name not in _models:
+            from sentence_transformers import SentenceTransformer
+            _models[name] = SentenceTransformer(name, revision=revision)
+        return _models[name]
+
+
+def get_tokenizer(name=MODEL_NAME, revision=MODEL_REVISION):
+    """
+    The model's (fast) tokenizer without its weights, for chunking in
+    processes that never embed. Reuses the loaded model's tokenizer if any.
+    """
+    with _lock:
+        if name in _models:
+            return _models[name].tokenizer
+        if name not in _tokenizers:
+            from transformers import AutoTokenizer
+            repo = name if "/" in name else f"sentence-transformers/{name}"
+            _tokenizers[name] = AutoTokenizer.from_pretrained(repo, revision=revision)
+        return _tokenizers[name]
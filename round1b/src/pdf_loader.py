@@ -1,5 +1,13 @@
 import os
-import fitz  # PyMuPDF
+from model_registry import MAX_SEQ_LENGTH, get_tokenizer
+
+# Bump whenever chunking output changes; stores built with another version
+# are rebuilt instead of updated incrementally
+CHUNKING_VERSION = 3
+# Word pieces per chunk: the model's limit minus [CLS] and [SEP], so no
+# chunk text is truncated away at embedding time
+CHUNK_TOKENS = MAX_SEQ_LENGTH - 2
+CHUNK_OVERLAP = 32
 
 def replace_ligatures(text):
     ligatures = {
@@ -43,47 +51,104 @@ def extract_section_title(page_text: str) -> str:
             return first_line
     return "Unknown Section"
 
+def iter_pages(file_path):
+    """
+    Yield per-page records of one PDF: filename, page_number, section_title, text
+    """
+    import fitz  # PyMuPDF; imported here so store readers don't pay for it
+
+    filename = os.path.basename(file_path)
+    with fitz.open(file_path) as doc:
+        for page in doc:
+            page_text = page.get_text()
+            page_text = replace_ligatures(page_text)  # cleanup ligatures here
+            section_title = extract_section_title(page_text)
+            yield {
+                "filename": filename,
+                "page_number": page.number + 1,
+                "section_title": section_title,
+                "text": page_text
+            }
+
+def list_pdfs(directory_path):
+    return sorted(filename for filename in os.listdir(directory_path) if filename.lower().endswith(".pdf"))
+
+def iter_documents_from_directory(directory_path):
+    """
+    Yield the page records of every PDF in a folder, one file at a time
+    """
+    for filename in list_pdfs(directory_path):
+        yield from iter_pages(os.path.join(directory_path, filename))
+
 def load_documents_from_directory(directory_path):
     """
     Load PDFs and extract per-page chunks with metadata: filename, page_number, section_title, text
     """
-    documents = []
-    for filename in os.listdir(directory_path):
-        if filename.lower().endswith(".pdf"):
-            file_path = os.path.join(directory_path, filename)
-            with fitz.open(file_path) as doc:
-                for page in doc:
-                    page_text = page.get_text()
-                    page_text = replace_ligatures(page_text)  # cleanup ligatures here
-                    section_title = extract_section_title(page_text)
-                    documents.append({
-                        "filename": filename,
-                        "page_number": page.number + 1,
-                        "section_title": section_title,
-                        "text": page_text
-                    })
-    return documents
-
-def chunk_text(documents, chunk_size=500):
-    """
-    Chunk documents (page texts) into smaller chunks if too long,
-    preserving metadata.
-    """
-    chunks = []
+    return list(iter_documents_from_directory(directory_path))
+
+def iter_chunks(documents, tokenizer=None, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+    """
+    Split page texts into windows of at most max_tokens word pieces of the
+    embedding model's (fast) tokenizer, consecutive windows sharing about
+    overlap pieces. Windows end and start on word boundaries, so a chunk
+    tokenizes the same on its own. A chunk doesn't copy its text: it keeps
+    the page's metadata, a reference to the page text and the
+    [char_start, char_end) range of the chunk in it (see chunk_string),
+    and its token_count in word pieces. Pages without text give no chunks.
+    """
+    if overlap >= max_tokens:
+        raise ValueError("Chunk overlap must be smaller than the chunk size.")
+    tokenizer = tokenizer or get_tokenizer()
     for doc in documents:
-        words = doc["text"].split()
-        if len(words) <= chunk_size:
-            chunks.append(doc)
-        else:
-            for i in range(0, len(words), chunk_size):
-                chunk_text = " ".join(words[i:i + chunk_size])
-                chunks.append({
-                    "filename": doc["filename"],
-                    "page_number": doc["page_number"],
-                    "section_title": doc["section_title"],
-                    "text": chunk_text
-                })
-    return chunks
+        text = doc["text"]
+        encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        offsets = encoding["offset_mapping"]
+        word_ids = encoding.word_ids()
+
+        def word_start(position, lowest):
+            # Step back to the first piece of the word at position, unless
+            # that word reaches back to lowest (a word longer than a window)
+            while position > lowest and word_ids[position] == word_ids[position - 1]:
+                position -= 1
+            return position if position > lowest else None
+
+        start = 0
+        while start < len(offsets):
+            stop = min(start + max_tokens, len(offsets))
+            if stop < len(offsets):
+                stop = word_start(stop, start) or stop
+            yield {
+                "filename": doc["filename"],
+                "page_number": doc["page_number"],
+                "section_title": doc["section_title"],
+                "page_text": text,
+                "char_start": offsets[start][0],
+                "char_end": offsets[stop - 1][1],
+                "token_count": stop - start
+            }
+            if stop == len(offsets):
+                break
+            # A window cut short before a word too long to share it with
+            # repeats none of itself
+            next_start = stop - overlap if stop - overlap > start else stop
+            start = word_start(next_start, start) or next_start
+
+def chunk_string(chunk):
+    """
+    The text of a chunk from iter_chunks, or of a plain {"text": ...} chunk
+    """
+    if "page_text" in chunk:
+        return chunk["page_text"][chunk["char_start"]:chunk["char_end"]]
+    return chunk["text"]
+
+def chunk_text(documents, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+    return list(iter_chunks(documents, max_tokens=max_tokens, overlap=overlap))
+
+def load_chunks_from_file(file_path, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+    """
+    All chunks of one PDF; the unit of work of a parsing worker
+    """
+    return list(iter_chunks(iter_pages(file_path), max_tokens=max_tokens, overlap=overlap))
 
 if __name__ == "__main__":
     input_dir = "input/knowledge_base/collection_1"  # adjust path if needed
@@ -92,4 +157,4 @@ if __name__ == "__main__":
     print(f"Loaded {len(docs)} pages, split into {len(chunks)} chunks.")
     if chunks:
         print("Sample chunk metadata:", {k: chunks[0][k] for k in ['filename', 'page_number', 'section_title']})
-        print("Sample chunk text snippet:", chunks[0]["text"][:200] + "...")
+        print("Sample chunk text snippet:", chunk_string(chunks[0])[:200] + "...")
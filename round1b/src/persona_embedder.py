@@ -1,10 +1,17 @@
-from sentence_transformers import SentenceTransformer
+from model_registry import MODEL_NAME, get_model
+from embedding_cache import EmbeddingCache, get_query_cache
 
 class PersonaEmbedder:
-    def __init__(self):
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
+    def __init__(self, model_name=MODEL_NAME):
+        self.model_name = model_name
+        self.cache = get_query_cache() if model_name == MODEL_NAME else EmbeddingCache(model_name)
+
+    @property
+    def model(self):
+        # Shared with rag_pipeline and embed_and_store; loaded on first use
+        return get_model(self.model_name)
 
     def embed_query(self, query, persona=None):
         if persona:
             query = f"{persona}: {query}"
-        return self.model.encode([query])[0]
+        return self.cache.encode([query], normalize=False)[0]
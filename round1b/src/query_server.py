@@ -0,0 +1,278 @@
+import argparse
+import bisect
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import rag_pipeline
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is +inf
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+
+def store_signature(path):
+    # Modification times of the files that define a store; a change means
+    # the store was rebuilt and should be reopened
+    if path.endswith(".pkl"):
+        return (os.path.getmtime(path),)
+    signature = []
+    for name in ("header.json", "index.json"):
+        file_path = os.path.join(path, name)
+        signature.append(os.path.getmtime(file_path) if os.path.exists(file_path) else None)
+    return tuple(signature)
+
+
+class StoreCache:
+    """
+    Stores kept open for the lifetime of the server, keyed by path.
+    """
+
+    def __init__(self, paths, nprobe=None, ef_search=None, rescore=None):
+        self.paths = list(paths)
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.rescore = rescore
+        self.stores = {}
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        with self.lock:
+            if path not in self.stores:
+                chunks, index = rag_pipeline.open_search_store(path, self.nprobe, self.ef_search, self.rescore)
+                self.stores[path] = (chunks, index, store_signature(path))
+            chunks, index, _ = self.stores[path]
+            return chunks, index
+
+    def reload_changed(self):
+        reloaded = []
+        with self.lock:
+            for path, (_, _, signature) in list(self.stores.items()):
+                if store_signature(path) != signature:
+                    del self.stores[path]
+                    reloaded.append(path)
+        for path in reloaded:
+            self.get(path)
+        return reloaded
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total_ms = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, ms):
+        with self.lock:
+            self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+            self.total_ms += ms
+
+    def snapshot(self):
+        with self.lock:
+            count = sum(self.counts)
+            return {
+                "count": count,
+                "mean_ms": round(self.total_ms / count, 3) if count else None,
+                "buckets": {
+                    **{f"le_{bound}ms": n for bound, n in zip(LATENCY_BUCKETS_MS, self.counts)},
+                    "inf": self.counts[-1]
+                }
+            }
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests for up to max_wait_ms (or max_batch items)
+    and answers them with one rag_pipeline.answer_batch call, so they share
+    a single encode and one search per store.
+    """
+
+    def __init__(self, stores, max_batch=32, max_wait_ms=5, hybrid=None):
+        self.stores = stores
+        self.hybrid = hybrid
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.pending = queue.Queue()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, data, store_path):
+        future = Future()
+        self.pending.put((data, store_path, future))
+        return future.result()
+
+    def _loop(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self._answer(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][2].set_exception(e)
+                    continue
+                # Answer each request on its own, so the error only reaches
+                # the request that caused it
+                for item in batch:
+                    try:
+                        self._answer([item])
+                    except Exception as item_error:
+                        item[2].set_exception(item_error)
+
+    def _answer(self, batch):
+        results = rag_pipeline.answer_batch(
+            [data for data, _, _ in batch],
+            [store_path for _, store_path, _ in batch],
+            self.stores.get,
+            hybrid=self.hybrid
+        )
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    server_version = "RagQueryServer/1.0"
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def send_json(self, status, body):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        state = self.server.state
+        if self.path == "/ready":
+            ready = state["ready"].is_set()
+            self.send_json(200 if ready else 503, {"ready": ready, "stores": state["stores"].paths})
+        elif self.path == "/metrics":
+            self.send_json(200, {"latency": state["latency"].snapshot()})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        state = self.server.state
+        if self.path == "/reload":
+            try:
+                reloaded = state["stores"].reload_changed()
+            except Exception as e:
+                # e.g. a store caught half-written; it is retried on next use
+                self.send_json(500, {"error": str(e)})
+                return
+            self.send_json(200, {"reloaded": reloaded})
+            return
+        if self.path != "/query":
+            self.send_json(404, {"error": "not found"})
+            return
+        if not state["ready"].is_set():
+            self.send_json(503, {"error": "model is still loading"})
+            return
+
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            data = json.loads(self.rfile.read(length) or b"{}")
+            # Malformed requests are turned away here, before they can join a batch
+            rag_pipeline.validate_input(data)
+            store_path = data.pop("vectorstore", None) or state["stores"].paths[0]
+            if store_path not in state["stores"].paths:
+                self.send_json(400, {"error": f"unknown vector store: {store_path}"})
+                return
+            result = state["batcher"].submit(data, store_path)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {"error": str(e)})
+            return
+        state["latency"].observe((time.perf_counter() - start) * 1000)
+        self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        if not self.server.state.get("quiet"):
+            super().log_message(format, *args)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def warm_up(state):
+    # Load the model weights and open every configured store before
+    # reporting ready, so the first real query pays none of it
+    rag_pipeline.embed_query("warm up")
+    for path in state["stores"].paths:
+        state["stores"].get(path)
+    state["ready"].set()
+    print(f"✅ Ready: {len(state['stores'].paths)} vector store(s) loaded")
+
+
+def serve(store_paths, host="127.0.0.1", port=8765, socket_path=None, max_batch=32, max_wait_ms=5,
+          nprobe=None, ef_search=None, rescore=None, quiet=False, hybrid=None):
+    stores = StoreCache(store_paths, nprobe=nprobe, ef_search=ef_search, rescore=rescore)
+    state = {
+        "stores": stores,
+        "batcher": MicroBatcher(stores, max_batch=max_batch, max_wait_ms=max_wait_ms, hybrid=hybrid),
+        "latency": LatencyHistogram(),
+        "ready": threading.Event(),
+        "quiet": quiet
+    }
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, QueryHandler)
+        print(f"Listening on unix socket {socket_path}")
+    else:
+        server = ThreadingHTTPServer((host, port), QueryHandler)
+        print(f"Listening on http://{host}:{port}")
+    server.state = state
+    threading.Thread(target=warm_up, args=(state,), daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent query server keeping the model and vector stores warm")
+    parser.add_argument("--vectorstore", action="append", required=True,
+                        help="Vector store to serve (repeatable; the first one is the default)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--max-batch", type=int, default=32, help="Most requests answered by one encode call")
+    parser.add_argument("--max-wait-ms", type=float, default=5, help="How long a request waits for others to batch with")
+    parser.add_argument("--nprobe", type=int, help="IVF index: lists probed per query")
+    parser.add_argument("--ef-search", type=int, help="HNSW index: search beam width")
+    parser.add_argument("--rescore", type=int, help="int8/binary index: candidates per result rescored exactly")
+    parser.add_argument("--hybrid", type=float, nargs="?", const=rag_pipeline.HYBRID_DENSE_WEIGHT,
+                        metavar="DENSE_WEIGHT", help="BM25 candidates rescored densely (see rag_pipeline.py --hybrid)")
+    parser.add_argument("--quiet", action="store_true", help="Don't log every request")
+    args = parser.parse_args()
+
+    serve(args.vectorstore, host=args.host, port=args.port, socket_path=args.socket, max_batch=args.max_batch,
+          max_wait_ms=args.max_wait_ms, nprobe=args.nprobe, ef_search=args.ef_search, rescore=args.rescore,
+          quiet=args.quiet, hybrid=args.hybrid)
@@ -1,28 +1,250 @@
 import argparse
+import heapq
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from itertools import islice
 import pickle
-from sentence_transformers import SentenceTransformer, util
+import numpy as np
+from embedding_cache import get_query_cache
+from vector_store import open_store
+from vector_index import ExactIndex, mmr_order, normalize_rows, top_k_rows
 
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+# Sections (one per document) in every answer
+SECTION_COUNT = 5
+# With MMR, documents re-ranked per requested section
+MMR_POOL_FACTOR = 4
+# Chunks fetched per requested section from approximate indexes, which
+# only return their top hits rather than scoring every row
+APPROXIMATE_POOL_FACTOR = 20
+# Hybrid search: rows the BM25 index hands to dense rescoring per query,
+# and the weight of the dense score in the fused ranking
+LEXICAL_CANDIDATES = 2000
+HYBRID_DENSE_WEIGHT = 0.7
+# Shards searched at once in federated mode; numpy releases the GIL while
+# scoring, so threads share the memory-mapped stores without copying them
+SEARCH_THREADS = min(8, os.cpu_count() or 1)
 
 
 def load_vector_store(path):
-    with open(path, "rb") as f:
-        return pickle.load(f)  # returns (chunks, embeddings)
+    """
+    Returns (chunks, embeddings). A store directory is memory-mapped and its
+    chunk text is read lazily; a legacy .pkl is unpickled whole.
+    """
+    if path.endswith(".pkl"):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    store = open_store(path)
+    return store.chunks, store.embeddings
 
 
-def embed_query(query, persona=None):
+def load_search_index(path, embeddings, nprobe=None, ef_search=None, rescore=None):
+    # Legacy pickles hold raw model output; new stores are normalized and may
+    # carry an approximate index
+    if path.endswith(".pkl"):
+        return ExactIndex(np.asarray(embeddings), normalized=False)
+    return open_store(path).open_index(nprobe=nprobe, ef_search=ef_search, rescore=rescore)
+
+
+def format_query(query, persona=None):
     if persona:
         query = f"{persona}: {query}"
-    return embedding_model.encode(query, convert_to_tensor=True)
+    return query
+
+
+def embed_query(query, persona=None):
+    return get_query_cache().encode([format_query(query, persona)])[0]
+
+
+def embed_queries(queries):
+    """
+    Embed many build_query() results; prompts not already cached go
+    through a single encode call.
+    """
+    texts = [format_query(query["prompt"], query["persona"]) for query in queries]
+    return get_query_cache().encode(texts)
+
+
+def document_ranges(chunks, query):
+    """
+    Row ranges of the documents the request names, or None to search the
+    whole store: legacy pickles have no per-document rows, and a request
+    naming no documents in the store falls back to everything.
+    """
+    if not query["documents"] or not hasattr(chunks, "document_ranges"):
+        return None
+    return chunks.document_ranges(query["documents"]) or None
+
+
+def document_ids(chunks):
+    # Each chunk's document; legacy pickles only carry file names
+    if hasattr(chunks, "doc_ids"):
+        return chunks.doc_ids
+    return np.unique([chunk.get("filename", "N/A") for chunk in chunks], return_inverse=True)[1]
+
+
+def live_document_ranges(chunks):
+    # Row ranges of every live document; None for legacy pickles, whose rows are all live
+    return chunks.document_ranges() if hasattr(chunks, "document_ranges") else None
+
+
+def exact_document_candidates(index, query_embeddings, doc_ids, ranges=None):
+    if not isinstance(index, ExactIndex):
+        index = ExactIndex(index.embeddings, normalized=True)
+    scores, rows, documents = index.document_maxima(query_embeddings, doc_ids, ranges)
+    return scores, rows, np.broadcast_to(documents, scores.shape)
+
+
+def document_candidates(index, query_embeddings, doc_ids, ranges=None, sections=SECTION_COUNT, live_ranges=None):
+    """
+    (scores, rows, documents), each (num_queries, candidates), holding the
+    best chunk of every document. Exact searches (and any search limited to
+    ranges) reduce the full similarity vector per document in one linear
+    pass. Approximate indexes reduce over their top hits instead, fetched
+    in a pool that doubles until it holds `sections` distinct documents
+    (or every live document, given live_ranges); queries the whole index
+    still can't satisfy fall back to the exact scan of the live rows.
+    """
+    if isinstance(index, ExactIndex) or ranges is not None:
+        return exact_document_candidates(index, query_embeddings, doc_ids, ranges)
+    doc_ids = np.asarray(doc_ids)
+    wanted = sections if live_ranges is None else min(sections, len(live_ranges))
+    found = [None] * len(query_embeddings)
+    pending = np.arange(len(query_embeddings))
+    k = sections * APPROXIMATE_POOL_FACTOR
+    while len(pending) and len(index):
+        k = min(k, len(index))
+        scores, rows = index.search(query_embeddings[pending], k)
+        # Approximate indexes pad with -1 when fewer rows were probed
+        scores = np.where(rows >= 0, scores, -np.inf)
+        documents = doc_ids[np.maximum(rows, 0)]
+        short = []
+        for row, i in enumerate(pending):
+            if len(np.unique(documents[row][rows[row] >= 0])) >= wanted:
+                found[i] = (scores[row], rows[row], documents[row])
+            else:
+                short.append(i)
+        pending = np.array(short, dtype=np.int64)
+        if k == len(index):
+            break
+        k *= 2
+    if len(pending):
+        exact = exact_document_candidates(index, query_embeddings[pending], doc_ids, live_ranges)
+        for row, i in enumerate(pending):
+            found[i] = tuple(column[row] for column in exact)
+
+    # Queries end up with different candidate counts; pad with -inf scores
+    width = max((len(scores) for scores, _, _ in found), default=0)
+    padded = (np.full((len(found), width), -np.inf, dtype=np.float32), np.zeros((len(found), width), dtype=np.int64),
+              np.zeros((len(found), width), dtype=np.int64))
+    for i, columns in enumerate(found):
+        for column, values in zip(padded, columns):
+            column[i, :len(values)] = values
+    return padded
+
+
+def min_max(values):
+    spread = values.max() - values.min()
+    if spread == 0:
+        return np.ones_like(values)
+    return (values - values.min()) / spread
+
 
+def lexical_text(query):
+    # BM25 matches the task itself, not the prompt's boilerplate
+    return format_query(query["task"], query["persona"])
 
-def get_top_k_indices(query_embedding, embeddings, top_k=10):
-    similarities = util.cos_sim(query_embedding, embeddings)[0]
-    top_results = similarities.argsort(descending=True)[:top_k]
-    return top_results.cpu().tolist(), similarities
+
+def lexical_hits(lexical, index, query_embedding, text, ranges=None):
+    """
+    (cosine, BM25, rows) of the LEXICAL_CANDIDATES best BM25 rows for text
+    in a store's LexicalIndex, rescored against the query embedding; only
+    these rows are dense-scored. None if no term of text occurs in the
+    searched rows.
+    """
+    bm25, rows = lexical.search(text, LEXICAL_CANDIDATES, ranges)
+    if not len(rows):
+        return None
+    # Read the vectors in row order
+    order = np.argsort(rows)
+    rows, bm25 = rows[order], bm25[order]
+    dense = np.asarray(index.embeddings[rows], dtype=np.float32) @ normalize_rows(query_embedding)[0]
+    return dense, bm25, rows
+
+
+def fuse_scores(dense, bm25, dense_weight=HYBRID_DENSE_WEIGHT):
+    # dense_weight * cosine + (1 - dense_weight) * BM25, each min-max scaled
+    # over the candidates they are ranked among
+    return dense_weight * min_max(dense) + (1 - dense_weight) * min_max(bm25)
+
+
+def lexical_candidates(lexical, index, query_embedding, text, doc_ids, ranges=None,
+                       dense_weight=HYBRID_DENSE_WEIGHT):
+    """
+    Candidates (scores, rows, documents) for one query from a store's
+    LexicalIndex: the lexical_hits for text ranked by fuse_scores. None if
+    BM25 finds nothing.
+    """
+    hits = lexical_hits(lexical, index, query_embedding, text, ranges)
+    if hits is None:
+        return None
+    dense, bm25, rows = hits
+    return fuse_scores(dense, bm25, dense_weight), rows, np.asarray(doc_ids)[rows]
+
+
+def query_candidates(chunks, index, query_embeddings, ranges=None, count=SECTION_COUNT, texts=None, hybrid=None):
+    """
+    Per query, the (scores, rows, documents) candidates its sections are
+    chosen from: document_candidates, searched together, or with hybrid
+    (the dense weight, 0-1) the lexical_candidates for its text wherever
+    the store has a lexical index and BM25 finds anything.
+    """
+    doc_ids = document_ids(chunks)
+    query_embeddings = normalize_rows(query_embeddings)
+    per_query = [None] * len(query_embeddings)
+    lexical = chunks.lexical_index() if hybrid is not None and hasattr(chunks, "lexical_index") else None
+    if lexical is not None:
+        per_query = [lexical_candidates(lexical, index, embedding, text, doc_ids, ranges, hybrid)
+                     for embedding, text in zip(query_embeddings, texts)]
+    dense = [i for i, candidates in enumerate(per_query) if candidates is None]
+    if dense:
+        candidates = document_candidates(index, query_embeddings[dense], doc_ids, ranges, count,
+                                         live_document_ranges(chunks))
+        for row, i in enumerate(dense):
+            per_query[i] = tuple(column[row] for column in candidates)
+    return per_query
+
+
+def top_documents(scores, rows, documents, count):
+    """
+    (rows, scores) of the best chunk of each of the count best documents
+    for one query, best first, given its document_candidates. Only the
+    candidates (about one per document) are ordered, never the corpus.
+    """
+    keep = np.isfinite(scores)
+    scores, rows, documents = scores[keep], rows[keep], documents[keep]
+    # A document cut by a block boundary, or hit several times by an
+    # approximate index, has more than one candidate; keep its best
+    order = np.argsort(-scores, kind="stable")
+    _, first = np.unique(documents[order], return_index=True)
+    best = order[first]
+    best = best[top_k_rows(scores[best][None, :], count)[0]]
+    return rows[best], scores[best]
+
+
+def select_rows(scores, rows, documents, sections=SECTION_COUNT, embeddings=None, mmr=None):
+    """
+    Rows of the best chunk of each of the `sections` best documents (see
+    top_documents). With mmr (the relevance weight, 0-1), a pool of the
+    best documents is re-ranked by maximal marginal relevance over their
+    chunks' embeddings.
+    """
+    if mmr is None:
+        return top_documents(scores, rows, documents, sections)[0].tolist()
+    rows, scores = top_documents(scores, rows, documents, sections * MMR_POOL_FACTOR)
+    vectors = np.asarray(embeddings[rows], dtype=np.float32)
+    return rows[mmr_order(scores, vectors, sections, mmr)].tolist()
 
 
 def remove_newlines(obj):
@@ -40,10 +262,27 @@ def remove_newlines(obj):
 
 
 
-def main(input_json_path, vector_store_path, output_json_path=None):
-    with open(input_json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+def validate_input(data):
+    """
+    Raise ValueError unless data has the input JSON fields build_query
+    reads: a job_to_be_done.task string, an optional persona.role string
+    and an optional list of {"filename": ...} documents.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("input JSON must be an object")
+    job = data.get("job_to_be_done")
+    if not isinstance(job, dict) or not isinstance(job.get("task"), str):
+        raise ValueError("job_to_be_done.task must be a string")
+    persona = data.get("persona", {})
+    if not isinstance(persona, dict) or not isinstance(persona.get("role", ""), str):
+        raise ValueError("persona.role must be a string")
+    documents = data.get("documents", [])
+    if not isinstance(documents, list) or not all(isinstance(doc, dict) and isinstance(doc.get("filename"), str)
+                                                  for doc in documents):
+        raise ValueError('documents must be a list of {"filename": ...} objects')
 
+
+def build_query(data):
     # More descriptive prompt to improve relevance
     base_query = data["job_to_be_done"]["task"]
     query_prompt = (
@@ -53,16 +292,16 @@ def main(input_json_path, vector_store_path, output_json_path=None):
         f"{base_query}"
     )
 
-    persona = data.get("persona", {}).get("role", None)
-    input_docs = [doc["filename"] for doc in data.get("documents", [])]
-
-    chunks, embeddings = load_vector_store(vector_store_path)
-    query_embedding = embed_query(query_prompt, persona)
+    return {
+        "prompt": query_prompt,
+        "persona": data.get("persona", {}).get("role", None),
+        "task": base_query,
+        "documents": [doc["filename"] for doc in data.get("documents", [])]
+    }
 
-    top_k = 10  # retrieve more for deduplication
-    top_indices, _ = get_top_k_indices(query_embedding, embeddings, top_k=top_k)
 
-    # Deduplicate by document for diversity (limit to 5 output sections)
+def select_sections(chunks, top_indices, sections=SECTION_COUNT):
+    # Deduplicate by document for diversity (limit to `sections` output sections)
     seen_docs = set()
     extracted_sections = []
     subsection_analysis = []
@@ -93,14 +332,18 @@ def main(input_json_path, vector_store_path, output_json_path=None):
             })
 
             importance_rank += 1
-            if importance_rank > 5:
+            if importance_rank > sections:
                 break
 
+    return extracted_sections, subsection_analysis
+
+
+def build_result(query, extracted_sections, subsection_analysis):
     result = {
         "metadata": {
-            "input_documents": input_docs,
-            "persona": persona or "",
-            "job_to_be_done": base_query,
+            "input_documents": query["documents"],
+            "persona": query["persona"] or "",
+            "job_to_be_done": query["task"],
             "processing_timestamp": datetime.utcnow().isoformat()
         },
         "extracted_sections": extracted_sections,
@@ -109,8 +352,10 @@ def main(input_json_path, vector_store_path, output_json_path=None):
 
     # --- Modify here to apply Unicode unescaping and optional newline removal ---
     # Uncomment below line if you want to remove all newlines in output text.
-    result = remove_newlines(result)
+    return remove_newlines(result)
+
 
+def write_result(result, output_json_path=None):
     if output_json_path:
         os.makedirs(os.path.dirname(output_json_path) or ".", exist_ok=True)
         with open(output_json_path, "w", encoding="utf-8") as out_f:
@@ -121,11 +366,281 @@ def main(input_json_path, vector_store_path, output_json_path=None):
         print(json.dumps(result, indent=2, ensure_ascii=False))
 
 
+def find_sections(chunks, index, query_embeddings, ranges=None, sections=SECTION_COUNT, mmr=None, texts=None,
+                  hybrid=None):
+    """
+    select_rows for every query embedding (see query_candidates).
+    """
+    count = sections if mmr is None else sections * MMR_POOL_FACTOR
+    candidates = query_candidates(chunks, index, query_embeddings, ranges, count, texts, hybrid)
+    return [select_rows(*query, sections=sections, embeddings=index.embeddings, mmr=mmr) for query in candidates]
+
+
+def main(input_json_path, vector_store_path, output_json_path=None, nprobe=None, ef_search=None, rescore=None,
+         sections=SECTION_COUNT, mmr=None, hybrid=None):
+    with open(input_json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    query = build_query(data)
+
+    chunks, embeddings = load_vector_store(vector_store_path)
+    index = load_search_index(vector_store_path, embeddings, nprobe=nprobe, ef_search=ef_search, rescore=rescore)
+    query_embedding = embed_query(query["prompt"], query["persona"])
+
+    top_indices = find_sections(chunks, index, query_embedding, document_ranges(chunks, query),
+                                sections=sections, mmr=mmr, texts=[lexical_text(query)], hybrid=hybrid)[0]
+
+    result = build_result(query, *select_sections(chunks, top_indices, sections))
+    write_result(result, output_json_path)
+
+
+def default_store_path(collection_dir):
+    store_dir = os.path.join(collection_dir, "vector_store")
+    if os.path.isdir(store_dir):
+        return store_dir
+    return os.path.join(collection_dir, "vector_store.pkl")
+
+
+def load_batch_requests(paths, vector_store_path=None, output_dir=None):
+    """
+    Expand --batch arguments into {"data", "vectorstore", "output"} requests.
+
+    A .json path is one challenge1b_input.json; its store and output default
+    to the collection folder it lives in. A .jsonl path holds one request per
+    line: either {"input": path, ...} or the input JSON fields inline
+    ("persona", "job_to_be_done", "documents") plus "vectorstore" and
+    optionally "output".
+    """
+    requests = []
+
+    def add(data, store_path, output_path, explicit_output=False):
+        if output_dir and not explicit_output:
+            output_path = os.path.join(output_dir, f"output_{len(requests) + 1:05}.json")
+        if not store_path or not output_path:
+            raise ValueError(f"Batch request {len(requests) + 1} needs a vector store and an output path")
+        requests.append({"data": data, "vectorstore": store_path, "output": output_path})
+
+    for path in paths:
+        if not path.endswith(".jsonl"):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            collection_dir = os.path.dirname(path)
+            add(data, vector_store_path or default_store_path(collection_dir),
+                os.path.join(collection_dir, "challenge1b_output.json"))
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                data = record
+                collection_dir = None
+                if "input" in record:
+                    with open(record["input"], "r", encoding="utf-8") as input_f:
+                        data = json.load(input_f)
+                    collection_dir = os.path.dirname(record["input"])
+                store_path = record.get("vectorstore") or vector_store_path
+                if not store_path and collection_dir is not None:
+                    store_path = default_store_path(collection_dir)
+                output_path = record.get("output")
+                if not output_path and collection_dir is not None:
+                    output_path = os.path.join(collection_dir, "challenge1b_output.json")
+                add(data, store_path, output_path, explicit_output="output" in record)
+    return requests
+
+
+def open_search_store(path, nprobe=None, ef_search=None, rescore=None):
+    chunks, embeddings = load_vector_store(path)
+    return chunks, load_search_index(path, embeddings, nprobe=nprobe, ef_search=ef_search, rescore=rescore)
+
+
+def answer_batch(datas, store_paths, open_store_fn=open_search_store, sections=SECTION_COUNT, mmr=None,
+                 hybrid=None):
+    """
+    Results for many input JSON dicts, in order. Every query is embedded in
+    one encode call, and the queries for each store that name the same
+    documents are scored together with a single matrix-matrix search over
+    those documents' rows (see find_sections). open_store_fn(path) ->
+    (chunks, index).
+    """
+    queries = [build_query(data) for data in datas]
+    query_embeddings = embed_queries(queries)
+
+    by_store = {}
+    for i, store_path in enumerate(store_paths):
+        by_store.setdefault(store_path, []).append(i)
+
+    results = [None] * len(queries)
+    for store_path, store_members in by_store.items():
+        chunks, index = open_store_fn(store_path)
+        by_ranges = {}
+        for i in store_members:
+            ranges = document_ranges(chunks, queries[i])
+            by_ranges.setdefault(None if ranges is None else tuple(ranges), []).append(i)
+        for ranges, members in by_ranges.items():
+            found = find_sections(chunks, index, query_embeddings[members], ranges, sections=sections, mmr=mmr,
+                                  texts=[lexical_text(queries[i]) for i in members], hybrid=hybrid)
+            for top_indices, i in zip(found, members):
+                results[i] = build_result(queries[i], *select_sections(chunks, top_indices, sections))
+    return results
+
+
+def run_batch(requests, nprobe=None, ef_search=None, rescore=None, sections=SECTION_COUNT, mmr=None, hybrid=None):
+    """
+    Answer many requests in one process, loading each store once.
+    """
+    results = answer_batch(
+        [request["data"] for request in requests],
+        [request["vectorstore"] for request in requests],
+        lambda path: open_search_store(path, nprobe=nprobe, ef_search=ef_search, rescore=rescore),
+        sections=sections,
+        mmr=mmr,
+        hybrid=hybrid
+    )
+    for request, result in zip(requests, results):
+        write_result(result, request["output"])
+    stores = len(set(request["vectorstore"] for request in requests))
+    print(f"✅ Answered {len(requests)} requests against {stores} vector stores")
+
+
+def list_shards(paths):
+    """
+    Store paths for --shards arguments. Each argument is a store (directory
+    or legacy .pkl), or a folder of collections that each hold one, like
+    input/knowledge_base.
+    """
+    shards = []
+    for path in paths:
+        if path.endswith(".pkl") or os.path.exists(os.path.join(path, "header.json")):
+            shards.append(path)
+            continue
+        for name in sorted(os.listdir(path)):
+            store_path = default_store_path(os.path.join(path, name))
+            if os.path.exists(store_path):
+                shards.append(store_path)
+    return shards
+
+
+def shard_candidates(shard, query, query_embedding, count, hybrid=None):
+    """
+    Unfused (cosine, BM25, rows, documents) candidates of one shard: its
+    lexical_hits with hybrid, otherwise (or if BM25 finds nothing) the best
+    chunk of its count best documents, with a BM25 score of zero. Empty
+    when the request names documents that only other shards hold.
+    """
+    chunks, index, ranges = shard
+    if query["documents"] and ranges is None:
+        empty = np.zeros(0, dtype=np.float32)
+        return empty, empty, empty.astype(np.int64), empty.astype(np.int64)
+    doc_ids = np.asarray(document_ids(chunks))
+    lexical = chunks.lexical_index() if hybrid is not None and hasattr(chunks, "lexical_index") else None
+    hits = None if lexical is None else lexical_hits(lexical, index, query_embedding, lexical_text(query), ranges)
+    if hits is not None:
+        dense, bm25, rows = hits
+        return dense, bm25, rows, doc_ids[rows]
+    candidates = document_candidates(index, normalize_rows(query_embedding), doc_ids, ranges, count,
+                                     live_document_ranges(chunks))
+    rows, scores = top_documents(*(column[0] for column in candidates), count)
+    return scores, np.zeros_like(scores), rows, doc_ids[rows]
+
+
+def federated_sections(shards, query, query_embedding, sections=SECTION_COUNT, mmr=None, executor=None,
+                       hybrid=None):
+    """
+    The best `sections` (shard number, row) pairs across many shards
+    ((chunks, index) pairs). Every shard is searched concurrently; with
+    hybrid the cosine and BM25 scores of all shards' candidates are fused
+    on one scale. Each shard's best documents are then heap-merged into one
+    ranking. A request naming documents searches only the shards holding
+    them, unless none do.
+    """
+    shards = [(chunks, index, document_ranges(chunks, query)) for chunks, index in shards]
+    if not any(ranges is not None for _, _, ranges in shards):
+        query = dict(query, documents=[])
+    count = sections if mmr is None else sections * MMR_POOL_FACTOR
+
+    def search(shard):
+        return shard_candidates(shard, query, query_embedding, count, hybrid)
+
+    if executor is None:
+        per_shard = [search(shard) for shard in shards]
+    else:
+        per_shard = list(executor.map(search, shards))
+    scores = [dense for dense, _, _, _ in per_shard]
+    if hybrid is not None and any(len(dense) for dense in scores):
+        fused = fuse_scores(np.concatenate(scores), np.concatenate([bm25 for _, bm25, _, _ in per_shard]), hybrid)
+        scores = np.split(fused, np.cumsum([len(dense) for dense in scores])[:-1])
+    ranked = []
+    for shard_number, (shard_scores, (_, _, rows, documents)) in enumerate(zip(scores, per_shard)):
+        best_rows, best_scores = top_documents(shard_scores, rows, documents, count)
+        ranked.append([(score, shard_number, row) for score, row in zip(best_scores.tolist(), best_rows.tolist())])
+    best = list(islice(heapq.merge(*ranked, key=lambda hit: -hit[0]), count))
+    if mmr is not None and best:
+        vectors = np.stack([np.asarray(shards[shard_number][1].embeddings[row], dtype=np.float32)
+                            for _, shard_number, row in best])
+        best = [best[i] for i in mmr_order(np.array([score for score, _, _ in best]), vectors, sections, mmr)]
+    return [(shard_number, row) for _, shard_number, row in best]
+
+
+def main_federated(input_json_path, shard_paths, output_json_path=None, nprobe=None, ef_search=None,
+                   rescore=None, sections=SECTION_COUNT, mmr=None, threads=SEARCH_THREADS, hybrid=None):
+    """
+    Like main, but over many stores at once, treated as shards of one
+    collection.
+    """
+    with open(input_json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    query = build_query(data)
+
+    shard_paths = list_shards(shard_paths)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        shards = list(executor.map(
+            lambda path: open_search_store(path, nprobe=nprobe, ef_search=ef_search, rescore=rescore), shard_paths
+        ))
+        query_embedding = embed_query(query["prompt"], query["persona"])
+        hits = federated_sections(shards, query, query_embedding, sections=sections, mmr=mmr, executor=executor,
+                                  hybrid=hybrid)
+
+    hit_chunks = [shards[shard_number][0][row] for shard_number, row in hits]
+    result = build_result(query, *select_sections(hit_chunks, range(len(hit_chunks)), sections))
+    write_result(result, output_json_path)
+    print(f"✅ Searched {len(shards)} vector stores")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="RAG pipeline with Unicode unescaping and optional newline removal")
-    parser.add_argument("--input", type=str, required=True, help="Input JSON filepath")
-    parser.add_argument("--vectorstore", type=str, required=True, help="Vector store .pkl filepath")
+    parser.add_argument("--input", type=str, help="Input JSON filepath")
+    parser.add_argument("--vectorstore", type=str, help="Vector store directory (or legacy .pkl filepath)")
     parser.add_argument("--output", type=str, help="Output JSON filepath (optional)")
+    parser.add_argument("--batch", nargs="+", metavar="PATH",
+                        help="Answer many input JSONs and/or JSONL request files in one run")
+    parser.add_argument("--shards", nargs="+", metavar="PATH",
+                        help="Search these vector stores (or folders of collections) together, in parallel")
+    parser.add_argument("--threads", type=int, default=SEARCH_THREADS, help="--shards: stores searched at once")
+    parser.add_argument("--output-dir", type=str, help="Batch mode: write every output here instead")
+    parser.add_argument("--nprobe", type=int, help="IVF index: lists probed per query (recall vs latency)")
+    parser.add_argument("--ef-search", type=int, help="HNSW index: search beam width (recall vs latency)")
+    parser.add_argument("--rescore", type=int,
+                        help="int8/binary index: candidates per result rescored exactly (recall vs latency)")
+    parser.add_argument("--sections", type=int, default=SECTION_COUNT,
+                        help="Sections to return, each from a different document")
+    parser.add_argument("--mmr", type=float, metavar="RELEVANCE",
+                        help="Re-rank documents by maximal marginal relevance; weight of query relevance "
+                             "against redundancy, 0-1 (e.g. 0.7)")
+    parser.add_argument("--hybrid", type=float, nargs="?", const=HYBRID_DENSE_WEIGHT, metavar="DENSE_WEIGHT",
+                        help="Take BM25 candidates from the store's lexical index and rescore only those densely; "
+                             f"the fused score weights dense similarity by DENSE_WEIGHT (default {HYBRID_DENSE_WEIGHT})")
     args = parser.parse_args()
 
-    main(args.input, args.vectorstore, args.output)
+    if args.batch:
+        requests = load_batch_requests(args.batch, args.vectorstore, args.output_dir)
+        run_batch(requests, nprobe=args.nprobe, ef_search=args.ef_search, rescore=args.rescore,
+                  sections=args.sections, mmr=args.mmr, hybrid=args.hybrid)
+    elif args.input and args.shards:
+        main_federated(args.input, args.shards, args.output, nprobe=args.nprobe, ef_search=args.ef_search,
+                       rescore=args.rescore, sections=args.sections, mmr=args.mmr, threads=args.threads,
+                       hybrid=args.hybrid)
+    elif args.input and args.vectorstore:
+        main(args.input, args.vectorstore, args.output, nprobe=args.nprobe, ef_search=args.ef_search,
+             rescore=args.rescore, sections=args.sections, mmr=args.mmr, hybrid=args.hybrid)
+    else:
+        parser.error("either --input and --vectorstore (or --shards), or --batch, is required")
@@ -0,0 +1,549 @@
+import os
+import json
+import numpy as np
+
+INDEX_FILENAME = "index.faiss"
+INDEX_META_FILENAME = "index.json"
+# Quantized indexes: codes, int8 per-dimension scales, and the row ids of
+# the codes when built over a subset of the rows
+CODES_FILENAME = "index.codes"
+SCALE_FILENAME = "index.scale"
+IDS_FILENAME = "index.ids"
+QUANTIZED_KINDS = ("int8", "binary")
+# Candidates kept per result for exact rescoring
+DEFAULT_RESCORE = 4
+
+# Rows scored per step by the exact backend; bounds the temporary score and
+# float16 -> float32 buffers regardless of corpus size.
+EXACT_BLOCK_ROWS = 65536
+
+# Set bits per byte value, for Hamming distances between packed sign codes
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def top_k_rows(scores, k):
+    """
+    Column ids of the k best scores in every row of a (q, n) matrix, best
+    first, using argpartition instead of a full sort.
+    """
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1)
+
+
+def scan_blocks(num_rows, ranges=None, block_rows=EXACT_BLOCK_ROWS):
+    """
+    [start, stop) blocks of at most block_rows rows covering ranges (the
+    whole matrix by default).
+    """
+    if ranges is None:
+        ranges = [(0, num_rows)]
+    return [(start, min(start + block_rows, stop))
+            for range_start, stop in ranges for start in range(range_start, stop, block_rows)]
+
+
+def segment_maxima(scores, segment_ids, offset=0):
+    """
+    Best score, and the row holding it, of every run of equal segment ids
+    (e.g. the chunks of one document) in a (q, n) score block. One
+    reduceat pass each, no sorting. Returns (run_scores (q, runs),
+    run_rows (q, runs), run_segments (runs,)), rows offset by offset.
+    """
+    segment_ids = np.asarray(segment_ids)
+    starts = np.concatenate([[0], np.flatnonzero(segment_ids[1:] != segment_ids[:-1]) + 1])
+    lengths = np.diff(np.append(starts, len(segment_ids)))
+    run_scores = np.maximum.reduceat(scores, starts, axis=1)
+    # First row of each run that reaches its maximum
+    is_best = scores == np.repeat(run_scores, lengths, axis=1)
+    positions = np.where(is_best, np.arange(scores.shape[1]), scores.shape[1])
+    run_rows = np.minimum.reduceat(positions, starts, axis=1) + offset
+    return run_scores, run_rows, segment_ids[starts]
+
+
+def mmr_order(query_scores, vectors, n, relevance):
+    """
+    Positions of n of the candidates, picked greedily by maximal marginal
+    relevance: relevance * query score - (1 - relevance) * the highest
+    cosine to any candidate already picked. Candidates are few, so their
+    full similarity matrix is cheap.
+    """
+    vectors = normalize_rows(vectors)
+    similarity = vectors @ vectors.T
+    picked = []
+    redundancy = np.zeros(len(query_scores), dtype=np.float32)
+    for _ in range(min(n, len(query_scores))):
+        gain = relevance * query_scores - (1 - relevance) * redundancy
+        gain[picked] = -np.inf
+        best = int(np.argmax(gain))
+        redundancy = similarity[best] if not picked else np.maximum(redundancy, similarity[best])
+        picked.append(best)
+    return picked
+
+
+def blocked_top_k(score_block, num_rows, num_queries, k, block_rows=EXACT_BLOCK_ROWS, ranges=None):
+    """
+    (scores, ids) of the k best rows per query, best first, where
+    score_block(start, stop) returns the (num_queries, stop - start) scores
+    of one block of rows; only k candidates per query are kept between
+    blocks. ranges limits the scan to those [start, stop) row ranges.
+    """
+    best_scores = np.zeros((num_queries, 0), dtype=np.float32)
+    best_ids = np.zeros((num_queries, 0), dtype=np.int64)
+    for start, stop in scan_blocks(num_rows, ranges, block_rows):
+        block_scores = score_block(start, stop)
+        candidate_scores = np.concatenate([best_scores, block_scores], axis=1)
+        candidate_ids = np.concatenate(
+            [best_ids, np.broadcast_to(np.arange(start, start + block_scores.shape[1]), block_scores.shape)],
+            axis=1
+        )
+        keep = top_k_rows(candidate_scores, k)
+        best_scores = np.take_along_axis(candidate_scores, keep, axis=1)
+        best_ids = np.take_along_axis(candidate_ids, keep, axis=1)
+    return best_scores, best_ids
+
+
+def live_top_k(search, k, size, live_mask):
+    """
+    (scores, ids) of the k best live rows per query, best first, from
+    search(n) -> (scores, ids) of the n best hits of an index that may still
+    hold tombstoned rows. The hits fetched double until every query has k
+    live ones or the whole index (size rows) was searched; missing hits
+    are padded with -1 ids and -inf scores.
+    """
+    fetch = k
+    while True:
+        fetch = min(fetch, size)
+        scores, ids = search(fetch)
+        live = (ids >= 0) & live_mask[np.maximum(ids, 0)]
+        if fetch == size or live.sum(axis=1).min(initial=k) >= k:
+            break
+        fetch *= 2
+    # Live hits first, in their original order
+    order = np.argsort(~live, axis=1, kind="stable")[:, :k]
+    scores = np.take_along_axis(np.where(live, scores, -np.inf), order, axis=1)
+    ids = np.take_along_axis(np.where(live, ids, -1), order, axis=1)
+    return scores.astype(np.float32), ids.astype(np.int64)
+
+
+class ExactIndex:
+    """
+    Brute-force cosine similarity: normalized inner product over the
+    (possibly memory-mapped) embedding matrix, scanned in blocks.
+    """
+    kind = "exact"
+
+    def __init__(self, embeddings, normalized=False, live_mask=None):
+        self.embeddings = embeddings
+        self.normalized = normalized
+        # Rows of removed documents that are still on disk score -inf
+        self.live_mask = live_mask
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def scores(self, queries, start=0, stop=None):
+        block = np.asarray(self.embeddings[start:stop], dtype=np.float32)
+        scores = queries @ block.T
+        if not self.normalized:
+            norms = np.linalg.norm(block, axis=1)
+            norms[norms == 0] = 1
+            scores /= norms
+        if self.live_mask is not None:
+            scores[:, ~self.live_mask[start:stop]] = -np.inf
+        return scores
+
+    def search(self, queries, k, ranges=None):
+        """
+        Returns (scores, ids), both (num_queries, k), best match first.
+        ranges restricts the search to those [start, stop) row ranges, which
+        are scored as slices of the matrix; cost scales with their size.
+        """
+        queries = normalize_rows(queries)
+        best_scores, best_ids = blocked_top_k(
+            lambda start, stop: self.scores(queries, start, stop), len(self.embeddings), len(queries), k,
+            ranges=ranges
+        )
+        if self.live_mask is not None:
+            # Like faiss, pad with -1 rather than return dead rows when fewer
+            # than k rows are live
+            best_ids = np.where(np.isneginf(best_scores), -1, best_ids)
+        return best_scores, best_ids
+
+    def document_maxima(self, queries, segment_ids, ranges=None):
+        """
+        segment_maxima over every scanned block: per query the best score
+        and row of each document (segment_ids holds each row's document),
+        in one linear pass over the rows. A document cut by a block
+        boundary shows up once per block.
+        """
+        queries = normalize_rows(queries)
+        results = [segment_maxima(self.scores(queries, start, stop), segment_ids[start:stop], offset=start)
+                   for start, stop in scan_blocks(len(self.embeddings), ranges)]
+        if not results:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.float32), empty.astype(np.int64), np.zeros(0, dtype=np.int64)
+        return tuple(np.concatenate(parts, axis=-1) for parts in zip(*results))
+
+
+class FaissIndex:
+    """
+    Approximate nearest-neighbour search with faiss (IVF or HNSW) over
+    normalized vectors. nprobe (IVF) and ef_search (HNSW) trade recall
+    for latency at query time.
+    """
+
+    def __init__(self, index, kind, params, embeddings=None, live_mask=None):
+        self.index = index
+        self.kind = kind
+        self.params = params
+        # The vectors themselves, for exact scans restricted to a few rows
+        self.embeddings = embeddings
+        # Rows tombstoned since they were added are dropped from the hits
+        self.live_mask = live_mask
+
+    def __len__(self):
+        return self.index.ntotal
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        if self.kind == "ivf" and nprobe:
+            self.index.nprobe = nprobe
+            self.params["nprobe"] = nprobe
+        if self.kind == "hnsw" and ef_search:
+            index = self.index
+            if not hasattr(index, "hnsw"):
+                # Wrapped in an IndexIDMap (built over a subset of rows)
+                import faiss
+                index = faiss.downcast_index(index.index)
+            index.hnsw.efSearch = ef_search
+            self.params["ef_search"] = ef_search
+
+    def search(self, queries, k, ranges=None):
+        if ranges is not None:
+            return ExactIndex(self.embeddings, normalized=True).search(queries, k, ranges)
+        queries = normalize_rows(queries)
+        if self.live_mask is not None:
+            return live_top_k(lambda n: self.index.search(queries, n), k, self.index.ntotal, self.live_mask)
+        scores, ids = self.index.search(queries, min(k, self.index.ntotal))
+        return scores, ids.astype(np.int64)
+
+    def add(self, embeddings, ids):
+        """
+        Add rows ids (ascending) of embeddings, e.g. rows appended to the
+        store since the index was built. Raises ValueError if this index
+        can't take them without a rebuild.
+        """
+        import faiss
+
+        if not len(ids):
+            return
+        vectors = normalize_rows(embeddings[ids])
+        if self.kind == "hnsw" and hasattr(self.index, "hnsw"):
+            # A plain HNSW index numbers its rows by position
+            if not np.array_equal(ids, np.arange(self.index.ntotal, self.index.ntotal + len(ids))):
+                raise ValueError("HNSW index without ids can only take the rows right after its last one")
+            self.index.add(vectors)
+        else:
+            self.index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+
+
+class QuantizedIndex:
+    """
+    Two-stage search over compact codes of the normalized vectors: int8
+    codes (per-dimension scale, 4x smaller than float32) or 1-bit sign codes
+    (32x smaller) are scanned for the rescore * k best candidates, which
+    are then rescored exactly against the float vectors. Loaded codes are
+    memory-mapped like the store; the float rows of the candidates are read
+    from the memory-mapped store.
+    """
+
+    def __init__(self, kind, codes, embeddings, params, scale=None, ids=None, live_mask=None):
+        self.kind = kind
+        self.codes = codes
+        self.embeddings = embeddings
+        self.params = params
+        self.scale = scale
+        # Row ids of the codes when they cover a subset of the rows
+        self.ids = ids
+        # Rows tombstoned since they were added are dropped from the candidates
+        self.live_mask = live_mask
+        self._scanner = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+    def set_search_params(self, rescore=None, **_):
+        if rescore:
+            self.params["rescore"] = rescore
+
+    def int8_scanner(self):
+        """
+        faiss index holding the int8 codes, which decodes them on the fly in
+        SIMD dot products instead of converting every block to float32 per
+        query; None without faiss.
+        """
+        if self._scanner is None:
+            try:
+                import faiss
+            except ImportError:
+                return None
+            scanner = faiss.IndexScalarQuantizer(self.codes.shape[1], faiss.ScalarQuantizer.QT_8bit_uniform,
+                                                 faiss.METRIC_INNER_PRODUCT)
+            # A uniform range of [-128.5, 126.5] decodes code c + 128 back to
+            # exactly c, so the scores match the NumPy scan
+            faiss.copy_array_to_vector(np.array([-128.5, 255], dtype=np.float32), scanner.sq.trained)
+            scanner.is_trained = True
+            for start in range(0, len(self.codes), EXACT_BLOCK_ROWS):
+                block = np.ascontiguousarray(self.codes[start:start + EXACT_BLOCK_ROWS])
+                scanner.add_sa_codes(block.view(np.uint8) ^ np.uint8(0x80))
+            self._scanner = scanner
+        return self._scanner
+
+    def approximate_scores(self, queries, start, stop):
+        block = np.asarray(self.codes[start:stop])
+        if self.kind == "int8":
+            # Fold the per-dimension scale into the query instead of
+            # dequantizing the codes
+            return (queries * (self.scale / 127)) @ block.T.astype(np.float32)
+        # Negated Hamming distance between sign codes, so larger is better
+        query_bits = np.packbits(queries > 0, axis=1)
+        if hasattr(np, "bitwise_count") and block.shape[1] % 8 == 0:
+            # numpy >= 2: popcount whole 64-bit words
+            block, query_bits = block.view(np.uint64), query_bits.view(np.uint64)
+            popcount = np.bitwise_count
+        else:
+            popcount = POPCOUNT.__getitem__
+        scores = np.empty((len(queries), len(block)), dtype=np.float32)
+        for i, bits in enumerate(query_bits):
+            scores[i] = -popcount(block ^ bits).sum(axis=1, dtype=np.int32)
+        return scores
+
+    def search(self, queries, k, ranges=None):
+        """
+        Returns (scores, ids), both (num_queries, k), best match first;
+        scores are exact cosine similarities. Padded with -1 when fewer than
+        k rows are indexed. A search restricted to a few row ranges scans
+        their float vectors directly.
+        """
+        if ranges is not None:
+            return ExactIndex(self.embeddings, normalized=True).search(queries, k, ranges)
+        queries = normalize_rows(queries)
+        candidates = min(len(self), k * self.params.get("rescore", DEFAULT_RESCORE))
+        if self.live_mask is not None:
+            _, rows = live_top_k(lambda n: self.candidates(queries, n), candidates, len(self), self.live_mask)
+        else:
+            _, rows = self.candidates(queries, candidates)
+
+        k = min(k, rows.shape[1])
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, query in enumerate(queries):
+            query_rows = rows[i][rows[i] >= 0]
+            candidate_scores = np.asarray(self.embeddings[query_rows], dtype=np.float32) @ query
+            best = top_k_rows(candidate_scores[None, :], k)[0]
+            scores[i, :len(best)] = candidate_scores[best]
+            ids[i, :len(best)] = query_rows[best]
+        return scores, ids
+
+    def candidates(self, queries, count):
+        # (approximate scores, rows) of the count best codes per query
+        scanner = self.int8_scanner() if self.kind == "int8" and count else None
+        if scanner is not None:
+            scores, positions = scanner.search(np.ascontiguousarray(queries * (self.scale / 127)), count)
+        else:
+            scores, positions = blocked_top_k(
+                lambda start, stop: self.approximate_scores(queries, start, stop), len(self), len(queries), count
+            )
+        return scores, positions if self.ids is None else self.ids[positions]
+
+    def add(self, embeddings, ids):
+        """
+        Add the codes of rows ids (ascending) of embeddings, quantized with
+        the existing scale (values past it are clipped; rescoring is exact).
+        """
+        if not len(ids):
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        codes = quantize_rows(embeddings, ids, self.kind, self.scale)
+        if self.ids is None and not np.array_equal(ids, np.arange(len(self.codes), len(self.codes) + len(ids))):
+            self.ids = np.arange(len(self.codes), dtype=np.int64)
+        if self.ids is not None:
+            self.ids = np.concatenate([self.ids, ids])
+        self.codes = np.concatenate([np.asarray(self.codes), codes])
+        self._scanner = None
+
+    def save(self, store_dir):
+        np.ascontiguousarray(self.codes).tofile(os.path.join(store_dir, CODES_FILENAME))
+        for filename, values in ((SCALE_FILENAME, self.scale), (IDS_FILENAME, self.ids)):
+            path = os.path.join(store_dir, filename)
+            if values is not None:
+                values.tofile(path)
+            elif os.path.exists(path):
+                os.remove(path)
+
+    @classmethod
+    def load(cls, store_dir, kind, params, embeddings, live_mask=None):
+        dim = embeddings.shape[1]
+        width = dim if kind == "int8" else (dim + 7) // 8
+        dtype = np.int8 if kind == "int8" else np.uint8
+        codes = np.memmap(os.path.join(store_dir, CODES_FILENAME), dtype=dtype, mode="r").reshape(-1, width)
+        scale_path = os.path.join(store_dir, SCALE_FILENAME)
+        ids_path = os.path.join(store_dir, IDS_FILENAME)
+        scale = np.fromfile(scale_path, dtype=np.float32) if os.path.exists(scale_path) else None
+        ids = np.fromfile(ids_path, dtype=np.int64) if os.path.exists(ids_path) else None
+        # The codes stay memory-mapped; int8 codes are copied into the faiss
+        # scanner only when the first full scan needs it
+        return cls(kind, codes, embeddings, params, scale=scale, ids=ids, live_mask=live_mask)
+
+
+def build_quantized_index(embeddings, kind="int8", rescore=DEFAULT_RESCORE, ids=None):
+    """
+    ids optionally restricts the index to those rows of embeddings; results
+    still carry the original row numbers.
+    """
+    if kind not in QUANTIZED_KINDS:
+        raise ValueError(f"Unknown index kind: {kind}")
+    row_ids = np.arange(len(embeddings)) if ids is None else np.asarray(ids, dtype=np.int64)
+    dim = embeddings.shape[1]
+
+    scale = None
+    if kind == "int8":
+        # Per-dimension max magnitude, so each dimension uses the full int8 range
+        scale = np.zeros(dim, dtype=np.float32)
+        for start in range(0, len(row_ids), EXACT_BLOCK_ROWS):
+            block = normalize_rows(embeddings[row_ids[start:start + EXACT_BLOCK_ROWS]])
+            scale = np.maximum(scale, np.abs(block).max(axis=0))
+        scale[scale == 0] = 1
+
+    codes = quantize_rows(embeddings, row_ids, kind, scale)
+    return QuantizedIndex(kind, codes, embeddings, {"rescore": rescore}, scale=scale,
+                          ids=None if ids is None else row_ids)
+
+
+def quantize_rows(embeddings, row_ids, kind, scale=None):
+    # int8 codes (scaled per dimension) or packed sign bits of those rows
+    dim = embeddings.shape[1]
+    width = dim if kind == "int8" else (dim + 7) // 8
+    codes = np.empty((len(row_ids), width), dtype=np.int8 if kind == "int8" else np.uint8)
+    for start in range(0, len(row_ids), EXACT_BLOCK_ROWS):
+        block = normalize_rows(embeddings[row_ids[start:start + EXACT_BLOCK_ROWS]])
+        if kind == "int8":
+            codes[start:start + len(block)] = np.clip(np.rint(block / scale * 127), -127, 127)
+        else:
+            codes[start:start + len(block)] = np.packbits(block > 0, axis=1)
+    return codes
+
+
+def build_index(embeddings, kind, ids=None, **params):
+    if kind in QUANTIZED_KINDS:
+        return build_quantized_index(embeddings, kind, ids=ids, **params)
+    return build_faiss_index(embeddings, kind, ids=ids, **params)
+
+
+def build_faiss_index(embeddings, kind="ivf", nlist=None, nprobe=8, hnsw_m=32, ef_construction=200, ef_search=64,
+                      ids=None):
+    """
+    ids optionally restricts the index to those rows of embeddings (e.g. the
+    live rows of an incrementally updated store); results still carry the
+    original row numbers.
+    """
+    import faiss
+
+    dim = embeddings.shape[1]
+    count = len(embeddings) if ids is None else len(ids)
+    if kind == "ivf":
+        # ~sqrt(N) lists is the usual starting point; faiss needs at least
+        # one training vector per list
+        nlist = min(nlist or max(1, int(np.sqrt(count))), count)
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(normalize_rows(embeddings if ids is None else embeddings[ids]))
+        params = {"nlist": nlist}
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        params = {"hnsw_m": hnsw_m, "ef_construction": ef_construction}
+    else:
+        raise ValueError(f"Unknown index kind: {kind}")
+
+    if ids is None:
+        for start in range(0, len(embeddings), EXACT_BLOCK_ROWS):
+            index.add(normalize_rows(embeddings[start:start + EXACT_BLOCK_ROWS]))
+    else:
+        # HNSW has no add_with_ids of its own
+        index = faiss.IndexIDMap(index) if kind == "hnsw" else index
+        for start in range(0, len(ids), EXACT_BLOCK_ROWS):
+            block_ids = np.asarray(ids[start:start + EXACT_BLOCK_ROWS], dtype=np.int64)
+            index.add_with_ids(normalize_rows(embeddings[block_ids]), block_ids)
+    faiss_index = FaissIndex(index, kind, params, embeddings)
+    faiss_index.set_search_params(nprobe=nprobe, ef_search=ef_search)
+    return faiss_index
+
+
+def save_index(index, store_dir, count=None):
+    """
+    count, the store rows the index has seen, lets later updates add only
+    the rows appended after it.
+    """
+    if index.kind in QUANTIZED_KINDS:
+        index.save(store_dir)
+    else:
+        import faiss
+
+        faiss.write_index(index.index, os.path.join(store_dir, INDEX_FILENAME))
+    with open(os.path.join(store_dir, INDEX_META_FILENAME), "w", encoding="utf-8") as f:
+        json.dump({"kind": index.kind, "params": index.params, "count": count}, f, indent=2)
+
+
+def load_index(store_dir, embeddings, normalized=False, nprobe=None, ef_search=None, live_mask=None,
+               rescore=None):
+    """
+    The approximate index saved next to the store if there is one,
+    otherwise an exact index over the embeddings.
+    """
+    meta_path = os.path.join(store_dir, INDEX_META_FILENAME)
+    if not os.path.exists(meta_path):
+        return ExactIndex(embeddings, normalized, live_mask=live_mask)
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta["kind"] in QUANTIZED_KINDS:
+        quantized_index = QuantizedIndex.load(store_dir, meta["kind"], meta["params"], embeddings, live_mask)
+        quantized_index.set_search_params(rescore=rescore)
+        return quantized_index
+    import faiss
+
+    index = faiss.read_index(os.path.join(store_dir, INDEX_FILENAME))
+    faiss_index = FaissIndex(index, meta["kind"], meta["params"], embeddings, live_mask)
+    faiss_index.set_search_params(
+        nprobe=nprobe or meta["params"].get("nprobe"),
+        ef_search=ef_search or meta["params"].get("ef_search")
+    )
+    return faiss_index
+
+
+def recall_at_k(index, exact_index, queries, k=10):
+    """
+    Mean fraction of the exact top-k that the index also returns.
+    """
+    _, approx_ids = index.search(queries, k)
+    _, exact_ids = exact_index.search(queries, k)
+    hits = [len(set(a.tolist()) & set(e.tolist())) / max(1, len(e)) for a, e in zip(approx_ids, exact_ids)]
+    return float(np.mean(hits))
@@ -1,27 +1,833 @@
-import sys
+import argparse
+import hashlib
 import os
+import json
 import pickle
-from sentence_transformers import SentenceTransformer
-from pdf_loader import load_documents_from_directory, chunk_text
+import queue
+import shutil
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from chunk_embedder import DEFAULT_BATCH_SIZE, ChunkEncoder
+from lexical_index import (LEXICAL_FILENAMES, LEXICAL_META_FILENAME, LexicalIndex, append_lexical_index,
+                           build_lexical_index)
+from model_registry import MODEL_NAME
+from pdf_loader import CHUNK_OVERLAP, CHUNK_TOKENS, CHUNKING_VERSION, chunk_string, list_pdfs, load_chunks_from_file
+from vector_index import (CODES_FILENAME, DEFAULT_RESCORE, ExactIndex, IDS_FILENAME, INDEX_FILENAME,
+                          INDEX_META_FILENAME, QUANTIZED_KINDS, SCALE_FILENAME, build_index, save_index, load_index,
+                          normalize_rows, recall_at_k)
 
-def embed_and_store(input_dir: str, output_dir: str):
-    documents = load_documents_from_directory(input_dir)
-    chunks = chunk_text(documents)
+# On-disk store layout (one directory per store):
+#   header.json        format version, model name, chunking version and
+#                      parameters, dimension, row count, live row count, dtype
+#   embeddings.bin     raw (count, dim) float32/float16 matrix of unit vectors,
+#                      opened with np.memmap
+#   documents.json     per document: file name, contiguous row range, SHA-256
+#                      of the PDF and whether it is still live
+#   chunk_doc.bin      uint32 index into documents.json per chunk
+#   chunk_page.bin     int32 page number per chunk
+#   text.bin           UTF-8 page texts, each stored once however many
+#                      (overlapping) chunks cut it
+#   text.span          uint64 [start, stop) byte range of each chunk in text.bin
+#                      (format 1/2 stores: text.off, one blob entry per chunk)
+#   section.off/.bin   uint64 offsets into the UTF-8 section title blob
+#   index.faiss/.json  optional approximate index (see vector_index.py), or
+#   index.codes/.json  int8 / 1-bit codes for two-stage quantized search
+#   lexical.*          BM25 inverted index over the live chunks' text (see
+#                      lexical_index.py), rebuilt whenever the store changes
+#
+# update_store() only appends: rows of removed or changed documents stay on
+# disk as tombstones (live=false) until the store is compacted. Rows past
+# the header count are leftovers of an interrupted update and are ignored.
+STORE_FORMAT_VERSION = 3
+READABLE_FORMAT_VERSIONS = (1, 2, 3)
+STORE_DIRNAME = "vector_store"
+# Compact once this fraction of the rows belongs to removed documents
+COMPACT_THRESHOLD = 0.25
 
-    if not chunks:
-        raise ValueError("No text chunks found. Check input folder or file types.")
+# Ingestion: PDFs parsed concurrently with embedding, parsed files allowed
+# to wait for the embedder, and chunks embedded and appended per write
+PARSE_WORKERS = min(4, os.cpu_count() or 1)
+PARSE_QUEUE_SIZE = 4
+WRITE_BATCH_CHUNKS = 1024
+
+
+def append_string_column(store_dir, name, strings, count):
+    """
+    Append strings after the first count values, dropping anything an
+    interrupted update left behind.
+    """
+    offsets_path = os.path.join(store_dir, name + ".off")
+    position = int(np.fromfile(offsets_path, dtype=np.uint64, count=count + 1)[count])
+    offsets = np.zeros(len(strings), dtype=np.uint64)
+    with open(os.path.join(store_dir, name + ".bin"), "r+b") as f:
+        f.truncate(position)
+        f.seek(position)
+        for i, value in enumerate(strings):
+            data = value.encode("utf-8")
+            f.write(data)
+            position += len(data)
+            offsets[i] = position
+    append_rows(offsets_path, offsets, count + 1)
+
+
+def append_span_column(store_dir, name, sources, count):
+    """
+    Append rows given as (text, char_start, char_end) after the first
+    count rows. Rows cutting the same text object share one copy of the
+    part of it they cover; each row stores its byte range in the blob.
+    """
+    spans_path = os.path.join(store_dir, name + ".span")
+    position = int(np.fromfile(spans_path, dtype=np.uint64, count=count * 2).max()) if count else 0
+    spans = np.zeros((len(sources), 2), dtype=np.uint64)
+    rows_by_text = {}
+    for i, (text, _, _) in enumerate(sources):
+        rows_by_text.setdefault(id(text), []).append(i)
+    with open(os.path.join(store_dir, name + ".bin"), "r+b") as f:
+        f.truncate(position)
+        f.seek(position)
+        for rows in rows_by_text.values():
+            text = sources[rows[0]][0]
+            low = min(sources[i][1] for i in rows)
+            high = max(sources[i][2] for i in rows)
+            for i in rows:
+                _, start, stop = sources[i]
+                spans[i, 0] = position + len(text[low:start].encode("utf-8"))
+                spans[i, 1] = spans[i, 0] + len(text[start:stop].encode("utf-8"))
+            data = text[low:high].encode("utf-8")
+            f.write(data)
+            position += len(data)
+    append_rows(spans_path, spans, count)
+
+
+def append_rows(path, array, count):
+    # Keep the first count rows of a fixed-width column file, then append
+    itemsize = array.itemsize * (array.shape[1] if array.ndim == 2 else 1)
+    with open(path, "r+b") as f:
+        f.truncate(count * itemsize)
+        f.seek(count * itemsize)
+        f.write(np.ascontiguousarray(array).tobytes())
+
+
+class StringColumn:
+    """
+    Strings stored as one UTF-8 blob plus either consecutive offsets
+    (name.off) or per-row byte ranges that may overlap (name.span); each
+    value is decoded only when it is read.
+    """
+
+    def __init__(self, store_dir, name):
+        span_path = os.path.join(store_dir, name + ".span")
+        if os.path.exists(span_path):
+            spans = memmap_or_empty(span_path, np.uint64).reshape(-1, 2)
+            self.starts, self.stops = spans[:, 0], spans[:, 1]
+        else:
+            offsets = np.memmap(os.path.join(store_dir, name + ".off"), dtype=np.uint64, mode="r")
+            self.starts, self.stops = offsets[:-1], offsets[1:]
+        self.blob = memmap_or_empty(os.path.join(store_dir, name + ".bin"), np.uint8)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, idx):
+        start, stop = int(self.starts[idx]), int(self.stops[idx])
+        return self.blob[start:stop].tobytes().decode("utf-8")
+
+
+def memmap_or_empty(path, dtype):
+    # np.memmap can't map an empty file
+    if os.path.getsize(path):
+        return np.memmap(path, dtype=dtype, mode="r")
+    return np.zeros(0, dtype=dtype)
+
+
+class ChunkTable:
+    """
+    Read-only sequence of chunk dicts ({"filename", "page_number",
+    "section_title", "text"}) backed by the store files.
+    """
+
+    def __init__(self, store_dir, count=None):
+        self.store_dir = store_dir
+        self._lexical = None
+        with open(os.path.join(store_dir, "documents.json"), "r", encoding="utf-8") as f:
+            self.filenames = json.load(f)["filenames"]
+        self.doc_ids = np.memmap(os.path.join(store_dir, "chunk_doc.bin"), dtype=np.uint32, mode="r")[:count]
+        self.documents = read_documents(store_dir, len(self.doc_ids))
+        self.pages = np.memmap(os.path.join(store_dir, "chunk_page.bin"), dtype=np.int32, mode="r")[:count]
+        self.texts = StringColumn(store_dir, "text")
+        self.section_titles = StringColumn(store_dir, "section")
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __getitem__(self, idx):
+        return {
+            "filename": self.filenames[self.doc_ids[idx]],
+            "page_number": int(self.pages[idx]),
+            "section_title": self.section_titles[idx],
+            "text": self.texts[idx]
+        }
+
+    def document_ranges(self, filenames=None):
+        """
+        Sorted [start, stop) row ranges of the live documents with these
+        file names (of every live document by default).
+        """
+        wanted = None if filenames is None else set(filenames)
+        return sorted(tuple(doc["rows"]) for doc in self.documents
+                      if doc["live"] and (wanted is None or doc["filename"] in wanted)
+                      and doc["rows"][1] > doc["rows"][0])
+
+    def lexical_index(self):
+        """
+        The store's LexicalIndex, or None if it has none or the index
+        predates the last change to the rows.
+        """
+        if self._lexical is None:
+            if not os.path.exists(os.path.join(self.store_dir, LEXICAL_META_FILENAME)):
+                return None
+            lexical = LexicalIndex(self.store_dir)
+            live_rows = sum(doc["rows"][1] - doc["rows"][0] for doc in self.documents if doc["live"])
+            if lexical.meta["count"] != len(self) or lexical.meta["indexed_rows"] > live_rows:
+                return None
+            self._lexical = lexical
+        return self._lexical
+
+
+class VectorStore:
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, "header.json"), "r", encoding="utf-8") as f:
+            self.header = json.load(f)
+        if self.header["format_version"] not in READABLE_FORMAT_VERSIONS:
+            raise ValueError(f"Unsupported vector store format {self.header['format_version']} in {store_dir}")
+        self.store_dir = store_dir
+        self.embeddings = np.memmap(
+            os.path.join(store_dir, "embeddings.bin"),
+            dtype=self.header["dtype"],
+            mode="r",
+            shape=(self.header["count"], self.header["dim"])
+        )
+        self.chunks = ChunkTable(store_dir, self.header["count"])
+        self.documents = self.chunks.documents
+
+    def __len__(self):
+        return self.header["count"]
+
+    def live_mask(self):
+        """
+        Boolean mask of the rows of live documents, or None when every row is
+        live.
+        """
+        if all(doc["live"] for doc in self.documents):
+            return None
+        mask = np.zeros(len(self), dtype=bool)
+        for doc in self.documents:
+            if doc["live"]:
+                mask[doc["rows"][0]:doc["rows"][1]] = True
+        return mask
+
+    def open_index(self, nprobe=None, ef_search=None, rescore=None):
+        return load_index(self.store_dir, self.embeddings, normalized=True, nprobe=nprobe, ef_search=ef_search,
+                          live_mask=self.live_mask(), rescore=rescore)
+
+
+def read_documents(store_dir, count):
+    """
+    [{"filename", "rows": [start, stop], "sha256", "live"}] per document.
+    Format 1 stores only have file names; their row ranges are recovered
+    from chunk_doc.bin.
+    """
+    with open(os.path.join(store_dir, "documents.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    filenames = meta["filenames"]
+    if "rows" not in meta:
+        doc_ids = np.fromfile(os.path.join(store_dir, "chunk_doc.bin"), dtype=np.uint32, count=count)
+        starts = np.searchsorted(doc_ids, np.arange(len(filenames)), side="left")
+        stops = np.searchsorted(doc_ids, np.arange(len(filenames)), side="right")
+        meta["rows"] = [[int(start), int(stop)] for start, stop in zip(starts, stops)]
+    return [
+        {
+            "filename": filename,
+            "rows": [min(meta["rows"][i][0], count), min(meta["rows"][i][1], count)],
+            "sha256": meta.get("sha256", [None] * len(filenames))[i],
+            "live": meta.get("live", [True] * len(filenames))[i]
+        }
+        for i, filename in enumerate(filenames)
+    ]
+
+
+def write_documents(store_dir, documents):
+    path = os.path.join(store_dir, "documents.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({
+            "filenames": [doc["filename"] for doc in documents],
+            "rows": [doc["rows"] for doc in documents],
+            "sha256": [doc["sha256"] for doc in documents],
+            "live": [doc["live"] for doc in documents]
+        }, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def chunking_params(max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+    # Recorded in the header; a store chunked differently is rebuilt, not updated
+    return {"chunking_version": CHUNKING_VERSION, "chunk_tokens": max_tokens, "chunk_overlap": overlap}
+
+
+def write_header(store_dir, model_name, dim, count, live_count, dtype, chunking):
+    header = {
+        "format_version": STORE_FORMAT_VERSION,
+        "model_name": model_name,
+        **chunking,
+        "normalized": True,
+        "dim": int(dim),
+        "count": int(count),
+        "live_count": int(live_count),
+        "dtype": str(dtype)
+    }
+    header_path = os.path.join(store_dir, "header.json")
+    with open(header_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(header, f, indent=2)
+    os.replace(header_path + ".tmp", header_path)
+
+
+def group_by_document(chunks, start=0, first_doc_id=0):
+    """
+    Stable row order that keeps each document's chunks contiguous, the
+    per-row document ids, and each document's file name and row range.
+    """
+    doc_index = {}
+    for chunk in chunks:
+        doc_index.setdefault(chunk["filename"], len(doc_index))
+    local_ids = np.array([doc_index[chunk["filename"]] for chunk in chunks], dtype=np.uint32)
+    order = np.argsort(local_ids, kind="stable")
+    counts = np.bincount(local_ids, minlength=len(doc_index))
+    stops = start + np.cumsum(counts)
+    documents = [
+        {"filename": filename, "rows": [int(stop - count), int(stop)]}
+        for filename, count, stop in zip(doc_index, counts, stops)
+    ]
+    return order, local_ids[order] + first_doc_id, documents
+
+
+class StoreWriter:
+    """
+    Appends batches of chunks and their embeddings to a store's column
+    files. documents.json and the header are only written by close(), so
+    readers keep seeing the previous complete state until then.
+    """
+
+    def __init__(self, store_dir, documents=(), count=0, dim=None, dtype="float32", model_name=MODEL_NAME,
+                 chunking=None):
+        self.store_dir = store_dir
+        self.documents = list(documents)
+        self.count = count
+        self.dim = dim
+        self.dtype = dtype
+        self.model_name = model_name
+        self.chunking = chunking or chunking_params()
+
+    @classmethod
+    def create(cls, store_dir, dtype="float32", model_name=MODEL_NAME, chunking=None):
+        """
+        Start an empty store, replacing whatever store_dir held.
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        for name in ("header.json", INDEX_FILENAME, INDEX_META_FILENAME, CODES_FILENAME, SCALE_FILENAME, IDS_FILENAME,
+                     "text.off", *LEXICAL_FILENAMES):
+            if os.path.exists(os.path.join(store_dir, name)):
+                os.remove(os.path.join(store_dir, name))
+        for name in ("embeddings.bin", "chunk_doc.bin", "chunk_page.bin", "text.bin", "text.span", "section.bin"):
+            open(os.path.join(store_dir, name), "wb").close()
+        np.zeros(1, dtype=np.uint64).tofile(os.path.join(store_dir, "section.off"))
+        return cls(store_dir, dtype=dtype, model_name=model_name, chunking=chunking)
+
+    def append(self, chunks, embeddings, sha256=None):
+        """
+        sha256 maps file names to the hash of the PDF they were read from; it
+        lets update_store() tell unchanged documents apart. A document's
+        chunks must all arrive in the same call, so its rows stay contiguous.
+        """
+        if len(chunks) != len(embeddings):
+            raise ValueError("Every chunk needs exactly one embedding.")
+        documents = self._append_rows(chunks, embeddings, sha256) if chunks else []
+        # Files that produced no chunks (blank or scanned PDFs) still get an
+        # entry with an empty row range, so update_store() knows them
+        chunked = {doc["filename"] for doc in documents}
+        for filename, digest in (sha256 or {}).items():
+            if filename not in chunked:
+                self.documents.append({"filename": filename, "rows": [self.count, self.count], "sha256": digest,
+                                       "live": True})
+
+    def _append_rows(self, chunks, embeddings, sha256):
+        order, doc_ids, documents = group_by_document(chunks, start=self.count, first_doc_id=len(self.documents))
+        chunks = [chunks[i] for i in order]
+        # Rows are stored unit-length so cosine similarity is a plain dot product
+        embeddings = np.ascontiguousarray(normalize_rows(embeddings)[order], dtype=self.dtype)
+        for doc in documents:
+            doc["sha256"] = (sha256 or {}).get(doc["filename"])
+            doc["live"] = True
+
+        store_dir = self.store_dir
+        append_rows(os.path.join(store_dir, "embeddings.bin"), embeddings, self.count)
+        append_rows(os.path.join(store_dir, "chunk_doc.bin"), doc_ids, self.count)
+        append_rows(os.path.join(store_dir, "chunk_page.bin"),
+                    np.array([chunk["page_number"] for chunk in chunks], dtype=np.int32), self.count)
+        append_span_column(store_dir, "text", [chunk_source(chunk) for chunk in chunks], self.count)
+        append_string_column(store_dir, "section", [chunk["section_title"] for chunk in chunks], self.count)
+        self.documents.extend(documents)
+        self.count += len(chunks)
+        self.dim = embeddings.shape[1]
+        return documents
+
+    def live_count(self):
+        return sum(doc["rows"][1] - doc["rows"][0] for doc in self.documents if doc["live"])
+
+    def close(self):
+        write_documents(self.store_dir, self.documents)
+        # The header goes last, so a store with a header is always complete
+        write_header(self.store_dir, self.model_name, self.dim, self.count, self.live_count(), self.dtype,
+                     self.chunking)
+
+
+def chunk_source(chunk):
+    # (text, char_start, char_end) of a chunk; plain {"text"} chunks cover their whole string
+    if "page_text" in chunk:
+        return chunk["page_text"], chunk["char_start"], chunk["char_end"]
+    return chunk["text"], 0, len(chunk["text"])
 
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    embeddings = model.encode([chunk["text"] for chunk in chunks], show_progress_bar=True)
 
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, "vector_store.pkl")
-    with open(output_path, "wb") as f:
-        pickle.dump((chunks, embeddings), f)
+def write_store(store_dir, chunks, embeddings, model_name=MODEL_NAME, dtype="float32", sha256=None,
+                chunking=None):
+    writer = StoreWriter.create(store_dir, dtype=dtype, model_name=model_name, chunking=chunking)
+    writer.append(chunks, embeddings, sha256)
+    writer.close()
+
+
+def open_store(store_dir):
+    return VectorStore(store_dir)
+
+
+def convert_pickle_store(pkl_path, store_dir=None, dtype="float32"):
+    """
+    One-time conversion of a legacy vector_store.pkl into the memory-mapped
+    format, written next to it unless store_dir is given.
+    """
+    with open(pkl_path, "rb") as f:
+        chunks, embeddings = pickle.load(f)
+    store_dir = store_dir or os.path.join(os.path.dirname(pkl_path), STORE_DIRNAME)
+    # Legacy stores hold 500-word chunks; update_store() rebuilds them
+    write_store(store_dir, chunks, np.asarray(embeddings), dtype=dtype, chunking={"chunking_version": 1})
+    print(f"✅ Converted {pkl_path} to {store_dir}")
+    build_store_lexical(store_dir)
+    return store_dir
+
+
+def build_store_index(store_dir, kind, sample_queries=200, k=10, **params):
+    """
+    Build an approximate (faiss) or quantized index for a written store,
+    save it next to the vectors and report its recall@k against exact
+    search, using a sample of the stored vectors as queries.
+    """
+    store = open_store(store_dir)
+    live_mask = store.live_mask()
+    live_ids = None if live_mask is None else np.flatnonzero(live_mask)
+    index = build_index(store.embeddings, kind, ids=live_ids, **params)
+    save_index(index, store_dir, count=len(store))
+    rng = np.random.default_rng(0)
+    candidates = np.arange(len(store)) if live_ids is None else live_ids
+    sample = rng.choice(candidates, size=min(sample_queries, len(candidates)), replace=False)
+    exact = ExactIndex(store.embeddings, normalized=True, live_mask=live_mask)
+    recall = recall_at_k(index, exact, store.embeddings[np.sort(sample)], k)
+    print(f"✅ {kind} index saved to {store_dir} (recall@{k} vs exact: {recall:.3f})")
+    if kind in QUANTIZED_KINDS:
+        float_bytes = len(index) * store.header["dim"] * np.dtype(store.header["dtype"]).itemsize
+        print(f"   {index.nbytes / 2**20:.1f} MiB of codes scanned instead of {float_bytes / 2**20:.1f} MiB of vectors "
+              f"({float_bytes / max(1, index.nbytes):.0f}x smaller), top {params.get('rescore', DEFAULT_RESCORE)}*k "
+              f"rescored exactly")
+    return recall
+
+
+def build_store_lexical(store_dir):
+    """
+    Build the BM25 inverted index over the text of a written store's live
+    chunks and save it next to the vectors.
+    """
+    store = open_store(store_dir)
+    live_mask = store.live_mask()
+    rows = range(len(store)) if live_mask is None else np.flatnonzero(live_mask).tolist()
+    terms = build_lexical_index(store_dir, ((row, store.chunks.texts[row]) for row in rows), len(store))
+    lexical = LexicalIndex(store_dir)
+    print(f"✅ Lexical index saved to {store_dir} ({terms} terms, {len(lexical.postings)} postings, "
+          f"{lexical.nbytes / 2**20:.1f} MiB)")
+
+
+def update_store_index(store_dir, kind, **params):
+    """
+    Add the rows appended to a store since its approximate or quantized
+    index was saved, instead of rebuilding it; rows tombstoned since are
+    filtered out at query time. Falls back to a full build when the index
+    can't take the new rows.
+    """
+    with open(os.path.join(store_dir, INDEX_META_FILENAME), "r", encoding="utf-8") as f:
+        indexed = json.load(f).get("count")
+    store = open_store(store_dir)
+    if indexed is None or indexed > len(store):
+        build_store_index(store_dir, kind, **params)
+        return
+    live_mask = store.live_mask()
+    new_rows = np.arange(indexed, len(store))
+    if live_mask is not None:
+        new_rows = new_rows[live_mask[indexed:]]
+    if not len(new_rows):
+        return
+    index = store.open_index()
+    try:
+        index.add(store.embeddings, new_rows)
+    except ValueError:
+        build_store_index(store_dir, kind, **params)
+        return
+    save_index(index, store_dir, count=len(store))
+    print(f"✅ Added {len(new_rows)} rows to the {kind} index in {store_dir}")
+
+
+def update_store_lexical(store_dir):
+    """
+    Add the text of the rows appended to a store since its lexical index
+    was saved, and zero the lengths of rows tombstoned since, instead of
+    re-tokenizing every live row.
+    """
+    meta_path = os.path.join(store_dir, LEXICAL_META_FILENAME)
+    if not os.path.exists(meta_path):
+        build_store_lexical(store_dir)
+        return
+    with open(meta_path, "r", encoding="utf-8") as f:
+        indexed = json.load(f)["count"]
+    store = open_store(store_dir)
+    if indexed > len(store):
+        build_store_lexical(store_dir)
+        return
+    live_mask = store.live_mask()
+    new_rows = range(indexed, len(store)) if live_mask is None else indexed + np.flatnonzero(live_mask[indexed:])
+    dead_rows = [] if live_mask is None else np.flatnonzero(~live_mask[:indexed])
+    append_lexical_index(store_dir, ((int(row), store.chunks.texts[row]) for row in new_rows), len(store),
+                         dead_rows)
+    print(f"✅ Added {len(new_rows)} rows to the lexical index in {store_dir}")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def pdf_hashes(input_dir):
+    return {filename: file_sha256(os.path.join(input_dir, filename)) for filename in list_pdfs(input_dir)}
+
+
+def parse_pdf(file_path, chunk_tokens=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP):
+    # Runs in a parsing worker process
+    chunks = load_chunks_from_file(file_path, max_tokens=chunk_tokens, overlap=chunk_overlap)
+    return os.path.basename(file_path), file_sha256(file_path), chunks
+
+
+def iter_parsed_pdfs(input_dir, filenames, workers=PARSE_WORKERS, queue_size=PARSE_QUEUE_SIZE,
+                     chunk_tokens=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP):
+    """
+    Yield (filename, sha256, chunks) per PDF, in the order of filenames.
+    A background thread keeps the parsing workers busy and hands finished
+    files over through a bounded queue, so parsing runs ahead of the
+    consumer by at most queue_size files and memory stays flat.
+    """
+    results = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # Give up once the consumer has gone away
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def produce():
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = deque()
+                for filename in filenames:
+                    if stop.is_set():
+                        break
+                    pending.append(executor.submit(parse_pdf, os.path.join(input_dir, filename),
+                                                   chunk_tokens, chunk_overlap))
+                    if len(pending) > workers:
+                        put(pending.popleft().result())
+                while pending and not stop.is_set():
+                    put(pending.popleft().result())
+                for future in pending:
+                    future.cancel()
+        except Exception as e:
+            put(e)
+        put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def ingest_pdfs(writer, input_dir, filenames, batch_size=DEFAULT_BATCH_SIZE, encode_workers=1,
+                parse_workers=PARSE_WORKERS, write_batch=WRITE_BATCH_CHUNKS):
+    """
+    Parse, embed and append the given PDFs to writer as a pipeline: the
+    embedder works on one batch of whole documents while the next files are
+    being parsed. Returns the number of chunks written.
+    """
+    written = 0
+    pending, pending_hashes = [], {}
+    with ChunkEncoder(batch_size, encode_workers) as encoder:
+        def flush():
+            nonlocal written, pending, pending_hashes
+            if pending_hashes:
+                texts = [chunk_string(chunk) for chunk in pending]
+                writer.append(pending, encoder.encode(texts, [chunk["token_count"] for chunk in pending]),
+                              pending_hashes)
+                written += len(pending)
+            pending, pending_hashes = [], {}
+
+        parsed = iter_parsed_pdfs(input_dir, filenames, workers=parse_workers,
+                                  chunk_tokens=writer.chunking["chunk_tokens"],
+                                  chunk_overlap=writer.chunking["chunk_overlap"])
+        for filename, digest, chunks in parsed:
+            pending.extend(chunks)
+            pending_hashes[filename] = digest
+            if len(pending) >= write_batch:
+                flush()
+        flush()
+    return written
+
+
+def embed_and_store(input_dir: str, output_dir: str, dtype: str = "float32", index_kind: str = "exact",
+                    batch_size: int = DEFAULT_BATCH_SIZE, encode_workers: int = 1, parse_workers: int = PARSE_WORKERS,
+                    write_batch: int = WRITE_BATCH_CHUNKS, chunk_tokens: int = CHUNK_TOKENS,
+                    chunk_overlap: int = CHUNK_OVERLAP, **index_params):
+    output_path = os.path.join(output_dir, STORE_DIRNAME)
+    writer = StoreWriter.create(output_path, dtype=dtype, chunking=chunking_params(chunk_tokens, chunk_overlap))
+    written = ingest_pdfs(writer, input_dir, list_pdfs(input_dir), batch_size=batch_size,
+                          encode_workers=encode_workers, parse_workers=parse_workers, write_batch=write_batch)
+
+    if not written:
+        raise ValueError("No text chunks found. Check input folder or file types.")
+    writer.close()
 
     print(f"✅ Vector store saved to {output_path}")
+    build_store_lexical(output_path)
+    if index_kind != "exact":
+        build_store_index(output_path, index_kind, **index_params)
+
+
+def saved_index_params(store_dir):
+    # Kind and build parameters of the approximate index saved with a store
+    meta_path = os.path.join(store_dir, INDEX_META_FILENAME)
+    if not os.path.exists(meta_path):
+        return "exact", {}
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return meta["kind"], meta["params"]
+
+
+def copy_row_ranges(array, ranges, path):
+    # Write rows [start, stop) of each range of array to path, one range at a time
+    with open(path, "wb") as f:
+        for start, stop in ranges:
+            f.write(np.ascontiguousarray(array[start:stop]).tobytes())
+
+
+def copy_string_ranges(column, ranges, path):
+    """
+    Copy the blob bytes covered by each row range of a StringColumn to path
+    as they are stored, so text shared by overlapping rows is copied once.
+    Returns the rows' (start, stop) byte ranges in the new blob.
+    """
+    spans = []
+    position = 0
+    with open(path, "wb") as f:
+        for start, stop in ranges:
+            starts = np.asarray(column.starts[start:stop], dtype=np.int64)
+            stops = np.asarray(column.stops[start:stop], dtype=np.int64)
+            low, high = int(starts.min()), int(stops.max())
+            f.write(column.blob[low:high].tobytes())
+            spans.append(np.stack([starts, stops], axis=1) + (position - low))
+            position += high - low
+    return np.concatenate(spans).astype(np.uint64) if spans else np.zeros((0, 2), dtype=np.uint64)
+
+
+def compact_store(store_dir):
+    """
+    Rewrite a store without the rows of removed documents. The live rows'
+    vectors, pages and stored text bytes are copied as they are, one
+    document at a time. The new store is written next to the old one and
+    swapped in, so readers never see a half-written directory.
+    """
+    store = open_store(store_dir)
+    live = [doc for doc in store.documents if doc["live"]]
+    ranges = [tuple(doc["rows"]) for doc in live if doc["rows"][1] > doc["rows"][0]]
+    lengths = [stop - start for start, stop in (doc["rows"] for doc in live)]
+    stops = np.cumsum(lengths, dtype=np.int64)
+    documents = [{**doc, "rows": [int(stop - length), int(stop)]} for doc, length, stop in zip(live, lengths, stops)]
+
+    compact_dir = store_dir.rstrip(os.sep) + ".compact"
+    shutil.rmtree(compact_dir, ignore_errors=True)
+    chunking = {key: store.header.get(key) for key in chunking_params()}
+    writer = StoreWriter.create(compact_dir, dtype=store.header["dtype"], model_name=store.header["model_name"],
+                                chunking=chunking)
+    copy_row_ranges(store.embeddings, ranges, os.path.join(compact_dir, "embeddings.bin"))
+    copy_row_ranges(store.chunks.pages, ranges, os.path.join(compact_dir, "chunk_page.bin"))
+    np.repeat(np.arange(len(live), dtype=np.uint32), lengths).tofile(os.path.join(compact_dir, "chunk_doc.bin"))
+    copy_string_ranges(store.chunks.texts, ranges, os.path.join(compact_dir, "text.bin")).tofile(
+        os.path.join(compact_dir, "text.span"))
+    # Section titles never overlap, so the copied ranges end at consecutive offsets
+    section_spans = copy_string_ranges(store.chunks.section_titles, ranges, os.path.join(compact_dir, "section.bin"))
+    np.concatenate([np.zeros(1, dtype=np.uint64), section_spans[:, 1]]).tofile(
+        os.path.join(compact_dir, "section.off"))
+    writer.documents, writer.count, writer.dim = documents, int(sum(lengths)), store.header["dim"]
+    writer.close()
+    index_kind, index_params = saved_index_params(store_dir)
+    del store
+
+    old_dir = store_dir.rstrip(os.sep) + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    os.replace(store_dir, old_dir)
+    os.replace(compact_dir, store_dir)
+    shutil.rmtree(old_dir)
+    print(f"✅ Compacted {store_dir} to {writer.count} rows")
+    build_store_lexical(store_dir)
+    if index_kind != "exact":
+        build_store_index(store_dir, index_kind, **index_params)
+
+
+def update_store(input_dir: str, output_dir: str, dtype: str = "float32", compact_threshold=COMPACT_THRESHOLD,
+                 batch_size: int = DEFAULT_BATCH_SIZE, encode_workers: int = 1, parse_workers: int = PARSE_WORKERS,
+                 write_batch: int = WRITE_BATCH_CHUNKS, chunk_tokens: int = CHUNK_TOKENS,
+                 chunk_overlap: int = CHUNK_OVERLAP):
+    """
+    Bring the store in output_dir up to date with the PDFs in input_dir,
+    embedding only new or changed files. Removed and changed documents are
+    tombstoned; the store is compacted once more than compact_threshold of
+    its rows are dead. The lexical and approximate indexes take only the
+    new rows, with tombstoned rows filtered out at query time; they are
+    rebuilt when the store is compacted. A store built by another model, chunking or format
+    is rebuilt from scratch.
+    """
+    store_dir = os.path.join(output_dir, STORE_DIRNAME)
+    hashes = pdf_hashes(input_dir)
+    chunking = chunking_params(chunk_tokens, chunk_overlap)
+    store = open_store(store_dir) if os.path.exists(os.path.join(store_dir, "header.json")) else None
+    if (store is None or store.header["format_version"] != STORE_FORMAT_VERSION
+            or store.header["model_name"] != MODEL_NAME
+            or any(store.header.get(key) != value for key, value in chunking.items())):
+        print(f"Rebuilding {store_dir} from scratch")
+        index_kind, index_params = saved_index_params(store_dir)
+        embed_and_store(input_dir, output_dir, dtype=dtype, index_kind=index_kind, batch_size=batch_size,
+                        encode_workers=encode_workers, parse_workers=parse_workers, write_batch=write_batch,
+                        chunk_tokens=chunk_tokens, chunk_overlap=chunk_overlap, **index_params)
+        return
+
+    writer = StoreWriter(store_dir, store.documents, store.header["count"], store.header["dim"],
+                         store.header["dtype"], chunking=chunking)
+    live = {doc["filename"]: doc for doc in writer.documents if doc["live"]}
+    removed = [doc for filename, doc in live.items() if hashes.get(filename) != doc["sha256"]]
+    added = [filename for filename, digest in hashes.items()
+             if filename not in live or live[filename]["sha256"] != digest]
+    del store
+    if not removed and not added:
+        print(f"✅ {store_dir} is up to date")
+        if not os.path.exists(os.path.join(store_dir, LEXICAL_META_FILENAME)):
+            build_store_lexical(store_dir)
+        return
+
+    for doc in removed:
+        doc["live"] = False
+    written = ingest_pdfs(writer, input_dir, added, batch_size=batch_size, encode_workers=encode_workers,
+                          parse_workers=parse_workers, write_batch=write_batch)
+    writer.close()
+    print(f"✅ Updated {store_dir}: {len(added)} added/changed, {len(removed)} removed/changed "
+          f"({written} chunks embedded)")
+
+    count, live_count = writer.count, writer.live_count()
+    if count and (count - live_count) / count > compact_threshold:
+        compact_store(store_dir)
+        return
+    update_store_lexical(store_dir)
+    index_kind, index_params = saved_index_params(store_dir)
+    if index_kind != "exact":
+        update_store_index(store_dir, index_kind, **index_params)
+
 
 if __name__ == "__main__":
-    input_dir = sys.argv[1] if len(sys.argv) > 1 else "input/knowledge_base/collection_1"
-    output_dir = sys.argv[2] if len(sys.argv) > 2 else "output"
-    embed_and_store(input_dir, output_dir)
+    parser = argparse.ArgumentParser(description="Build a vector store from a folder of PDFs")
+    parser.add_argument("input_dir", nargs="?", default="input/knowledge_base/collection_1")
+    parser.add_argument("output_dir", nargs="?", default="output")
+    parser.add_argument("--float16", action="store_true", help="Store embeddings as float16 (half the size)")
+    parser.add_argument("--convert", metavar="PKL", help="Convert a legacy vector_store.pkl and exit")
+    parser.add_argument("--index", choices=["exact", "ivf", "hnsw", *QUANTIZED_KINDS], default="exact",
+                        help="Also build an approximate (ivf, hnsw) or quantized (int8, binary) index next to the "
+                             "store (default: exact search only)")
+    parser.add_argument("--nlist", type=int, help="IVF: number of inverted lists (default: sqrt(count))")
+    parser.add_argument("--nprobe", type=int, default=8, help="IVF: lists probed per query")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="HNSW: neighbours per node")
+    parser.add_argument("--ef-search", type=int, default=64, help="HNSW: search beam width")
+    parser.add_argument("--rescore", type=int, default=DEFAULT_RESCORE,
+                        help="int8/binary: candidates per result rescored against the float vectors")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Chunks per encode call (batches hold chunks of similar length)")
+    parser.add_argument("--encode-workers", type=int, default=1,
+                        help="Encode in this many processes, each with its own model and share of the cores")
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS,
+                        help="PDF parsing processes running alongside the embedder")
+    parser.add_argument("--write-batch", type=int, default=WRITE_BATCH_CHUNKS,
+                        help="Chunks embedded and appended to the store at a time")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS,
+                        help="Word pieces per chunk (default: the model's sequence limit)")
+    parser.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP,
+                        help="Word pieces shared by consecutive chunks of a page")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only embed new or changed PDFs; adds their rows to the saved indexes")
+    parser.add_argument("--compact-threshold", type=float, default=COMPACT_THRESHOLD,
+                        help="--incremental: compact once this fraction of rows belongs to removed documents")
+    args = parser.parse_args()
+
+    dtype = "float16" if args.float16 else "float32"
+    if args.index == "ivf":
+        index_params = {"nlist": args.nlist, "nprobe": args.nprobe}
+    elif args.index == "hnsw":
+        index_params = {"hnsw_m": args.hnsw_m, "ef_search": args.ef_search}
+    elif args.index in QUANTIZED_KINDS:
+        index_params = {"rescore": args.rescore}
+    else:
+        index_params = {}
+    if args.convert:
+        store_dir = convert_pickle_store(args.convert, dtype=dtype)
+        if args.index != "exact":
+            build_store_index(store_dir, args.index, **index_params)
+    elif args.incremental:
+        update_store(args.input_dir, args.output_dir, dtype=dtype, compact_threshold=args.compact_threshold,
+                     batch_size=args.batch_size, encode_workers=args.encode_workers,
+                     parse_workers=args.parse_workers, write_batch=args.write_batch,
+                     chunk_tokens=args.chunk_tokens, chunk_overlap=args.chunk_overlap)
+    else:
+        embed_and_store(args.input_dir, args.output_dir, dtype=dtype, index_kind=args.index,
+                        batch_size=args.batch_size, encode_workers=args.encode_workers,
+                        parse_workers=args.parse_workers, write_batch=args.write_batch,
+                        chunk_tokens=args.chunk_tokens, chunk_overlap=args.chunk_overlap, **index_params)
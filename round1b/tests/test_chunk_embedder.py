@@ -0,0 +1,36 @@
+import numpy as np
+import chunk_embedder
+from chunk_embedder import ChunkEncoder, length_buckets
+
+
+class FakeModel:
+    # Embeds each text as [len(text)]; fails if anything tokenizes through it
+    @property
+    def tokenizer(self):
+        raise AssertionError("texts were tokenized again")
+
+    def encode(self, texts, batch_size, show_progress_bar, convert_to_numpy):
+        assert batch_size == len(texts)
+        return np.array([[len(text)] for text in texts], dtype=np.float32)
+
+
+def test_batches_follow_the_given_lengths():
+    texts = ["aaaa", "b", "cc", "ddd"]
+    assert length_buckets(texts, 2) == [[0, 3], [2, 1]]
+    assert length_buckets(texts, 2, lengths=[1, 9, 3, 2]) == [[1, 2], [3, 0]]
+
+
+def test_throughput_comes_from_the_chunk_lengths(monkeypatch, capsys):
+    monkeypatch.setattr(chunk_embedder, "get_model", lambda name: FakeModel())
+    texts = ["one two", "three", "four five six", "seven"]
+    with ChunkEncoder(batch_size=2) as encoder:
+        embeddings = encoder.encode(texts, lengths=[2, 1, 300, 1])
+    assert embeddings[:, 0].tolist() == [len(text) for text in texts]
+    # [CLS] and [SEP] added, the 300-piece text cut to the model's 256
+    assert encoder.reporter.tokens == 4 + 3 + 256 + 3
+    assert "tokens/s" in capsys.readouterr().out
+
+    with ChunkEncoder(batch_size=2) as encoder:
+        encoder.encode(texts)
+    assert encoder.reporter.tokens is None
+    assert "tokens/s" not in capsys.readouterr().out
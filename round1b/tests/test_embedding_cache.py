@@ -0,0 +1,90 @@
+import sqlite3
+import zlib
+import numpy as np
+import pytest
+import embedding_cache
+from embedding_cache import EmbeddingCache
+from model_registry import EMBEDDING_DIM, MODEL_NAME
+
+
+class FakeModel:
+    # A fixed random vector per text, and a record of what was encoded
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.encoded = []
+
+    def encode(self, texts, normalize_embeddings=True):
+        self.encoded.extend(texts)
+        return np.stack([np.random.default_rng(zlib.crc32(text.encode())).standard_normal(self.dim)
+                         for text in texts]).astype(np.float32)
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(embedding_cache, "get_model", lambda name, revision=None: model)
+    return model
+
+
+def test_memory_tier_evicts_the_least_recently_used(model):
+    cache = EmbeddingCache(cache_dir="", memory_size=2)
+    cache.encode(["a", "b"])
+    cache.encode(["a"])
+    cache.encode(["c"])
+    assert list(cache.memory) == [cache.key("a", True), cache.key("c", True)]
+    cache.encode(["b"])
+    assert model.encoded == ["a", "b", "c", "b"]
+
+
+def test_embeddings_persist_across_processes(model, tmp_path):
+    vectors = EmbeddingCache(cache_dir=str(tmp_path)).encode(["plan a trip", "book a hotel"])
+    model.encoded.clear()
+
+    cache = EmbeddingCache(cache_dir=str(tmp_path))
+    assert np.array_equal(cache.encode(["book  a hotel ", "plan a trip"]), vectors[::-1])
+    assert model.encoded == []
+
+
+def test_disk_tier_keeps_the_most_recently_used_rows(model, tmp_path):
+    cache = EmbeddingCache(cache_dir=str(tmp_path), memory_size=1, disk_size=2)
+    for text in ("a", "b", "c"):
+        cache.encode([text])
+    keys = {key for key, in cache.db.execute("SELECT key FROM embeddings")}
+    assert keys == {cache.key("b", True), cache.key("c", True)}
+
+
+def test_keys_separate_models_settings_and_sizes(model):
+    cache = EmbeddingCache(cache_dir="")
+    key = cache.key("Plan a trip", True)
+    assert cache.key("  Plan   a trip\n", True) == key
+    assert cache.key("Plan a trip", False) != key
+    assert cache.key("plan a trip", True) != key
+    assert EmbeddingCache("other-model", cache_dir="").key("Plan a trip", True) != key
+    assert EmbeddingCache(revision="abc123", cache_dir="").key("Plan a trip", True) != key
+    assert EmbeddingCache(cache_dir="", dim=768).key("Plan a trip", True) != key
+
+
+def test_rows_of_another_size_are_ignored(model, tmp_path):
+    cache = EmbeddingCache(cache_dir=str(tmp_path))
+    cache.encode(["plan a trip"])
+    with sqlite3.connect(str(tmp_path / "query_embeddings.sqlite")) as db:
+        db.execute("UPDATE embeddings SET dim = 768, vector = ?", (np.zeros(768, dtype=np.float32).tobytes(),))
+    model.encoded.clear()
+
+    vector = EmbeddingCache(cache_dir=str(tmp_path)).encode(["plan a trip"])[0]
+    assert model.encoded == ["plan a trip"]
+    assert len(vector) == EMBEDDING_DIM
+
+
+def test_model_of_unexpected_size_is_rejected(monkeypatch):
+    monkeypatch.setattr(embedding_cache, "get_model", lambda name, revision=None: FakeModel(768))
+    with pytest.raises(ValueError):
+        EmbeddingCache(MODEL_NAME, cache_dir="").encode(["plan a trip"])
+
+
+def test_cache_dir_is_read_from_the_environment_when_created(model, tmp_path, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_CACHE_DIR", str(tmp_path / "cache"))
+    EmbeddingCache().encode(["plan a trip"])
+    assert (tmp_path / "cache" / "query_embeddings.sqlite").exists()
+    monkeypatch.setenv("EMBEDDING_CACHE_DIR", "")
+    assert EmbeddingCache().db is None
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from rag_pipeline import APPROXIMATE_POOL_FACTOR, SECTION_COUNT, find_sections
+from vector_index import normalize_rows
+from vector_store import build_store_index, open_store, write_store
+
+DIM = 32
+# More near-duplicates than the first hit pool holds
+DUPLICATES = 4 * SECTION_COUNT * APPROXIMATE_POOL_FACTOR
+OTHER_DOCUMENTS = 8
+
+
+@pytest.fixture(scope="module")
+def store_dir(tmp_path_factory):
+    """
+    One document of near-duplicate chunks right next to the query, and a
+    few documents of a handful of chunks each further away.
+    """
+    rng = np.random.default_rng(0)
+    query = normalize_rows(rng.standard_normal((1, DIM)))[0]
+    vectors = [query + 0.01 * rng.standard_normal((DUPLICATES, DIM))]
+    filenames = ["duplicates.pdf"] * DUPLICATES
+    for i in range(OTHER_DOCUMENTS):
+        vectors.append(query + (0.5 + 0.1 * i) * rng.standard_normal((3, DIM)))
+        filenames += [f"other{i}.pdf"] * 3
+    chunks = [{"filename": filename, "page_number": 1, "section_title": "", "text": f"chunk {row}"}
+              for row, filename in enumerate(filenames)]
+    store_dir = str(tmp_path_factory.mktemp("store") / "vector_store")
+    write_store(store_dir, chunks, np.concatenate(vectors).astype(np.float32))
+    return store_dir, query[None, :].astype(np.float32)
+
+
+@pytest.mark.parametrize("kind, params", [("hnsw", {}), ("ivf", {"nprobe": 1}), ("int8", {}), ("binary", {})])
+@pytest.mark.parametrize("mmr", [None, 0.7])
+def test_approximate_index_answers_every_section(store_dir, kind, params, mmr):
+    store_dir, query = store_dir
+    build_store_index(store_dir, kind, **params)
+    store = open_store(store_dir)
+    rows = find_sections(store.chunks, store.open_index(), query, mmr=mmr)[0]
+    filenames = [store.chunks[row]["filename"] for row in rows]
+    assert len(filenames) == SECTION_COUNT
+    assert len(set(filenames)) == SECTION_COUNT
+    assert filenames[0] == "duplicates.pdf"
+
+
+def test_store_with_fewer_documents_than_sections(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((DUPLICATES + 2, DIM)).astype(np.float32)
+    filenames = ["a.pdf"] * DUPLICATES + ["b.pdf", "c.pdf"]
+    chunks = [{"filename": filename, "page_number": 1, "section_title": "", "text": "x"} for filename in filenames]
+    store_dir = str(tmp_path / "vector_store")
+    write_store(store_dir, chunks, vectors)
+    build_store_index(store_dir, "hnsw")
+    store = open_store(store_dir)
+    rows = find_sections(store.chunks, store.open_index(), vectors[:1])[0]
+    assert sorted(store.chunks[row]["filename"] for row in rows) == ["a.pdf", "b.pdf", "c.pdf"]
@@ -0,0 +1,22 @@
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+# Cold-start budget for importing the CLI modules, before any model is used
+IMPORT_TIME_BUDGET_SECONDS = 1.5
+
+
+def test_cli_modules_import_without_loading_model():
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import rag_pipeline, vector_store, persona_embedder, query_server\n"
+        "print(time.perf_counter() - start)\n"
+        "print('sentence_transformers' in sys.modules, 'torch' in sys.modules, 'fitz' in sys.modules)\n"
+    )
+    out = subprocess.run([sys.executable, "-c", code], cwd=SRC_DIR, capture_output=True, text=True, check=True)
+    elapsed, heavy = out.stdout.strip().splitlines()
+    assert heavy == "False False False"
+    assert float(elapsed) < IMPORT_TIME_BUDGET_SECONDS
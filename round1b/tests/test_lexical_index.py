@@ -0,0 +1,109 @@
+import math
+import numpy as np
+import pytest
+from lexical_index import BM25_B, BM25_K1, LexicalIndex, build_lexical_index, tokenize
+from rag_pipeline import federated_sections, fuse_scores, min_max, shard_candidates
+from vector_index import normalize_rows
+from vector_store import build_store_lexical, open_store, write_store
+
+CORPUS = [
+    "Apple banana apple",
+    "banana, cherry!",
+    "cherry cherry CHERRY date",
+]
+
+
+def bm25(idf, freq, length, average_length=3):
+    # Okapi BM25 of one term in one row, as in the textbook formula
+    return idf * freq * (BM25_K1 + 1) / (freq + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+
+
+@pytest.fixture
+def lexical(tmp_path):
+    build_lexical_index(str(tmp_path), enumerate(CORPUS), len(CORPUS))
+    return LexicalIndex(str(tmp_path))
+
+
+def test_tokenize_lowercases_and_splits_on_non_word_characters():
+    assert tokenize("Fill-and-Sign PDFs, 2024!") == ["fill", "and", "sign", "pdfs", "2024"]
+    assert tokenize("Café  déjà_vu") == ["café", "déjà_vu"]
+    assert tokenize(" .,;! ") == []
+
+
+def test_bm25_scores_match_hand_computed_values(lexical):
+    assert lexical.meta["indexed_rows"] == 3
+    assert lexical.meta["average_length"] == 3
+
+    # apple: in 1 of 3 rows, twice in row 0 (3 tokens)
+    scores, rows = lexical.search("apple", 10)
+    assert rows.tolist() == [0]
+    assert np.allclose(scores, [bm25(math.log(1 + 2.5 / 1.5), 2, 3)])
+
+    # banana and cherry: each in 2 of 3 rows
+    idf = math.log(1 + 1.5 / 2.5)
+    scores, rows = lexical.search("Banana cherry", 10)
+    assert rows.tolist() == [1, 2, 0]
+    assert np.allclose(scores, [bm25(idf, 1, 2) * 2, bm25(idf, 3, 4), bm25(idf, 1, 3)])
+
+    # k and ranges limit the hits, not the statistics
+    scores, rows = lexical.search("banana cherry", 1)
+    assert rows.tolist() == [1]
+    scores, rows = lexical.search("banana cherry", 10, ranges=[(0, 1), (2, 3)])
+    assert rows.tolist() == [2, 0]
+    assert np.allclose(scores, [bm25(idf, 3, 4), bm25(idf, 1, 3)])
+
+
+@pytest.mark.parametrize("text", ["", "?!", "zebra", "ZEBRA unicorn"])
+def test_queries_without_indexed_terms_find_nothing(lexical, text):
+    scores, rows = lexical.search(text, 10)
+    assert len(scores) == len(rows) == 0
+    assert rows.dtype == np.int64
+
+
+def test_fusion_min_max_scales_each_score():
+    assert np.allclose(min_max(np.array([2.0, 4.0, 6.0])), [0, 0.5, 1])
+    assert np.allclose(min_max(np.array([0.3, 0.3])), [1, 1])
+    fused = fuse_scores(np.array([0.2, 0.4, 0.6]), np.array([3.0, 0.0, 1.0]), dense_weight=0.7)
+    assert np.allclose(fused, [0.7 * 0 + 0.3 * 1, 0.7 * 0.5 + 0.3 * 0, 0.7 * 1 + 0.3 * (1 / 3)])
+
+
+@pytest.fixture
+def shards(tmp_path):
+    """
+    Two stores of two documents each; only the first has a lexical index.
+    """
+    rng = np.random.default_rng(0)
+    shards = []
+    for number, texts in enumerate([["budget travel tips", "museum opening hours", "budget hotels", "beach"],
+                                    ["budget flights", "castle tours", "budget food", "night life"]]):
+        chunks = [{"filename": f"shard{number}-{row // 2}.pdf", "page_number": 1, "section_title": "", "text": text}
+                  for row, text in enumerate(texts)]
+        store_dir = str(tmp_path / f"store{number}")
+        write_store(store_dir, chunks, normalize_rows(rng.standard_normal((len(texts), 8))).astype(np.float32))
+        if number == 0:
+            build_store_lexical(store_dir)
+        store = open_store(store_dir)
+        shards.append((store.chunks, store.open_index()))
+    return shards
+
+
+def test_shards_without_a_lexical_index_score_zero_bm25(shards):
+    query = {"task": "budget", "persona": "Traveler", "documents": []}
+    embedding = normalize_rows(np.random.default_rng(1).standard_normal((1, 8))).astype(np.float32)
+    assert shards[0][0].lexical_index() is not None and shards[1][0].lexical_index() is None
+
+    _, bm25_scores, rows, _ = shard_candidates((*shards[0], None), query, embedding, 4, hybrid=0.7)
+    assert sorted(rows.tolist()) == [0, 2]
+    assert (bm25_scores > 0).all()
+    _, bm25_scores, rows, documents = shard_candidates((*shards[1], None), query, embedding, 4, hybrid=0.7)
+    assert len(rows) == 2 and len(set(documents.tolist())) == 2
+    assert (bm25_scores == 0).all()
+
+    # Both shards' candidates are ranked by one fusion over all of them
+    per_shard = [shard_candidates((*shard, None), query, embedding, 4, hybrid=0.7) for shard in shards]
+    fused = fuse_scores(np.concatenate([dense for dense, _, _, _ in per_shard]),
+                        np.concatenate([bm25_scores for _, bm25_scores, _, _ in per_shard]), 0.7)
+    candidates = [(shard_number, row)
+                  for shard_number, (_, _, rows, _) in enumerate(per_shard) for row in rows.tolist()]
+    expected = [candidates[i] for i in np.argsort(-fused, kind="stable")]
+    assert federated_sections(shards, query, embedding, sections=4, hybrid=0.7) == expected
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from model_registry import MAX_SEQ_LENGTH, MODEL_NAME
+from pdf_loader import CHUNK_OVERLAP, CHUNK_TOKENS, chunk_string, iter_chunks
+
+# Under the tokenizer's 100-character word limit, but many word pieces long
+LONG_WORD = "qzvxkwjpfyhbgm" * 5
+# Past the limit: a single unknown piece
+HUGE_WORD = "x" * 150
+WORDS = ["budget", "itinerary", "Marseille", "côte", "d'Azur", "fill-and-sign", "e-signatures", "2024,",
+         "onboarding.", "the", "a", "of", "PDF", "Acrobat's", "hors-d'œuvre"]
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    # The model's own tokenizer, if it is already downloaded; never fetched here
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(f"sentence-transformers/{MODEL_NAME}", local_files_only=True)
+    except (ImportError, OSError, ValueError) as e:
+        pytest.skip(f"{MODEL_NAME} tokenizer unavailable: {e}")
+
+
+def make_page(text):
+    return {"filename": "sample.pdf", "page_number": 3, "section_title": "Sample", "text": text}
+
+
+def chunk_pieces(tokenizer, page, max_tokens, overlap):
+    """
+    The page's encoding and, per chunk, the [first, stop) range of the
+    page's word pieces it covers.
+    """
+    encoding = tokenizer(page["text"], add_special_tokens=False, return_offsets_mapping=True)
+    starts = np.array([start for start, _ in encoding["offset_mapping"]])
+    chunks = list(iter_chunks([page], tokenizer, max_tokens=max_tokens, overlap=overlap))
+    assert chunks[0]["char_start"] == 0
+    assert chunks[-1]["char_end"] == encoding["offset_mapping"][-1][1]
+    pieces = []
+    for chunk in chunks:
+        assert (chunk["filename"], chunk["page_number"], chunk["section_title"]) == ("sample.pdf", 3, "Sample")
+        assert chunk["page_text"] is page["text"]
+        assert chunk_string(chunk) == page["text"][chunk["char_start"]:chunk["char_end"]]
+        first, stop = np.searchsorted(starts, [chunk["char_start"], chunk["char_end"]])
+        assert 0 < stop - first <= max_tokens
+        pieces.append((int(first), int(stop)))
+    # Every piece is in some chunk, and each chunk moves forward
+    assert pieces[0][0] == 0 and pieces[-1][1] == len(starts)
+    for (first, stop), (next_first, next_stop) in zip(pieces, pieces[1:]):
+        assert first < next_first <= stop < next_stop
+    return encoding, chunks, pieces
+
+
+def test_chunks_fit_the_model_and_overlap(tokenizer):
+    rng = np.random.default_rng(0)
+    page = make_page(" ".join(rng.choice(WORDS, 500)) + f" {HUGE_WORD} " + " ".join(rng.choice(WORDS, 120)))
+    assert CHUNK_TOKENS == MAX_SEQ_LENGTH - 2 == 254
+    encoding, chunks, pieces = chunk_pieces(tokenizer, page, CHUNK_TOKENS, CHUNK_OVERLAP)
+    word_ids = encoding.word_ids()
+    assert len(chunks) > 2
+
+    for chunk, (first, stop) in zip(chunks, pieces):
+        # Cut on word boundaries, so the chunk tokenizes the same on its own
+        # and fits the model with [CLS] and [SEP]
+        assert first == 0 or word_ids[first] != word_ids[first - 1]
+        assert stop == len(word_ids) or word_ids[stop] != word_ids[stop - 1]
+        ids = tokenizer(chunk_string(chunk))["input_ids"]
+        assert ids[1:-1] == encoding["input_ids"][first:stop]
+        assert len(ids) <= MAX_SEQ_LENGTH
+    # Neighbours share the overlap, plus the start of the word it begins in
+    for (_, stop), (next_first, _) in zip(pieces, pieces[1:]):
+        assert CHUNK_OVERLAP <= stop - next_first < CHUNK_OVERLAP + 16
+    # The word past the tokenizer's limit is one piece, kept whole
+    assert any(HUGE_WORD in chunk_string(chunk) for chunk in chunks)
+
+
+def test_words_longer_than_a_window_are_cut(tokenizer):
+    page = make_page(f"plan a trip {LONG_WORD} to Marseille and Nice")
+    max_tokens, overlap = 16, 4
+    assert len(tokenizer(LONG_WORD, add_special_tokens=False)["input_ids"]) > max_tokens
+    encoding, chunks, pieces = chunk_pieces(tokenizer, page, max_tokens, overlap)
+    starts = [start for start, _ in encoding["offset_mapping"]]
+    long_start = page["text"].index(LONG_WORD)
+    long_stop = long_start + len(LONG_WORD)
+
+    # The window before the word stops at it; windows inside it are full
+    # and share exactly the overlap
+    assert chunk_string(chunks[0]) == "plan a trip"
+    inside = [(first, stop) for first, stop in pieces if long_start <= starts[first] and starts[stop - 1] < long_stop]
+    assert len(inside) >= 2
+    assert all(stop - first == max_tokens for first, stop in inside)
+    for (_, stop), (next_first, _) in zip(inside, inside[1:]):
+        assert stop - next_first == overlap
+    assert chunk_string(chunks[-1]).endswith("to Marseille and Nice")
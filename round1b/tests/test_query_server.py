@@ -0,0 +1,108 @@
+import http.client
+import json
+import threading
+import pytest
+import rag_pipeline
+from query_server import LatencyHistogram, MicroBatcher, QueryHandler, StoreCache, ThreadingHTTPServer
+
+VALID = {"persona": {"role": "Traveler"}, "job_to_be_done": {"task": "Plan a trip"},
+         "documents": [{"filename": "a.pdf"}]}
+
+
+def fake_answer_batch(datas, store_paths, open_store_fn, hybrid=None):
+    # Fails the whole batch if any request in it is bad, like an exception
+    # raised part-way through rag_pipeline.answer_batch
+    return [{"task": data["job_to_be_done"]["task"]} for data in datas]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(rag_pipeline, "answer_batch", fake_answer_batch)
+    stores = StoreCache(["store"])
+    state = {
+        "stores": stores,
+        "batcher": MicroBatcher(stores, max_wait_ms=200),
+        "latency": LatencyHistogram(),
+        "ready": threading.Event(),
+        "quiet": True
+    }
+    state["ready"].set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), QueryHandler)
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, path, body):
+    connection = http.client.HTTPConnection(*server.server_address, timeout=10)
+    connection.request("POST", path, json.dumps(body))
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+@pytest.mark.parametrize("data", [
+    {"job_to_be_done": "oops"},
+    {"job_to_be_done": {"task": 3}},
+    {"job_to_be_done": {"task": "x"}, "persona": "Traveler"},
+    {"job_to_be_done": {"task": "x"}, "documents": ["a.pdf"]},
+    ["not", "an", "object"],
+])
+def test_malformed_requests_are_rejected(data):
+    with pytest.raises(ValueError):
+        rag_pipeline.validate_input(data)
+
+
+def test_valid_request_passes_validation():
+    rag_pipeline.validate_input(VALID)
+    rag_pipeline.validate_input({"job_to_be_done": {"task": "x"}})
+
+
+def test_bad_request_gets_400_without_failing_its_batch(server):
+    results = {}
+
+    def send(name, body):
+        results[name] = post(server, "/query", body)
+
+    threads = [threading.Thread(target=send, args=("bad", {"job_to_be_done": "oops"})),
+               threading.Thread(target=send, args=("good", VALID))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results["bad"][0] == 400
+    assert results["good"] == (200, {"task": "Plan a trip"})
+
+
+def test_failing_request_only_fails_its_own_future(monkeypatch):
+    def answer_batch(datas, store_paths, open_store_fn, hybrid=None):
+        if any(data.get("fail") for data in datas):
+            raise RuntimeError("boom")
+        return fake_answer_batch(datas, store_paths, open_store_fn)
+
+    monkeypatch.setattr(rag_pipeline, "answer_batch", answer_batch)
+    batcher = MicroBatcher(StoreCache(["store"]), max_wait_ms=200)
+    results = {}
+
+    def submit(name, data):
+        try:
+            results[name] = batcher.submit(data, "store")
+        except RuntimeError as e:
+            results[name] = str(e)
+
+    threads = [threading.Thread(target=submit, args=("bad", {**VALID, "fail": True})),
+               threading.Thread(target=submit, args=("good", VALID))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {"bad": "boom", "good": {"task": "Plan a trip"}}
+
+
+def test_failed_reload_is_reported(server, monkeypatch):
+    def reload_changed():
+        raise ValueError("store is half-written")
+
+    monkeypatch.setattr(server.state["stores"], "reload_changed", reload_changed)
+    assert post(server, "/reload", {}) == (500, {"error": "store is half-written"})
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+from vector_index import (ExactIndex, QuantizedIndex, build_index, build_quantized_index, load_index, normalize_rows,
+                          recall_at_k, save_index, segment_maxima)
+
+NUM_ROWS = 2000
+DIM = 64
+
+
+CLUSTER_ROWS = 10
+
+
+@pytest.fixture(scope="module")
+def centers():
+    return normalize_rows(np.random.default_rng(0).standard_normal((NUM_ROWS // CLUSTER_ROWS, DIM)))
+
+
+@pytest.fixture(scope="module")
+def embeddings(centers):
+    # Tight clusters of CLUSTER_ROWS rows, so every query has a clear top 10
+    noise = np.random.default_rng(1).standard_normal((NUM_ROWS, DIM))
+    return normalize_rows(np.repeat(centers, CLUSTER_ROWS, axis=0) + 0.02 * noise).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def queries(centers):
+    noise = np.random.default_rng(2).standard_normal((20, DIM))
+    return normalize_rows(centers[::10] + 0.02 * noise).astype(np.float32)
+
+
+def test_segment_maxima_picks_the_first_best_row_of_each_run():
+    scores = np.array([[0.1, 0.5, 0.5, 0.2, 0.9, 0.3],
+                       [0.7, 0.1, 0.2, 0.4, 0.4, 0.8]], dtype=np.float32)
+    run_scores, run_rows, run_segments = segment_maxima(scores, np.array([3, 3, 3, 5, 5, 3]), offset=10)
+    assert run_segments.tolist() == [3, 5, 3]
+    assert np.allclose(run_scores, [[0.5, 0.9, 0.3], [0.7, 0.4, 0.8]])
+    assert run_rows.tolist() == [[11, 14, 15], [10, 13, 15]]
+
+
+def test_exact_document_maxima_matches_per_document_max(embeddings, queries):
+    segment_ids = np.repeat(np.arange(NUM_ROWS // 50), 50)
+    run_scores, run_rows, run_segments = ExactIndex(embeddings, normalized=True).document_maxima(queries, segment_ids)
+    scores = queries @ embeddings.T
+    for segment, best_scores, best_rows in zip(run_segments, run_scores.T, run_rows.T):
+        rows = np.flatnonzero(segment_ids == segment)
+        assert np.allclose(best_scores, scores[:, rows].max(axis=1))
+        assert np.array_equal(segment_ids[best_rows], np.full(len(queries), segment))
+
+
+@pytest.mark.parametrize("kind", ["int8", "binary"])
+def test_quantized_search_is_rescored_exactly(embeddings, queries, kind):
+    index = build_quantized_index(embeddings, kind, rescore=10)
+    exact = ExactIndex(embeddings, normalized=True)
+    assert recall_at_k(index, exact, queries, 10) >= 0.9
+    scores, ids = index.search(queries, 10)
+    assert np.allclose(scores, np.take_along_axis(queries @ embeddings.T, ids, axis=1), atol=1e-5)
+    assert np.all(np.diff(scores, axis=1) <= 0)
+
+
+def test_int8_scan_matches_without_faiss(embeddings, queries, monkeypatch):
+    index = build_quantized_index(embeddings, "int8", rescore=4)
+    expected = index.search(queries, 10)
+    monkeypatch.setattr(index, "int8_scanner", lambda: None)
+    scores, ids = index.search(queries, 10)
+    assert np.array_equal(ids, expected[1])
+    assert np.allclose(scores, expected[0])
+
+
+def test_quantized_index_over_live_rows_round_trips(tmp_path, embeddings, queries):
+    live_mask = np.ones(NUM_ROWS, dtype=bool)
+    live_mask[::3] = False
+    save_index(build_quantized_index(embeddings, "int8", ids=np.flatnonzero(live_mask)), str(tmp_path))
+
+    index = load_index(str(tmp_path), embeddings, normalized=True, rescore=8)
+    assert isinstance(index, QuantizedIndex)
+    assert index.params["rescore"] == 8
+    _, ids = index.search(queries, 10)
+    assert live_mask[ids].all()
+    exact = ExactIndex(embeddings, normalized=True, live_mask=live_mask)
+    assert recall_at_k(index, exact, queries, 10) >= 0.9
+
+
+@pytest.mark.parametrize("kind, params", [("hnsw", {}), ("ivf", {"nlist": 16, "nprobe": 16}), ("int8", {}),
+                                          ("binary", {})])
+def test_added_rows_are_searched_and_tombstoned_rows_skipped(tmp_path, embeddings, queries, kind, params):
+    half = NUM_ROWS // 2
+    save_index(build_index(embeddings[:half], kind, **params), str(tmp_path), count=half)
+    # Tombstone a few whole clusters of the first half, none of them queried
+    live_mask = np.ones(NUM_ROWS, dtype=bool)
+    live_mask.reshape(-1, CLUSTER_ROWS)[1:half // CLUSTER_ROWS:10] = False
+
+    index = load_index(str(tmp_path), embeddings, normalized=True, live_mask=live_mask)
+    index.add(embeddings, np.arange(half, NUM_ROWS))
+    assert len(index) == NUM_ROWS
+    _, ids = index.search(embeddings[~live_mask][::CLUSTER_ROWS], 10)
+    assert (ids >= 0).all() and live_mask[ids].all()
+    exact = ExactIndex(embeddings, normalized=True, live_mask=live_mask)
+    assert recall_at_k(index, exact, queries, 10) >= 0.9
+
+
+def test_loaded_codes_stay_mapped_until_a_full_scan(tmp_path, embeddings, queries):
+    save_index(build_quantized_index(embeddings, "int8"), str(tmp_path))
+    index = load_index(str(tmp_path), embeddings, normalized=True)
+    assert isinstance(index.codes, np.memmap)
+    assert index._scanner is None
+    index.search(queries, 10, ranges=[(0, 100)])
+    assert index._scanner is None
+    index.search(queries, 10)
+    assert index._scanner is not None
+    assert recall_at_k(index, ExactIndex(embeddings, normalized=True), queries, 10) >= 0.9
@@ -0,0 +1,146 @@
+import os
+import shutil
+import zlib
+import numpy as np
+import pytest
+from lexical_index import LexicalIndex
+from vector_store import (StoreWriter, build_store_lexical, compact_store, open_store, update_store_lexical,
+                          write_store)
+
+DIM = 16
+
+
+def encode(texts):
+    # Stub encoder: a fixed random unit vector per text
+    vectors = np.stack([np.random.default_rng(zlib.crc32(text.encode())).standard_normal(DIM) for text in texts])
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def document_chunks(filename, pages=2):
+    """
+    Chunks of a fake document: two overlapping chunks cut from each page's
+    text, as the chunker produces them.
+    """
+    chunks = []
+    for page_number in range(1, pages + 1):
+        page_text = f"{filename} page {page_number}: " + " ".join(f"word{i}" for i in range(20))
+        middle = len(page_text) // 2
+        for start, stop in ((0, middle + 10), (middle - 10, len(page_text))):
+            chunks.append({"filename": filename, "page_number": page_number, "section_title": f"Section {page_number}",
+                           "text": page_text[start:stop], "page_text": page_text, "char_start": start,
+                           "char_end": stop})
+    return chunks
+
+
+def append_documents(writer, filenames):
+    chunks = [chunk for filename in filenames for chunk in document_chunks(filename)]
+    writer.append(chunks, encode([chunk["text"] for chunk in chunks]),
+                  sha256={filename: f"hash-{filename}" for filename in filenames})
+
+
+def reopen_writer(store_dir):
+    store = open_store(store_dir)
+    return StoreWriter(store_dir, store.documents, store.header["count"], store.header["dim"], store.header["dtype"],
+                       chunking={key: store.header[key] for key in ("chunking_version", "chunk_tokens",
+                                                                   "chunk_overlap")})
+
+
+def live_chunks(store):
+    mask = store.live_mask()
+    rows = range(len(store)) if mask is None else np.flatnonzero(mask)
+    return [store.chunks[row] for row in rows], np.asarray(store.embeddings[list(rows)])
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    store_dir = str(tmp_path / "vector_store")
+    writer = StoreWriter.create(store_dir)
+    append_documents(writer, ["a.pdf", "b.pdf"])
+    writer.close()
+    return store_dir
+
+
+def test_overlapping_chunks_share_their_page_text(store_dir):
+    store = open_store(store_dir)
+    chunks = [chunk for filename in ("a.pdf", "b.pdf") for chunk in document_chunks(filename)]
+    assert [store.chunks[i]["text"] for i in range(len(store))] == [chunk["text"] for chunk in chunks]
+    page_texts = {chunk["page_text"] for chunk in chunks}
+    assert os.path.getsize(os.path.join(store_dir, "text.bin")) == sum(len(text.encode()) for text in page_texts)
+
+
+def test_tombstoned_rows_leave_the_live_mask_and_search(store_dir):
+    writer = reopen_writer(store_dir)
+    writer.documents[0]["live"] = False
+    append_documents(writer, ["a.pdf", "c.pdf"])
+    writer.close()
+
+    store = open_store(store_dir)
+    assert len(store) == 16
+    assert store.header["live_count"] == 12
+    assert store.live_mask().tolist() == [False] * 4 + [True] * 12
+    assert [(doc["filename"], doc["rows"], doc["live"]) for doc in store.documents] == [
+        ("a.pdf", [0, 4], False), ("b.pdf", [4, 8], True), ("a.pdf", [8, 12], True), ("c.pdf", [12, 16], True)
+    ]
+    _, ids = store.open_index().search(np.asarray(store.embeddings[:4]), 16)
+    assert not (set(ids.ravel().tolist()) & {0, 1, 2, 3})
+
+
+def test_documents_without_chunks_are_recorded(store_dir):
+    writer = reopen_writer(store_dir)
+    writer.append([], np.zeros((0, DIM), dtype=np.float32), sha256={"blank.pdf": "hash-blank"})
+    writer.close()
+
+    store = open_store(store_dir)
+    assert store.documents[-1] == {"filename": "blank.pdf", "rows": [8, 8], "sha256": "hash-blank", "live": True}
+    assert len(store) == 8
+
+
+def test_compaction_keeps_live_rows_and_drops_tombstones(store_dir):
+    writer = reopen_writer(store_dir)
+    writer.documents[0]["live"] = False
+    append_documents(writer, ["c.pdf"])
+    writer.append([], np.zeros((0, DIM), dtype=np.float32), sha256={"blank.pdf": "hash-blank"})
+    writer.close()
+    expected_chunks, expected_embeddings = live_chunks(open_store(store_dir))
+
+    compact_store(store_dir)
+    store = open_store(store_dir)
+    assert store.live_mask() is None
+    assert not os.path.exists(store_dir + ".compact") and not os.path.exists(store_dir + ".old")
+    assert [(doc["filename"], doc["rows"]) for doc in store.documents] == [
+        ("b.pdf", [0, 4]), ("c.pdf", [4, 8]), ("blank.pdf", [8, 8])
+    ]
+    chunks, embeddings = live_chunks(store)
+    assert chunks == expected_chunks
+    assert np.array_equal(embeddings, expected_embeddings)
+
+    # Page texts are still stored once, not once per overlapping chunk
+    fresh_dir = store_dir + ".fresh"
+    fresh_chunks = document_chunks("b.pdf") + document_chunks("c.pdf")
+    write_store(fresh_dir, fresh_chunks, encode([chunk["text"] for chunk in fresh_chunks]))
+    for name in ("text.bin", "text.span", "section.bin", "section.off"):
+        with open(os.path.join(store_dir, name), "rb") as f, open(os.path.join(fresh_dir, name), "rb") as g:
+            assert f.read() == g.read(), name
+
+
+def test_incremental_update_matches_a_rebuilt_lexical_index(store_dir):
+    build_store_lexical(store_dir)
+    writer = reopen_writer(store_dir)
+    writer.documents[0]["live"] = False
+    append_documents(writer, ["a.pdf", "c.pdf"])
+    writer.close()
+    update_store_lexical(store_dir)
+
+    rebuilt_dir = store_dir + ".rebuilt"
+    shutil.copytree(store_dir, rebuilt_dir)
+    build_store_lexical(rebuilt_dir)
+    updated, rebuilt = LexicalIndex(store_dir), LexicalIndex(rebuilt_dir)
+    # Same statistics; term ids differ by the order terms were first seen
+    assert {**updated.meta, "terms": None} == {**rebuilt.meta, "terms": None}
+    assert sorted(updated.meta["terms"]) == sorted(rebuilt.meta["terms"])
+    for text in ("a.pdf page 1", "word3 word17", "c.pdf", "missing"):
+        scores, rows = updated.search(text, 100)
+        expected_scores, expected_rows = rebuilt.search(text, 100)
+        assert sorted(rows.tolist()) == sorted(expected_rows.tolist())
+        assert np.allclose(np.sort(scores), np.sort(expected_scores))
+        assert not set(rows.tolist()) & {0, 1, 2, 3}